@@ -0,0 +1,611 @@
+#!/usr/bin/env python
+
+# Generates random modules, writes them, reads them back and writes them
+# again, checking that the two encodings are identical and reporting the
+# rate at which modules are decoded and encoded for each kind of module.
+
+import copy, os, pickle, random, sys, tempfile, time
+from cStringIO import StringIO
+
+import asm
+import builder
+import diff
+import dis
+import emitter
+import layout
+import opcodes
+import pack
+import pgo
+import strip
+from opcodes import Imm, LOfp, LOmp, NoOp, SOfp, SOmp, SOSOfp, SOSOmp
+
+# Values at the limits of the 1, 2 and 4 byte encodings of OP values.
+boundaries = [0, -1, 1, 63, 64, -64, -65, 8191, 8192, -8192, -8193,
+              0x1fffffff, -0x20000000]
+
+# The address modes of source and destination operands and those of middle
+# operands.
+operand_modes = ["LOmp", "LOfp", "Imm", "SOSOmp", "SOSOfp", "NoOp"]
+middle_modes = ["Imm", "SOfp", "SOmp", "NoOp"]
+
+# The number of values in the arrays of data items, including the empty and
+# longest arrays whose sizes are held in their headers.
+data_counts = [0, 1, 15, 16, 17, 100]
+
+
+# A listing of a small module to be assembled.
+listing = """
+0x0: load 0(mp), $0x0, 48(fp)
+0x1: movw $0x0, 40(fp)
+0x2: blew $0x7b, 40(fp), $0x5
+0x3: addw $0x1, 40(fp)
+0x4: jmp $0x2
+0x5: ret
+
+entry 0x0, 1
+desc $0x0, 8, "c0"
+desc $0x1, 56, "00c8"
+
+var @mp, 8
+string @mp+0, "$Sys"
+
+module count
+
+link 0x0, 1, 0x4244b354, "init"
+
+ldts @ldt, 0
+
+source "/tmp/countmin.b"
+"""
+
+
+def op_value(r):
+
+    if r.random() < 0.5:
+        return r.choice(boundaries)
+    return r.randint(-0x20000000, 0x1fffffff)
+
+def short_value(r):
+
+    # Double indirect offsets are written as unsigned 16-bit values.
+    return r.choice([0, 63, 64, 8191, 8192, 0xffff, r.randint(0, 0xffff)])
+
+def operand(r, mode):
+
+    if mode == "NoOp":
+        return NoOp()
+    elif mode == "SOSOmp":
+        return SOSOmp(short_value(r), short_value(r))
+    elif mode == "SOSOfp":
+        return SOSOfp(short_value(r), short_value(r))
+    
+    return getattr(opcodes, mode)(op_value(r))
+
+def instruction(r, class_, source = None, middle = None, destination = None):
+
+    """Returns an instance of the instruction class with operands using the
+    given address modes, or random ones where they are not given."""
+    
+    source = operand(r, source or r.choice(operand_modes))
+    middle = operand(r, middle or r.choice(middle_modes))
+    destination = operand(r, destination or r.choice(operand_modes))
+    
+    return opcodes.create(class_, source, middle, destination)
+
+def text(r, length = 8):
+
+    # Names are terminated by zero bytes, so they cannot contain them.
+    return "".join(chr(r.randint(1, 255)) for i in range(length))
+
+def value(r, array_type):
+
+    if array_type == 1:
+        return r.randint(0, 255)
+    elif array_type == 2:
+        return r.choice([0, -1, -0x80000000, 0x7fffffff,
+                         r.randint(-0x80000000, 0x7fffffff)])
+    elif array_type == 3:
+        return chr(r.randint(0, 255))
+    elif array_type == 4:
+        return r.choice([0.0, -0.0, 1e308, -1e-308, float("inf"),
+                         r.uniform(-1e9, 1e9)])
+    else:
+        return r.choice([0, -1, -2**63, 2**63 - 1,
+                         r.randint(-2**63, 2**63 - 1)])
+
+
+class Generator:
+
+    """Creates random modules, using the Random object, r."""
+    
+    def __init__(self, r):
+    
+        self.r = r
+    
+    def module(self, code = 50, types = 4, data = 20, arrays = 0,
+                     links = 4, ldt = 2, exceptions = 0, signed = False):
+    
+        r = self.r
+        d = dis.Dis()
+        d.file_name = None
+        
+        flags = r.choice([0, dis.RuntimeFlag.SHAREMP,
+                          dis.RuntimeFlag.MUSTCOMPILE])
+        if ldt is not None:
+            flags |= dis.RuntimeFlag.HASLDT
+        if exceptions:
+            flags |= dis.RuntimeFlag.HASEXCEPT
+        d.runtime_flag = dis.RuntimeFlag(flags)
+        
+        d.signed = signed
+        if signed:
+            d.signature = "".join(chr(r.randint(0, 255))
+                                  for i in range(r.randint(0, 300)))
+        
+        d.stack_extent = op_value(r)
+        d.data_size = op_value(r)
+        d.entry_pc = op_value(r)
+        d.entry_type = op_value(r)
+        
+        d.code = [instruction(r, r.choice(opcodes.instructions))
+                  for i in range(code)]
+        
+        d.types = []
+        for i in range(max(types, 1)):
+            pointers = text(r, r.choice([0, 1, 2, 63, 64]))
+            d.types.append(dis.Type(op_value(r), op_value(r), pointers))
+        
+        self.used = set()
+        d.data = {}
+        d.data_items = []
+        d.arrays = []
+        
+        for i in range(data):
+            self.data_item(d, 0)
+        
+        for i in range(arrays):
+            d.arrays.append(self.array(d, 1))
+        
+        d.module_name = text(r)
+        d.link = [dis.Link(op_value(r), op_value(r),
+                           r.randint(-0x80000000, 0x7fffffff), text(r))
+                  for i in range(links)]
+        
+        d.initialised_globals = op_value(r)
+        d.ldt = []
+        for i in range(ldt or 0):
+            d.ldt.append([dis.LDT(r.randint(0, 0xffffffff), text(r))
+                          for j in range(r.randint(1, 5))])
+        
+        d.exceptions = []
+        for i in range(exceptions):
+            pcs = [(text(r), op_value(r)) for j in range(r.randint(0, 4))]
+            d.exceptions.append(dis.ExceptionInfo(
+                op_value(r), op_value(r), op_value(r),
+                r.choice([-1, op_value(r)]), r.randint(0, 0x1000) << 16,
+                pcs, r.choice([-1, op_value(r)])))
+        
+        d.path = text(r, 20)
+        return d
+    
+    def address(self, base):
+    
+        # Choose an offset that gives an unused address for the base.
+        while True:
+            offset = self.r.choice([0, 63, 64, 8191, 8192, self.r.randint(
+                0, max(0, 0x1fffffff - base))])
+            if base + offset not in self.used:
+                self.used.add(base + offset)
+                return offset
+    
+    def data_item(self, d, base, type_ = None):
+    
+        r = self.r
+        array_type = r.choice([1, 2, 3, 4, 8])
+        array = [value(r, array_type) for i in range(r.choice(data_counts))]
+        
+        item = dis.Data(base, self.address(base), array_type, type_, array)
+        d.data[base + item.offset] = item
+        d.data_items.append(item)
+        return item
+    
+    def array(self, d, depth):
+    
+        """Returns an array, defined at the given depth, that may contain
+        data items and other arrays."""
+        
+        r = self.r
+        offset = self.address(0)
+        
+        if r.random() < 0.2:
+            # An array that only sets the base address of its items.
+            array = dis.Array(offset, index = 0)
+            type_ = None
+        else:
+            type_index = r.randrange(len(d.types))
+            array = dis.Array(offset, type_index, r.randint(0, 1000))
+            type_ = d.types[type_index]
+            
+            # Some arrays are not initialised.
+            if r.random() < 0.2:
+                return array
+            array.index = r.choice([0, r.randint(0, 0x1000)])
+        
+        base = offset + array.index
+        
+        for i in range(r.randint(0, 8)):
+            if depth < 3 and r.random() < 0.2:
+                array.items.append(self.array(d, depth + 1))
+            else:
+                array.items.append(self.data_item(d, base, type_))
+        
+        return array
+
+
+def every_opcode(g):
+
+    # Include each instruction in every combination of address modes that it
+    # can use.
+    d = g.module(code = 0)
+    
+    for class_ in opcodes.instructions:
+        for source in operand_modes:
+            for middle in middle_modes:
+                for destination in operand_modes:
+                    d.code.append(instruction(g.r, class_, source, middle,
+                                              destination))
+    return d
+
+def boundary_values(g):
+
+    # Use every boundary value for every operand that holds an OP value.
+    d = g.module(code = 0, links = 0)
+    
+    for value in boundaries:
+        for mode in "LOmp", "LOfp", "Imm":
+            d.code.append(opcodes.movw(getattr(opcodes, mode)(value),
+                                       getattr(opcodes, mode)(value)))
+        for mode in "Imm", "SOfp", "SOmp":
+            d.code.append(opcodes.addw(Imm(value),
+                                       getattr(opcodes, mode)(value),
+                                       LOfp(value)))
+        d.link.append(dis.Link(value, value, value, text(g.r)))
+    
+    return d
+
+def stripped_arrays(g):
+
+    # Strip and rearrange a module with arrays, checking that the types used
+    # by the arrays are kept and that the pointers to them are not moved.
+    d = g.module(code = 0, types = 20, data = 10, arrays = 10, exceptions = 0)
+    
+    d.entry_type = 0
+    for link in d.link:
+        link.desc_number = 0
+    d.data_size = d.types[0].size = 0x1000
+    
+    arrays = strip.nested_arrays(d.arrays)
+    types = [(array, d.types[array.type_index]) for array in arrays
+             if array.type_index is not None]
+    offsets = [(array, array.offset) for array in arrays]
+    
+    strip.strip(d)
+    
+    if layout.layout(d):
+        raise AssertionError("module data containing arrays was rearranged")
+    
+    for array, type_ in types:
+        if d.types[array.type_index] is not type_:
+            raise AssertionError("array type was not renumbered")
+    
+    for array, offset in offsets:
+        if array.offset != offset or d.data_size != 0x1000:
+            raise AssertionError("array pointer was moved")
+    
+    return d
+
+def pickled_module(g):
+
+    # Pickle and copy an assembled module, which was not read from a file,
+    # checking that it is unchanged, including attributes that are not held
+    # in the compact form used to pickle it.
+    d = asm.assemble(listing)
+    d.note = g.r.random()
+    
+    copies = [pickle.loads(pickle.dumps(d, protocol)) for protocol in 0, 2]
+    copies += [copy.copy(d), copy.deepcopy(d)]
+    
+    for e in copies:
+        if encode(e) != encode(d) or e.note != d.note:
+            raise AssertionError("pickled module differs from the original")
+    
+    return copies[-1]
+
+def listed_module(g):
+
+    # List a module containing strings with quotes, backslashes and other
+    # characters that are escaped, then assemble the listing, checking that
+    # the result is the same as the original.
+    d = asm.assemble(listing)
+    quoted = [text(g.r, 10) + "'\"\\," for i in range(4)]
+    
+    d.data[0].array = list(quoted[0])
+    d.link[0].name = quoted[1]
+    d.ldt = [[dis.LDT(0x1234, quoted[2])]]
+    d.initialised_globals = 1
+    d.exceptions = [dis.ExceptionInfo(0, 0, 5, -1, 1 << 16, [[quoted[3], 3]],
+                                      5)]
+    d.runtime_flag.value |= dis.RuntimeFlag.HASEXCEPT
+    d.path = "".join(quoted)
+    
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        d.list()
+        lines = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    
+    e = asm.assemble(lines)
+    if encode(e) != encode(d):
+        raise AssertionError("assembled listing differs from the original")
+    
+    return e
+
+def emitted_module(g):
+
+    # Write a module containing arrays with an Emitter, checking that the
+    # module read from the result is the same as the original.
+    d = g.module(exceptions = 2, arrays = 10)
+    
+    f = StringIO()
+    e = emitter.Emitter(f, d.stack_extent, d.runtime_flag.value)
+    
+    for ins in d.code:
+        e.emit(ins)
+    for type_ in d.types:
+        e.add_type(type_)
+    
+    entries = [(item.offset, 0, item) for item in d.data_items
+               if item.base == 0]
+    entries += [(array.offset, 1, array) for array in d.arrays]
+    
+    for offset, kind, entry in sorted(entries):
+        if kind == 0:
+            e.add_data(entry)
+        else:
+            e.add_array(entry)
+    
+    for link in d.link:
+        e.add_link(link)
+    
+    e.data_size = d.data_size
+    e.entry_pc = d.entry_pc
+    e.entry_type = d.entry_type
+    e.module_name = d.module_name
+    e.path = d.path
+    e.ldt = d.ldt
+    e.initialised_globals = d.initialised_globals
+    e.exceptions = d.exceptions
+    e.finish()
+    
+    emitted = decode(f.getvalue())
+    if encode(emitted) != encode(d):
+        raise AssertionError("emitted module differs from the original")
+    
+    # Items in arrays cannot be added on their own.
+    for item in d.data_items:
+        if item.base != 0:
+            try:
+                e.add_data(item)
+            except emitter.EmitError:
+                break
+            raise AssertionError("item in an array was emitted on its own")
+    
+    return emitted
+
+def library_module(g):
+
+    # Strip a module without an entry point, which uses -1 for its entry pc
+    # and type, as library modules do, load it into a builder, reorder its
+    # code and compare it with itself, checking that the entry point and
+    # type are unchanged.
+    d = asm.assemble(listing.replace("entry 0x0, 1", "entry -0x1, -1"))
+    d.link[0].desc_number = -1
+    
+    strip.strip(d)
+    
+    if d.entry_type != -1 or d.link[0].desc_number != -1:
+        raise AssertionError("type numbers of library module were changed")
+    
+    # Load the code into a builder and resolve it again.
+    before = encode(d)
+    builder.load(d).resolve(d)
+    
+    if d.entry_pc != -1 or encode(d) != before:
+        raise AssertionError("library module was changed by the builder")
+    
+    # Reorder the code so that the branch out of the loop falls through.
+    counts = {0: 1, 1: 1, 2: 100, 3: 1, 4: 1, 5: 100}
+    if not pgo.reorder(d, counts) or d.entry_pc != -1 or \
+       d.link[0].pc != 0 or not isinstance(d.code[3], opcodes.ret):
+        raise AssertionError("library module was not reordered")
+    
+    # The builder uses its own class of immediate operands for branch
+    # targets, so return the module as it is read from a file.
+    e = decode(encode(d))
+    
+    if diff.diff(e, decode(encode(d))).header:
+        raise AssertionError("identical library modules differ")
+    
+    return e
+
+def packed_module(g):
+
+    # Pickle a module loaded from a pack file, which decodes its sections
+    # from the mapped file, checking that it is unchanged.
+    d = g.module(exceptions = 2, arrays = 2)
+    d.code_size = len(d.code)
+    d.type_size = len(d.types)
+    d.link_size = len(d.link)
+    
+    handle, file_name = tempfile.mkstemp(".pack")
+    os.close(handle)
+    
+    try:
+        writer = pack.PackWriter(open(file_name, "wb"))
+        writer.add(d, "module")
+        writer.close()
+        writer.f.close()
+        
+        p = pack.Pack(file_name)
+        m = p[0]
+        copies = [pickle.loads(pickle.dumps(m, protocol)) for protocol in 0, 2]
+        
+        for e in [m] + copies:
+            if encode(e) != encode(d):
+                raise AssertionError("packed module differs from the original")
+        p.close()
+    
+    finally:
+        os.remove(file_name)
+    
+    return copies[-1]
+
+cases = [
+    ("opcodes", every_opcode),
+    ("boundaries", boundary_values),
+    ("data", lambda g: g.module(code = 10, data = 60)),
+    ("arrays", lambda g: g.module(code = 10, data = 10, arrays = 10)),
+    ("no ldt", lambda g: g.module(ldt = None)),
+    ("empty ldt", lambda g: g.module(ldt = 0)),
+    ("exceptions", lambda g: g.module(exceptions = 5)),
+    ("stripped", stripped_arrays),
+    ("pickled", pickled_module),
+    ("packed", packed_module),
+    ("library", library_module),
+    ("emitted", emitted_module),
+    ("listed", listed_module),
+    ("signed", lambda g: g.module(exceptions = 2, arrays = 2, signed = True)),
+    ("large", lambda g: g.module(code = 20000, types = 200, data = 2000,
+                                 arrays = 50, links = 200, ldt = 20))
+    ]
+
+
+def encode(d):
+
+    f = StringIO()
+    d.write(f)
+    return f.getvalue()
+
+def decode(data):
+
+    d = dis.Dis()
+    d.read(StringIO(data))
+    return d
+
+def compare(first, second):
+
+    """Returns None if the strings are equal or a message describing the
+    first difference between them."""
+    
+    if first == second:
+        return None
+    
+    i = 0
+    while i < min(len(first), len(second)) and first[i] == second[i]:
+        i += 1
+    
+    return "encodings differ at offset 0x%x (lengths %i and %i)" % (
+        i, len(first), len(second))
+
+def run(name, function, seed, iterations):
+
+    """Round-trips the given number of modules created by the function,
+    returning a list of failures and a dictionary of statistics."""
+    
+    failures = []
+    size = 0
+    decode_time = encode_time = 0.0
+    
+    for i in range(iterations):
+    
+        case_seed = "%s:%s:%i" % (seed, name, i)
+        
+        try:
+            d = function(Generator(random.Random(case_seed)))
+            first = encode(d)
+            
+            t0 = time.time()
+            e = decode(first)
+            t1 = time.time()
+            second = encode(e)
+            t2 = time.time()
+            
+            problem = compare(first, second)
+            if problem is None and \
+               [ins.key() for ins in d.code] != [ins.key() for ins in e.code]:
+                problem = "decoded instructions differ"
+        
+        except Exception, exception:
+            problem = "%s: %s" % (exception.__class__.__name__, exception)
+        
+        if problem:
+            failures.append("%s (seed %s)" % (problem, repr(case_seed)))
+            continue
+        
+        size += len(first)
+        decode_time += t1 - t0
+        encode_time += t2 - t1
+    
+    return failures, (size, decode_time, encode_time)
+
+def rate(size, seconds):
+
+    if seconds == 0:
+        return "-"
+    return "%.2f" % (size / seconds / 1048576)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 3:
+        sys.stderr.write("Usage: %s [<seed> [<iterations>]]\n" % sys.argv[0])
+        sys.exit(1)
+    
+    if len(sys.argv) > 1:
+        seed = sys.argv[1]
+    else:
+        seed = str(random.randrange(1000000))
+    
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+    else:
+        iterations = 20
+    
+    print "Seed %s, %i modules per case" % (seed, iterations)
+    print
+    print "%-12s %10s %12s %12s" % ("Case", "Bytes", "Decode MB/s",
+                                    "Encode MB/s")
+    
+    failed = 0
+    
+    for name, function in cases:
+    
+        failures, (size, decode_time, encode_time) = \
+            run(name, function, seed, iterations)
+        
+        print "%-12s %10i %12s %12s" % (name, size, rate(size, decode_time),
+                                        rate(size, encode_time))
+        
+        for failure in failures:
+            print "  FAILED:", failure
+        
+        failed += len(failures)
+    
+    if failed:
+        print
+        print "%i round trips failed." % failed
+        sys.exit(1)
+    
+    sys.exit()
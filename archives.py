@@ -0,0 +1,105 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fnmatch, gzip, os, tarfile, zipfile
+from cStringIO import StringIO
+
+import dis
+
+# File name suffixes of the supported archives.
+tar_suffixes = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2")
+zip_suffixes = (".zip",)
+gzip_suffixes = (".gz",)
+
+
+def is_archive(path):
+
+    """Returns True if the file with the given path is an archive that can
+    be read by the members function."""
+    
+    path = path.lower()
+    
+    for suffix in tar_suffixes + zip_suffixes + gzip_suffixes:
+        if path.endswith(suffix):
+            return True
+    
+    return False
+
+def members(path, pattern = "*.dis"):
+
+    """Yields (name, data) pairs for the files in the archive with the given
+    path whose paths within the archive match the pattern, where each name is
+    the path of the archive joined to the path of the file within it and data
+    is its contents.
+    
+    Tar files are read as streams so that each file is only held in memory
+    while it is being used. A gzip file that does not contain a tar file is
+    treated as an archive containing a single file."""
+    
+    lower = path.lower()
+    
+    if lower.endswith(tar_suffixes):
+        return tar_members(path, pattern)
+    elif lower.endswith(zip_suffixes):
+        return zip_members(path, pattern)
+    elif lower.endswith(gzip_suffixes):
+        return gzip_members(path, pattern)
+    else:
+        raise dis.DisError("Unsupported archive '%s'." % path)
+
+def tar_members(path, pattern):
+
+    tf = tarfile.open(path, "r|*")
+    try:
+        for info in tf:
+            if info.isfile() and fnmatch.fnmatch(info.name, pattern):
+                yield os.path.join(path, info.name), \
+                      tf.extractfile(info).read()
+    finally:
+        tf.close()
+
+def zip_members(path, pattern):
+
+    zf = zipfile.ZipFile(path)
+    try:
+        for info in zf.infolist():
+            if not info.filename.endswith("/") and \
+               fnmatch.fnmatch(info.filename, pattern):
+                yield os.path.join(path, info.filename), zf.read(info)
+    finally:
+        zf.close()
+
+def gzip_members(path, pattern):
+
+    name = os.path.basename(path)[:-len(".gz")]
+    
+    if fnmatch.fnmatch(name, pattern):
+        gf = gzip.GzipFile(path, "rb")
+        try:
+            yield os.path.join(os.path.dirname(path), name), gf.read()
+        finally:
+            gf.close()
+
+def read_archive(path, pattern = "*.dis"):
+
+    """Yields (name, Dis object) pairs for the modules in the archive with the
+    given path whose paths within the archive match the pattern."""
+    
+    for name, data in members(path, pattern):
+        d = dis.Dis()
+        d.read(StringIO(data), name)
+        yield name, d
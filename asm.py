@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re, sys
+
+import dis
+import opcodes
+
+# Operands take the forms $value, N(fp), N(mp), N(M(fp)) and N(M(mp)), where
+# the value of an immediate operand may also be the name of a label.
+operand_re = re.compile(r"\$(?P<imm>\S+)$|(?P<offset>-?\d+)\("
+                        r"(?:(?P<inner>-?\d+)\((?P<reg2>fp|mp)\)|(?P<reg>fp|mp))"
+                        r"\)$")
+
+# Lines may start with a label or the pc printed by the Dis.list method.
+label_re = re.compile(r"([A-Za-z_.][\w.]*|0x[0-9a-fA-F]+|\d+):\s*")
+
+address_re = re.compile(r"@(mp|ldt)\+?(-?\d*)$")
+
+# Strings are written by the dbl_repr function, with backslashes escaping the
+# double quotes they contain.
+string_re = re.compile(r'"((?:[^"\\]|\\.)*)"$')
+
+number_re = re.compile(r"-?(0x[0-9a-fA-F]+|\d+)$")
+
+# Operand layouts of the instruction classes.
+NONE, ONE, SRC_DST, SRC_SRC, THREE = range(5)
+
+# Map instruction names to classes and their operand layouts, accepting names
+# with and without the underscore used to avoid clashes with Python keywords.
+instruction_classes = {}
+for class_ in opcodes.instructions:
+
+    if issubclass(class_, opcodes.Src_Src_Dst) or \
+       issubclass(class_, opcodes.Src_Src_Src):
+        shape = THREE
+    elif issubclass(class_, opcodes.Src_Dst):
+        shape = SRC_DST
+    elif issubclass(class_, opcodes.Src_Src):
+        shape = SRC_SRC
+    elif issubclass(class_, opcodes.Src) or issubclass(class_, opcodes.Dst):
+        shape = ONE
+    else:
+        shape = NONE
+    
+    instruction_classes[class_.__name__] = (class_, shape)
+    instruction_classes[class_.__name__.rstrip("_")] = (class_, shape)
+
+
+class AsmError(Exception):
+    pass
+
+
+def assign(obj, attribute, value):
+
+    if isinstance(attribute, int):
+        obj[attribute] = value
+    else:
+        setattr(obj, attribute, value)
+
+
+class Assembler:
+
+    """Assembles the text produced by the Dis.list method, and hand-written
+    text in the same form, into a Dis object.
+    
+    Labels can be defined at the start of a line, as in "loop:", and used as
+    immediate operands, as in "jmp $loop". References to labels that are
+    defined later are recorded and patched when the input has been read."""
+    
+    def __init__(self, stack_extent = 0):
+    
+        self.stack_extent = stack_extent
+        
+        self.directives = {
+            "entry": self.entry,
+            "desc": self.desc,
+            "var": self.var,
+            "byte": lambda args: self.data_item(1, args),
+            "word": lambda args: self.data_item(2, args),
+            "string": lambda args: self.data_item(3, args),
+            "real": lambda args: self.data_item(4, args),
+            "long": lambda args: self.data_item(8, args),
+            "module": self.module,
+            "link": self.link,
+            "ldts": self.ldts,
+            "ext": self.ext,
+            "exceptions": self.exceptions,
+            "exception": self.exception,
+            "except": self.except_,
+            "source": self.source
+            }
+    
+    def error(self, message):
+    
+        return AsmError(message + " at line %i." % self.line_number)
+    
+    def assemble(self, lines):
+    
+        """Assembles the lines of text, returning a Dis object."""
+        
+        d = self.d = dis.Dis()
+        d.file_name = None
+        d.runtime_flag = dis.RuntimeFlag(0)
+        d.stack_extent = self.stack_extent
+        d.data_size = 0
+        d.entry_pc = 0
+        d.entry_type = 0
+        d.code = []
+        d.types = []
+        d.data = {}
+        d.data_items = []
+        d.module_name = ""
+        d.link = []
+        d.ldt = []
+        d.initialised_globals = 0
+        d.exceptions = []
+        d.path = ""
+        
+        self.labels = {}
+        self.fixups = []
+        self.operands = {}
+        self.middle_operands = {}
+        
+        directives = self.directives
+        code = d.code
+        line_number = 0
+        
+        for line in lines:
+        
+            line_number += 1
+            line = line.strip()
+            
+            if not line or line[0] == "#":
+                continue
+            
+            # Only use the regular expression for lines that may have labels.
+            if ":" in line:
+                match = label_re.match(line)
+                if match:
+                    name = match.group(1)
+                    if not number_re.match(name):
+                        self.labels[name] = len(code)
+                    line = line[match.end():]
+                    if not line:
+                        continue
+            
+            pieces = line.split(None, 1)
+            name = pieces[0]
+            
+            if len(pieces) == 2:
+                args = pieces[1]
+            else:
+                args = ""
+            
+            self.line_number = line_number
+            
+            handler = directives.get(name)
+            if handler:
+                handler(args)
+            else:
+                code.append(self.instruction(name, args))
+        
+        self.resolve()
+        
+        if d.ldt or d.initialised_globals:
+            d.runtime_flag.value |= dis.RuntimeFlag.HASLDT
+        
+        if d.exceptions:
+            d.runtime_flag.value |= dis.RuntimeFlag.HASEXCEPT
+        
+        d.code_size = len(d.code)
+        d.type_size = len(d.types)
+        d.link_size = len(d.link)
+        
+        return d
+    
+    def resolve(self):
+    
+        for line_number, obj, attribute, name in self.fixups:
+            try:
+                assign(obj, attribute, self.labels[name])
+            except KeyError:
+                self.line_number = line_number
+                raise self.error("Undefined label '%s'" % name)
+        
+        for exception in self.d.exceptions:
+            exception.pcs = map(tuple, exception.pcs)
+    
+    def value(self, text, obj, attribute):
+    
+        """Sets the attribute of the object, or the item of a list if the
+        attribute is an index, to the number or label given in the text,
+        recording a fixup if the label is not yet defined."""
+        
+        if number_re.match(text):
+            assign(obj, attribute, int(text, 0))
+        elif text in self.labels:
+            assign(obj, attribute, self.labels[text])
+        else:
+            assign(obj, attribute, 0)
+            self.fixups.append((self.line_number, obj, attribute, text))
+    
+    def instruction(self, name, args):
+    
+        try:
+            class_, shape = instruction_classes[name]
+        except KeyError:
+            raise self.error("Unknown instruction '%s'" % name)
+        
+        if args:
+            texts = args.split(",")
+        else:
+            texts = []
+        
+        # Assign the operands to positions according to the instruction's
+        # operand types, omitting the middle operand if only two are given.
+        n = len(texts)
+        
+        if shape == THREE:
+            if n == 3:
+                return class_(self.operand(texts[0]),
+                              self.middle_operand(texts[1]),
+                              self.operand(texts[2]))
+            elif n == 2:
+                return class_(self.operand(texts[0]), opcodes.NoOperand(),
+                              self.operand(texts[1]))
+        
+        elif shape == SRC_DST and n == 2:
+            return class_(self.operand(texts[0]), self.operand(texts[1]))
+        
+        elif shape == SRC_SRC and n == 2:
+            return class_(self.operand(texts[0]), self.middle_operand(texts[1]))
+        
+        elif shape == ONE and n == 1:
+            return class_(self.operand(texts[0]))
+        
+        elif shape == NONE and n == 0:
+            return class_()
+        
+        raise self.error("Wrong number of operands for '%s'" % name)
+    
+    def operand(self, text):
+    
+        # Reuse the results of parsing operands that have been seen before.
+        try:
+            class_, args = self.operands[text]
+        except KeyError:
+            class_, args = self.operands[text] = self.parse_operand(text)
+        
+        if args is None:
+            operand = class_(0, "$OP")
+            self.value(text.strip()[1:], operand, "value")
+            return operand
+        
+        return class_(*args)
+    
+    def middle_operand(self, text):
+    
+        try:
+            class_, args = self.middle_operands[text]
+        except KeyError:
+            class_, args = self.middle_operands[text] = \
+                self.parse_middle_operand(text)
+        
+        if args is None:
+            operand = class_(0, "$SI")
+            self.value(text.strip()[1:], operand, "value")
+            return operand
+        
+        return class_(*args)
+    
+    def parse_operand(self, text):
+    
+        """Returns the class and constructor arguments of the operand described
+        by the text, with None instead of arguments for labels."""
+        
+        match = operand_re.match(text.strip())
+        if not match:
+            raise self.error("Invalid operand '%s'" % text.strip())
+        
+        imm, offset, inner, reg2, reg = match.groups()
+        
+        if imm is not None:
+            if number_re.match(imm):
+                return opcodes.Immediate, (int(imm, 0), "$OP")
+            else:
+                return opcodes.Immediate, None
+        elif inner is not None:
+            if reg2 == "fp":
+                return opcodes.DoubleShortOffsetFP, (int(offset), int(inner),
+                                                     "SO(SO(FP))")
+            else:
+                return opcodes.DoubleShortOffsetMP, (int(offset), int(inner),
+                                                     "SO(SO(MP))")
+        elif reg == "fp":
+            return opcodes.LongOffsetFP, (int(offset), "LO(FP)")
+        else:
+            return opcodes.LongOffsetMP, (int(offset), "LO(MP)")
+    
+    def parse_middle_operand(self, text):
+    
+        match = operand_re.match(text.strip())
+        if not match or match.group("inner") is not None:
+            raise self.error("Invalid middle operand '%s'" % text.strip())
+        
+        imm, offset, inner, reg2, reg = match.groups()
+        
+        if imm is not None:
+            if number_re.match(imm):
+                return opcodes.Immediate, (int(imm, 0), "$SI")
+            else:
+                return opcodes.Immediate, None
+        elif reg == "fp":
+            return opcodes.ShortOffsetFP, (int(offset), "SO(FP)")
+        else:
+            return opcodes.ShortOffsetMP, (int(offset), "SO(MP)")
+    
+    def split(self, args, count):
+    
+        """Splits the arguments of a directive at the first count - 1 commas,
+        leaving any commas in a trailing string intact."""
+        
+        pieces = [piece.strip() for piece in args.split(",", count - 1)]
+        if len(pieces) != count:
+            raise self.error("Expected %i arguments" % count)
+        
+        return pieces
+    
+    def string(self, text):
+    
+        match = string_re.match(text)
+        if not match:
+            raise self.error("Invalid string %s" % text)
+        
+        return match.group(1).decode("string_escape")
+    
+    def address(self, text):
+    
+        match = address_re.match(text)
+        if not match:
+            raise self.error("Invalid address '%s'" % text)
+        
+        return match.group(1), int(match.group(2) or "0")
+    
+    def entry(self, args):
+    
+        pc, type_ = self.split(args, 2)
+        self.value(pc, self.d, "entry_pc")
+        self.d.entry_type = int(type_, 0)
+    
+    def desc(self, args):
+    
+        number, size, array = self.split(args, 3)
+        if not number.startswith("$"):
+            raise self.error("Invalid type number '%s'" % number)
+        
+        self.d.types.append(dis.Type(int(number[1:], 0), int(size, 0),
+                                     self.string(array).decode("hex")))
+    
+    def var(self, args):
+    
+        address, size = self.split(args, 2)
+        self.d.data_size = int(size, 0)
+    
+    def data_item(self, array_type, args):
+    
+        address, values = self.split(args, 2)
+        area, offset = self.address(address)
+        
+        if area == "ldt":
+            # A word in the LDT area starts a new sequence of imports.
+            self.d.ldt.append([])
+            return
+        
+        if array_type == 3:
+            array = self.string(values)
+        elif array_type == 4:
+            array = [float(value) for value in values.split(",")]
+        else:
+            array = [int(value, 0) for value in values.split(",")]
+        
+        item = dis.Data(0, offset, array_type, array = array)
+        self.d.data[offset] = item
+        self.d.data_items.append(item)
+    
+    def module(self, args):
+    
+        self.d.module_name = args.strip()
+    
+    def link(self, args):
+    
+        pc, desc_number, sig, name = self.split(args, 4)
+        link = dis.Link(0, int(desc_number, 0), int(sig, 0), self.string(name))
+        self.value(pc, link, "pc")
+        self.d.link.append(link)
+    
+    def ldts(self, args):
+    
+        # The directive describes the LDT section, even if it is empty.
+        address, number = self.split(args, 2)
+        self.d.initialised_globals = int(number, 0)
+        self.d.runtime_flag.value |= dis.RuntimeFlag.HASLDT
+    
+    def ext(self, args):
+    
+        address, sig, name = self.split(args, 3)
+        if not self.d.ldt:
+            raise self.error("LDT entry found outside a sequence")
+        
+        self.d.ldt[-1].append(dis.LDT(int(sig, 0), self.string(name)))
+    
+    def exceptions(self, args):
+    
+        # The number of exception handlers is found from the handlers that
+        # follow.
+        pass
+    
+    def exception(self, args):
+    
+        p1, p2, offset, desc, ne = self.split(args, 5)
+        exception = dis.ExceptionInfo(int(offset, 0), 0, 0, int(desc, 0),
+                                      int(ne, 0) << 16)
+        self.value(p1, exception, "p1")
+        self.value(p2, exception, "p2")
+        self.d.exceptions.append(exception)
+    
+    def except_(self, args):
+    
+        # The name is a string that may contain commas.
+        pieces = [piece.strip() for piece in args.rsplit(",", 1)]
+        if len(pieces) != 2:
+            raise self.error("Expected 2 arguments")
+        
+        name, pc = pieces
+        if not self.d.exceptions:
+            raise self.error("Exception label found outside a handler")
+        
+        exception = self.d.exceptions[-1]
+        
+        if name == "*":
+            self.value(pc, exception, "pc")
+        else:
+            label = [self.string(name), 0]
+            self.value(pc, label, 1)
+            exception.pcs.append(label)
+    
+    def source(self, args):
+    
+        self.d.path = self.string(args.strip())
+
+
+def assemble(text, stack_extent = 0):
+
+    return Assembler(stack_extent).assemble(text.split("\n"))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage: %s <input file> <output file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    try:
+        d = Assembler().assemble(open(sys.argv[1]))
+    except AsmError, error:
+        sys.stderr.write("%s: %s\n" % (sys.argv[1], error))
+        sys.exit(1)
+    
+    d.write(open(sys.argv[2], "wb"))
+    
+    sys.exit()
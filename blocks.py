@@ -0,0 +1,137 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import opcodes
+
+
+class Block:
+
+    def __init__(self, start, end):
+    
+        # The block contains the instructions from start up to, but not
+        # including, end.
+        self.start = start
+        self.end = end
+        self.successors = []
+    
+    def __repr__(self):
+    
+        return "Block(start=%s, end=%s, successors=%s)" % (hex(self.start),
+            hex(self.end), map(hex, self.successors))
+
+
+def branch_target(ins):
+
+    """Returns the pc that the instruction, ins, may jump to, or None if it
+    does not refer to a pc in the same module."""
+    
+    if opcodes.flags[ins.opcode] & (opcodes.BRANCH | opcodes.JUMP):
+        if isinstance(ins.destination, opcodes.Immediate):
+            return ins.destination.value
+    
+    return None
+
+def call_target(ins):
+
+    """Returns the pc of the function called or spawned by the instruction,
+    ins, or None if it does not call a function in the same module."""
+    
+    if opcodes.flags[ins.opcode] & opcodes.CALL and \
+       isinstance(ins.destination, opcodes.Immediate):
+        return ins.destination.value
+    
+    return None
+
+def function_entries(d):
+
+    """Returns a sorted list of the pcs of the functions in the module, d,
+    found from its link section, its entry point and its call instructions."""
+    
+    entries = set([d.entry_pc])
+    
+    for link in d.link:
+        entries.add(link.pc)
+    
+    for ins in d.code:
+        pc = call_target(ins)
+        if pc is not None:
+            entries.add(pc)
+    
+    return sorted(pc for pc in entries if 0 <= pc < len(d.code))
+
+def leaders(code, entries = (), tables = None):
+
+    """Returns a sorted list of the pcs that start basic blocks in the code,
+    including the pcs given in entries and the targets of the case tables in
+    the dictionary, tables, which maps pcs of case instructions to CaseTable
+    objects."""
+    
+    found = set(entries)
+    found.add(0)
+    size = len(code)
+    
+    if tables:
+        for table in tables.values():
+            found.update(pc for pc in table.targets() if 0 <= pc < size)
+    
+    for pc, ins in enumerate(code):
+    
+        target = branch_target(ins)
+        if target is not None and 0 <= target < size:
+            found.add(target)
+        
+        if target is not None or \
+           opcodes.flags[ins.opcode] & opcodes.TERMINATE:
+            found.add(pc + 1)
+    
+    return sorted(pc for pc in found if pc < size)
+
+def basic_blocks(code, entries = (), tables = None):
+
+    """Splits the code into a list of Block objects, in pc order, with the
+    successors of each block filled in, including the targets of any case
+    tables given."""
+    
+    tables = tables or {}
+    starts = leaders(code, entries, tables)
+    blocks = []
+    
+    for i, start in enumerate(starts):
+        if i + 1 < len(starts):
+            end = starts[i + 1]
+        else:
+            end = len(code)
+        blocks.append(Block(start, end))
+    
+    for block in blocks:
+    
+        last = code[block.end - 1]
+        target = branch_target(last)
+        
+        if target is not None:
+            block.successors.append(target)
+        
+        table = tables.get(block.end - 1)
+        if table is not None:
+            block.successors.extend(table.targets())
+        
+        if not opcodes.flags[last.opcode] & opcodes.TERMINATE and \
+           block.end < len(code):
+            if block.end not in block.successors:
+                block.successors.append(block.end)
+    
+    return blocks
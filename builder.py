@@ -0,0 +1,426 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cases, dis, opcodes
+from asm import assign
+from blocks import branch_target, call_target
+
+# The number of items held in each chunk of code before it is split.
+CHUNK_SIZE = 1024
+
+
+class BuildError(Exception):
+    pass
+
+
+class Label:
+
+    """Marks a position in the code held by a Builder. Labels can be used as
+    the values of immediate operands, as the pcs of links, exception handlers
+    and the entry point, and as items in word arrays in the module data, such
+    as case tables. They are replaced by pcs when the code is resolved."""
+    
+    def __init__(self, name = None):
+    
+        self.name = name
+        self.chunk = None
+        self.pc = None
+    
+    def __repr__(self):
+    
+        return "Label(%s, pc=%s)" % (repr(self.name), self.pc)
+
+
+class Target(opcodes.Immediate):
+
+    """An immediate operand whose value is the pc of a label."""
+    
+    def __init__(self, label, annotation = None):
+    
+        opcodes.Immediate.__init__(self, label.pc, annotation)
+        self.label = label
+
+
+class Chunk:
+
+    def __init__(self, items = None):
+    
+        # The items are instructions and the labels that mark the positions
+        # before them.
+        self.items = items or []
+        self.size = len([item for item in self.items
+                         if not isinstance(item, Label)])
+
+
+def trailing_labels(items):
+
+    """Returns the index of the first of the labels at the end of the list of
+    items."""
+    
+    index = len(items)
+    while index > 0 and isinstance(items[index - 1], Label):
+        index -= 1
+    return index
+
+
+class Builder:
+
+    """Collects instructions and labels in a list of chunks so that they can
+    be inserted and removed anywhere in the code while only moving the items
+    in one chunk. Branch targets are given as labels and are only converted
+    to pcs when the resolve method is called, which can be done as often as
+    needed.
+    
+    Instructions are inserted before or after a label, or before the
+    instruction at a given pc, which is found by skipping whole chunks."""
+    
+    def __init__(self):
+    
+        self.chunks = [Chunk()]
+        self.size = 0
+        
+        # Labels used in the module, recorded as (object, attribute, label)
+        # tuples, where the attribute may be an index into a list.
+        self.fixups = []
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+    
+        for chunk in self.chunks:
+            for item in chunk.items:
+                if not isinstance(item, Label):
+                    yield item
+    
+    def label(self, name = None):
+    
+        """Returns a new label that is not yet placed in the code."""
+        
+        return Label(name)
+    
+    def mark(self, label = None):
+    
+        """Places the label, or a new label, at the end of the code, returning
+        it."""
+        
+        if label is None:
+            label = Label()
+        elif label.chunk is not None:
+            raise BuildError("Label %s is already placed in the code." %
+                             repr(label.name))
+        
+        label.chunk = self.chunks[-1]
+        label.chunk.items.append(label)
+        return label
+    
+    def append(self, *instructions):
+    
+        chunk = self.chunks[-1]
+        self.insert_items(chunk, len(chunk.items), instructions)
+    
+    def insert_before(self, label, *instructions):
+    
+        """Inserts the instructions before the label, so that branches to the
+        label do not reach them."""
+        
+        self.insert_items(label.chunk, self.position(label), instructions)
+    
+    def insert_after(self, label, *instructions):
+    
+        """Inserts the instructions after the label, so that branches to the
+        label reach them first."""
+        
+        self.insert_items(label.chunk, self.position(label) + 1, instructions)
+    
+    def insert_at(self, pc, *instructions):
+    
+        """Inserts the instructions before the instruction currently at the
+        given pc and any labels that mark it."""
+        
+        chunk, index = self.locate(pc)
+        self.insert_items(chunk, index, instructions)
+    
+    def remove(self, label, count = 1):
+    
+        """Removes the given number of instructions following the label,
+        leaving any labels between them in place."""
+        
+        self.remove_items(label.chunk, self.position(label) + 1, count)
+    
+    def remove_at(self, pc, count = 1):
+    
+        """Removes the given number of instructions starting at the given
+        pc."""
+        
+        chunk, index = self.locate(pc)
+        self.remove_items(chunk, index, count)
+    
+    def position(self, label):
+    
+        if label.chunk is None:
+            raise BuildError("Label %s is not placed in the code." %
+                             repr(label.name))
+        
+        return label.chunk.items.index(label)
+    
+    def locate(self, pc):
+    
+        """Returns the chunk and the index in it of the first item for the
+        instruction at the given pc, or of the end of the code."""
+        
+        if not 0 <= pc <= self.size:
+            raise BuildError("No instruction at pc 0x%x." % pc)
+        
+        chunks = self.chunks
+        i = 0
+        while pc >= chunks[i].size and i < len(chunks) - 1:
+            pc -= chunks[i].size
+            i += 1
+        
+        chunk = chunks[i]
+        
+        if len(chunk.items) == chunk.size:
+            index = pc
+        else:
+            index = 0
+            for item in chunk.items:
+                if not isinstance(item, Label):
+                    if pc == 0:
+                        break
+                    pc -= 1
+                index += 1
+            
+            # Place the instructions before any labels that mark the
+            # instruction.
+            while index > 0 and isinstance(chunk.items[index - 1], Label):
+                index -= 1
+        
+        # Labels at the ends of earlier chunks may also mark the instruction.
+        while index == 0 and i > 0:
+            previous = chunks[i - 1]
+            start = trailing_labels(previous.items)
+            if start == len(previous.items) and previous.size > 0:
+                break
+            i -= 1
+            chunk = previous
+            index = start
+        
+        return chunk, index
+    
+    def insert_items(self, chunk, index, instructions):
+    
+        chunk.items[index:index] = instructions
+        chunk.size += len(instructions)
+        self.size += len(instructions)
+        
+        if len(chunk.items) > 2 * CHUNK_SIZE:
+            self.split(chunk)
+    
+    def split(self, chunk):
+    
+        # Divide the items into chunks of the usual size, keeping the first
+        # ones in the existing chunk.
+        items = chunk.items
+        pieces = []
+        
+        for start in range(CHUNK_SIZE, len(items), CHUNK_SIZE):
+            piece = Chunk(items[start:start + CHUNK_SIZE])
+            for item in piece.items:
+                if isinstance(item, Label):
+                    item.chunk = piece
+            pieces.append(piece)
+        
+        chunk.items = items[:CHUNK_SIZE]
+        chunk.size = len([item for item in chunk.items
+                          if not isinstance(item, Label)])
+        
+        i = self.chunks.index(chunk)
+        self.chunks[i + 1:i + 1] = pieces
+    
+    def remove_items(self, chunk, index, count):
+    
+        i = self.chunks.index(chunk)
+        
+        while count > 0 and i < len(self.chunks):
+        
+            chunk = self.chunks[i]
+            items = chunk.items
+            kept = items[:index]
+            
+            for item in items[index:]:
+                if count > 0 and not isinstance(item, Label):
+                    count -= 1
+                    chunk.size -= 1
+                    self.size -= 1
+                else:
+                    kept.append(item)
+            
+            chunk.items = kept
+            i += 1
+            index = 0
+        
+        if count > 0:
+            raise BuildError("Removed past the end of the code.")
+    
+    def record(self, obj, attribute, value):
+    
+        if isinstance(value, Label):
+            self.fixups.append((obj, attribute, value))
+    
+    def resolve(self, d):
+    
+        """Assigns pcs to the instructions and labels in a single pass over
+        the code, setting d.code to the list of instructions, then updates the
+        operands of the instructions that refer to labels. Labels used for the
+        entry point, links, exception handlers and in word arrays in the
+        module data of the module, d, are replaced by pcs and remembered so
+        that they are updated again if the code is resolved later."""
+        
+        code = []
+        targets = []
+        
+        for chunk in self.chunks:
+        
+            for item in chunk.items:
+            
+                if isinstance(item, Label):
+                    item.pc = len(code)
+                    continue
+                
+                for name in "source", "middle", "destination":
+                    operand = getattr(item, name)
+                    if isinstance(operand, Target):
+                        targets.append(operand)
+                    elif isinstance(operand, opcodes.Immediate) and \
+                         isinstance(operand.value, Label):
+                        operand = Target(operand.value, operand.annotation)
+                        setattr(item, name, operand)
+                        targets.append(operand)
+                
+                code.append(item)
+        
+        d.code = code
+        d.code_size = len(code)
+        
+        # Record the labels used in the rest of the module.
+        self.record(d, "entry_pc", d.entry_pc)
+        
+        for link in d.link:
+            self.record(link, "pc", link.pc)
+        
+        for exception in getattr(d, "exceptions", []):
+            self.record(exception, "p1", exception.p1)
+            self.record(exception, "p2", exception.p2)
+            self.record(exception, "pc", exception.pc)
+            for i, (name, pc) in enumerate(exception.pcs):
+                if isinstance(pc, Label):
+                    exception.pcs[i] = [name, pc]
+                    self.record(exception.pcs[i], 1, pc)
+        
+        for item in d.data.values():
+            if item.array_type == 2:
+                for i, value in enumerate(item.array):
+                    self.record(item.array, i, value)
+        
+        for operand in targets:
+            operand.value = self.pc(operand.label)
+        
+        for obj, attribute, label in self.fixups:
+            assign(obj, attribute, self.pc(label))
+        
+        return d
+    
+    def pc(self, label):
+    
+        if label.pc is None or label.chunk is None:
+            raise BuildError("Label %s is not placed in the code." %
+                             repr(label.name))
+        return label.pc
+
+
+def load(d):
+
+    """Returns a Builder containing the code of the module, d, with labels in
+    place of the pcs used as branch and call targets, by movpc instructions,
+    in the jump tables of case instructions, as the entry point and as the pcs
+    of links and exception handlers."""
+    
+    b = Builder()
+    labels = {}
+    
+    def label_for(pc):
+        if pc not in labels:
+            labels[pc] = Label()
+        return labels[pc]
+    
+    for ins in d.code:
+        target = branch_target(ins)
+        if target is None:
+            target = call_target(ins)
+        if target is not None:
+            ins.destination = Target(label_for(target),
+                                     ins.destination.annotation)
+        
+        # The movpc instruction obtains the address of the instruction at
+        # the pc in its source operand.
+        if isinstance(ins, opcodes.movpc) and \
+           isinstance(ins.source, opcodes.Immediate):
+            ins.source = Target(label_for(ins.source.value),
+                                ins.source.annotation)
+    
+    # Modules without an entry point, such as library modules, use -1 as
+    # the entry pc. Values that are not pcs in the code are kept.
+    def in_code(pc):
+        return 0 <= pc <= len(d.code)
+    
+    if in_code(d.entry_pc):
+        b.fixups.append((d, "entry_pc", label_for(d.entry_pc)))
+    
+    for link in d.link:
+        if in_code(link.pc):
+            b.fixups.append((link, "pc", label_for(link.pc)))
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+        for exception in d.exceptions:
+            b.fixups.append((exception, "p1", label_for(exception.p1)))
+            b.fixups.append((exception, "p2", label_for(exception.p2)))
+            if exception.pc != -1:
+                b.fixups.append((exception, "pc", label_for(exception.pc)))
+            exception.pcs = [[name, pc] for name, pc in exception.pcs]
+            for pair in exception.pcs:
+                b.fixups.append((pair, 1, label_for(pair[1])))
+    
+    # The pcs in the jump tables of case instructions are held in word
+    # arrays in the module data.
+    found = cases.elements(d)
+    for table in cases.tables(d).values():
+        for address in table.pc_addresses:
+            item, index = found[address]
+            b.fixups.append((item.array, index, label_for(item.array[index])))
+    
+    for pc, ins in enumerate(d.code):
+        if pc in labels:
+            b.mark(labels[pc])
+        b.append(ins)
+    
+    # Labels for pcs at or beyond the end of the code mark the end.
+    for pc in sorted(labels):
+        if pc >= len(d.code):
+            b.mark(labels[pc])
+    
+    return b
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from weakref import WeakKeyDictionary
+
+import dis, opcodes
+from blocks import function_entries
+from ptrmap import PointerAnalysis
+
+# Call graphs of the modules that have been analysed.
+cache = WeakKeyDictionary()
+
+
+def slot(operand):
+
+    # Returns a key for the word referred to by a direct operand.
+    
+    if isinstance(operand, opcodes.LongOffsetFP) or \
+       isinstance(operand, opcodes.ShortOffsetFP):
+        return ("fp", operand.value)
+    elif isinstance(operand, opcodes.LongOffsetMP) or \
+         isinstance(operand, opcodes.ShortOffsetMP):
+        return ("mp", operand.value)
+    
+    return None
+
+
+class CallGraph:
+
+    """Describes the functions in a module, the functions that each one calls
+    or spawns in the same module and the functions it calls in other modules.
+    
+    Functions are found from the module's entry point, its links and its call
+    and spawn instructions, and each one is assumed to extend to the start of
+    the next. The frame type of each function is given by its link or by the
+    frame instructions used to call it, and its frame size by that type. Since
+    the frames of called functions are allocated on the stack of the calling
+    thread, the worst-case stack usage of a function is the size of its frame
+    plus the largest usage of the functions it calls. Functions in recursive
+    cycles have no upper bound, and calls to other modules are not included.
+    
+    The graph does not refer to the module itself, so that it can be cached
+    for as long as the module exists."""
+    
+    def __init__(self, d):
+    
+        self.stack_extent = d.stack_extent
+        self.functions = function_entries(d)
+        
+        self.names = {}
+        for link in d.link:
+            self.names.setdefault(link.pc, link.name)
+        
+        # Map the pcs of functions to the pcs of the functions they call and
+        # spawn, and to the names of the functions they call in other modules.
+        self.calls = dict((pc, set()) for pc in self.functions)
+        self.spawns = dict((pc, set()) for pc in self.functions)
+        self.external = dict((pc, set()) for pc in self.functions)
+        
+        # Find the frame type of each function and the size of its frame.
+        frame_types = PointerAnalysis(d).frame_types
+        self.frame_sizes = {}
+        for pc in self.functions:
+            type_number = frame_types.get(pc)
+            if type_number is not None and type_number < len(d.types):
+                self.frame_sizes[pc] = d.types[type_number].size
+        
+        self.scan(d)
+        
+        self.entries = set([d.entry_pc])
+        for link in d.link:
+            self.entries.add(link.pc)
+        for targets in self.spawns.values():
+            self.entries.update(targets)
+        
+        self.components = self.find_components()
+        self.recursive = set()
+        for component in self.components:
+            if len(component) > 1 or component[0] in self.calls[component[0]]:
+                self.recursive.update(component)
+        
+        self.usage = {}
+        self.paths = {}
+        self.find_usage()
+    
+    def scan(self, d):
+    
+        entries = set(self.functions)
+        function = None
+        
+        # Map the slots holding module pointers to the LDT sequences that
+        # were used to load them.
+        modules = {}
+        
+        for pc, ins in enumerate(d.code):
+        
+            if pc in entries:
+                function = pc
+                modules = {}
+            
+            if function is None:
+                continue
+            
+            if isinstance(ins, opcodes.load) and \
+               isinstance(ins.middle, opcodes.Immediate):
+                modules[slot(ins.destination)] = ins.middle.value
+            
+            elif isinstance(ins, opcodes.call) or \
+                 isinstance(ins, opcodes.spawn):
+                if isinstance(ins.destination, opcodes.Immediate):
+                    target = ins.destination.value
+                    if isinstance(ins, opcodes.call):
+                        self.calls[function].add(target)
+                    else:
+                        self.spawns[function].add(target)
+            
+            elif isinstance(ins, opcodes.mcall) or \
+                 isinstance(ins, opcodes.mspawn):
+                self.external[function].add(
+                    import_name(d, modules.get(slot(ins.destination)),
+                                ins.middle))
+    
+    def frame_size(self, pc):
+    
+        """Returns the size of the frame of the function at the given pc, or
+        None if its frame type is not known."""
+        
+        return self.frame_sizes.get(pc)
+    
+    def find_components(self):
+    
+        """Returns a list of the strongly connected components of the graph
+        of calls, each of which is a list of pcs, with the components of
+        called functions before those of their callers."""
+        
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        
+        for root in self.functions:
+        
+            if root in index:
+                continue
+            
+            # Visit the functions without recursion, keeping an iterator over
+            # the callees of each function on the path from the root.
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            path = [(root, iter(sorted(self.calls[root])))]
+            
+            while path:
+            
+                pc, callees = path[-1]
+                
+                for callee in callees:
+                    if callee not in self.calls:
+                        continue
+                    if callee not in index:
+                        index[callee] = low[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        path.append((callee, iter(sorted(self.calls[callee]))))
+                        break
+                    elif callee in on_stack:
+                        low[pc] = min(low[pc], index[callee])
+                else:
+                    path.pop()
+                    if path:
+                        caller = path[-1][0]
+                        low[caller] = min(low[caller], low[pc])
+                    
+                    if low[pc] == index[pc]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.remove(member)
+                            component.append(member)
+                            if member == pc:
+                                break
+                        components.append(sorted(component))
+        
+        return components
+    
+    def find_usage(self):
+    
+        # Visit the components with called functions first so that the usage
+        # of each callee is known before its callers.
+        for component in self.components:
+        
+            for pc in component:
+            
+                if pc in self.recursive:
+                    self.usage[pc] = None
+                    self.paths[pc] = [pc]
+                    continue
+                
+                deepest = 0
+                path = []
+                for callee in sorted(self.calls[pc]):
+                    if callee not in self.usage:
+                        continue
+                    usage = self.usage[callee]
+                    if usage is None:
+                        deepest = None
+                        path = self.paths[callee]
+                        break
+                    elif usage > deepest:
+                        deepest = usage
+                        path = self.paths[callee]
+                
+                if deepest is None:
+                    self.usage[pc] = None
+                else:
+                    self.usage[pc] = (self.frame_size(pc) or 0) + deepest
+                
+                self.paths[pc] = [pc] + path
+    
+    def entry_points(self):
+    
+        """Returns a sorted list of the pcs of the functions that can be
+        started from outside the module or by spawning a thread."""
+        
+        return sorted(pc for pc in self.entries if pc in self.calls)
+    
+    def reachable(self, pc):
+    
+        """Returns the set of pcs of the functions that may be called, directly
+        or indirectly, by the function at the given pc, including itself."""
+        
+        found = set([pc])
+        pending = [pc]
+        
+        while pending:
+            for callee in self.calls.get(pending.pop(), ()):
+                if callee not in found:
+                    found.add(callee)
+                    pending.append(callee)
+        
+        return found
+    
+    def name(self, pc):
+    
+        return self.names.get(pc, hex(pc))
+    
+    def list(self):
+    
+        print "stack extent %i" % self.stack_extent
+        
+        for pc in self.entry_points():
+        
+            functions = self.reachable(pc)
+            usage = self.usage[pc]
+            path = " -> ".join(map(self.name, self.paths[pc]))
+            
+            if usage is None:
+                print "%s: unbounded, recursive: %s" % (self.name(pc), path)
+            else:
+                print "%s: %i bytes: %s" % (self.name(pc), usage, path)
+            
+            unknown = [f for f in sorted(functions)
+                       if self.frame_size(f) is None]
+            if unknown:
+                print "  unknown frame sizes:", \
+                      ", ".join(map(self.name, unknown))
+            
+            external = set()
+            for f in functions:
+                external.update(self.external[f])
+            if external:
+                print "  calls other modules:", ", ".join(sorted(external))
+
+
+def import_name(d, sequence, operand):
+
+    """Returns the name of the function in a module imported by the module,
+    d, given the number of its LDT sequence and the operand containing its
+    index in the sequence."""
+    
+    if sequence is not None and isinstance(operand, opcodes.Immediate) \
+       and d.runtime_flag.contains(dis.RuntimeFlag.HASLDT) and \
+       sequence < len(d.ldt) and operand.value < len(d.ldt[sequence]):
+        return d.ldt[sequence][operand.value].name
+    
+    return "?"
+
+def call_graph(d):
+
+    """Returns the CallGraph for the module, d, which is only created the
+    first time it is requested for the module. The module should not be
+    changed after that."""
+    
+    graph = cache.get(d)
+    if graph is None:
+        graph = cache[d] = CallGraph(d)
+    return graph
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: %s <file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    d = dis.Dis(sys.argv[1])
+    call_graph(d).list()
+    
+    sys.exit()
@@ -0,0 +1,221 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from bisect import bisect_right
+
+import opcodes
+from strip import mp_offset
+from utils import dbl_repr
+
+# The layouts of the jump tables used by the case instructions, as used by
+# the interpreter: the offset of the first entry from the start of the table,
+# which holds the number of entries, the size of each entry and the offsets
+# of the low value, high value and pc in each entry. The default pc follows
+# the last entry.
+layouts = {
+    opcodes.case:  (4, 12, 0, 4, 8),
+    opcodes.casec: (4, 12, 0, 4, 8),
+    opcodes.casel: (8, 24, 0, 8, 16)
+    }
+
+
+def elements(d):
+
+    """Returns a dictionary mapping the addresses of the elements of the data
+    items in the module data of the module, d, to (item, index) pairs. Strings
+    are represented by a single element with an index of None."""
+    
+    found = {}
+    
+    for item in d.data.values():
+    
+        if item.base != 0:
+            continue
+        
+        if item.array_type == 3:
+            found[item.offset] = (item, None)
+        else:
+            size = item.item_sizes[item.array_type]
+            for index in range(len(item.array)):
+                found[item.offset + index * size] = (item, index)
+    
+    return found
+
+
+class CaseTable:
+
+    """Describes the jump table used by a case, casec or casel instruction.
+    
+    The entries are (low, high, pc) tuples, sorted by their low values, that
+    map values from low up to, but not including, high to a pc. For casec
+    tables, the values are strings and the high value is included in the
+    range, or is None if the entry only matches its low value. Values that
+    are not matched by any entry use the default pc."""
+    
+    def __init__(self, kind, offset, entries, default, pc_addresses = ()):
+    
+        self.kind = kind
+        self.offset = offset
+        self.entries = sorted(entries)
+        self.default = default
+        
+        # The addresses of the words in the module data holding the pcs of
+        # the entries and the default pc.
+        self.pc_addresses = list(pc_addresses)
+        
+        self.lows = [low for low, high, pc in self.entries]
+    
+    def __repr__(self):
+    
+        return "CaseTable(kind=%s, offset=%i, entries=%s, default=%s)" % (
+            self.kind, self.offset, repr(self.entries), hex(self.default))
+    
+    def lookup(self, value):
+    
+        """Returns the pc that the instruction jumps to for the value."""
+        
+        i = bisect_right(self.lows, value) - 1
+        
+        if i >= 0:
+            low, high, pc = self.entries[i]
+            if self.kind != "casec":
+                if value < high:
+                    return pc
+            elif high is None:
+                if value == low:
+                    return pc
+            elif value <= high:
+                return pc
+        
+        return self.default
+    
+    def size(self):
+    
+        """Returns the number of bytes used by the table."""
+        
+        return self.pc_addresses[-1] + 4 - self.offset
+    
+    def targets(self):
+    
+        """Returns a sorted list of the pcs that the instruction may jump
+        to."""
+        
+        pcs = set(pc for low, high, pc in self.entries)
+        pcs.add(self.default)
+        return sorted(pcs)
+    
+    def lines(self):
+    
+        """Returns a list of lines describing the entries in the table."""
+        
+        lines = []
+        
+        for low, high, pc in self.entries:
+            if self.kind != "casec":
+                lines.append("[%i, %i): %s" % (low, high, hex(pc)))
+            elif high is None:
+                lines.append("%s: %s" % (dbl_repr(low), hex(pc)))
+            else:
+                lines.append("[%s, %s]: %s" % (dbl_repr(low), dbl_repr(high),
+                                               hex(pc)))
+        
+        lines.append("*: %s" % hex(self.default))
+        return lines
+
+
+def read_table(ins, found):
+
+    """Returns a CaseTable for the case, casec or casel instruction, ins,
+    using the elements of the module data in the dictionary returned by the
+    elements function, or None if the table cannot be found."""
+    
+    layout = layouts.get(ins.__class__)
+    offset = mp_offset(ins.destination)
+    
+    if layout is None or offset is None or \
+       isinstance(ins.destination, opcodes.DoubleShortOffsetMP):
+        return None
+    
+    first, size, low_offset, high_offset, pc_offset = layout
+    kind = ins.__class__.__name__
+    
+    def value(address, array_type):
+        item, index = found.get(address, (None, None))
+        if item is None or item.array_type != array_type:
+            raise KeyError(address)
+        elif index is None:
+            return item.data()
+        return item.array[index]
+    
+    if kind == "case":
+        key_type = 2
+    elif kind == "casel":
+        key_type = 8
+    else:
+        key_type = 3
+    
+    try:
+        count = value(offset, 2)
+        entries = []
+        pc_addresses = []
+        
+        for i in range(count):
+        
+            address = offset + first + i * size
+            low = value(address + low_offset, key_type)
+            
+            # A missing high string is a nil pointer.
+            try:
+                high = value(address + high_offset, key_type)
+            except KeyError:
+                if kind != "casec":
+                    raise
+                high = None
+            
+            pc_addresses.append(address + pc_offset)
+            entries.append((low, high, value(address + pc_offset, 2)))
+        
+        pc_addresses.append(offset + first + count * size)
+        default = value(pc_addresses[-1], 2)
+    
+    except KeyError:
+        return None
+    
+    return CaseTable(kind, offset, entries, default, pc_addresses)
+
+def tables(d):
+
+    """Returns a dictionary mapping the pcs of the case, casec and casel
+    instructions in the module, d, to CaseTable objects describing the jump
+    tables they use."""
+    
+    found = None
+    result = {}
+    
+    for pc, ins in enumerate(d.code):
+    
+        if ins.__class__ not in layouts:
+            continue
+        
+        if found is None:
+            found = elements(d)
+        
+        table = read_table(ins, found)
+        if table is not None:
+            result[pc] = table
+    
+    return result
@@ -0,0 +1,168 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import dis
+
+
+class Corpus:
+
+    """Holds a collection of Dis objects, replacing the types, data, links,
+    LDTs and instructions in each module with shared objects when they have
+    the same contents as ones in modules that were added earlier.
+    
+    Since these objects are shared between modules, they must not be modified
+    after a module has been added to the corpus."""
+    
+    sections = ("types", "payloads", "data", "links", "ldts", "ldt_lists",
+                "instructions", "code")
+    
+    def __init__(self):
+    
+        self.modules = {}
+        
+        # Each table maps a key describing the contents of an object to the
+        # shared instance of that object.
+        self.tables = {}
+        for name in self.sections:
+            self.tables[name] = {}
+        
+        # Record the number of objects that were looked up in each table.
+        self.references = dict.fromkeys(self.sections, 0)
+    
+    def share(self, section, key, obj):
+    
+        self.references[section] += 1
+        return self.tables[section].setdefault(key, obj)
+    
+    def add(self, d, name = None):
+    
+        """Adds the Dis object, d, to the corpus under the given name or the
+        name of the file it was read from, returning the object."""
+        
+        if name is None:
+            name = d.file_name
+        
+        d.module_name = intern(d.module_name)
+        d.path = intern(d.path)
+        
+        # Share the types first because data items refer to them, mapping
+        # the original types to the shared ones. The original types are kept
+        # until the data items have been shared so that their ids are not
+        # reused.
+        original = d.types
+        d.types = []
+        type_ids = {}
+        for type_ in original:
+            shared = self.share_type(type_)
+            type_ids[id(type_)] = type_ids[id(shared)] = shared
+            d.types.append(shared)
+        
+        data = {}
+        items = []
+        for address, item in sorted(d.data.items()):
+            if item.type_ is not None:
+                shared = type_ids.get(id(item.type_))
+                if shared is None:
+                    shared = self.share_type(item.type_)
+                item.type_ = shared
+            item = self.share_data(item)
+            data[address] = item
+            items.append(item)
+        
+        d.data = data
+        d.data_items = items
+        
+        links = []
+        for link in d.link:
+            link.name = intern(link.name)
+            links.append(self.share("links", (link.pc, link.desc_number,
+                                              link.sig, link.name), link))
+        d.link = links
+        
+        if d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+            d.ldt = self.share_ldt(d.ldt)
+        
+        code = []
+        for ins in d.code:
+            code.append(self.share("instructions", ins.key(), ins))
+        
+        d.code = self.share("code", tuple(map(id, code)), code)
+        
+        self.modules[name] = d
+        return d
+    
+    def share_type(self, type_):
+    
+        type_.array = intern(type_.array)
+        return self.share("types", (type_.desc_number, type_.size,
+                                    type_.array), type_)
+    
+    def share_data(self, item):
+    
+        # Share the contents of the item separately from the item itself
+        # because equal strings are often found at different addresses in
+        # different modules.
+        if item.array_type == 3:
+            payload = intern("".join(item.array))
+        else:
+            payload = tuple(item.array)
+        
+        item.array = self.share("payloads", (item.array_type, payload),
+                                payload)
+        
+        return self.share("data", (item.base, item.offset, item.array_type,
+                                   id(item.type_), id(item.array)), item)
+    
+    def share_ldt(self, ldt):
+    
+        sequences = []
+        
+        for sequence in ldt:
+        
+            shared = []
+            for entry in sequence:
+                entry.name = intern(entry.name)
+                shared.append(self.share("ldts", (entry.sig, entry.name),
+                                         entry))
+            
+            sequence = shared
+            sequences.append(self.share("ldt_lists", tuple(map(id, sequence)),
+                                        sequence))
+        
+        return self.share("ldt_lists", tuple(map(id, sequences)), sequences)
+    
+    def statistics(self):
+    
+        """Returns a dictionary mapping the name of each kind of shared object
+        to a tuple containing the number of objects looked up and the number
+        of unique objects held."""
+        
+        stats = {}
+        for name in self.sections:
+            stats[name] = (self.references[name], len(self.tables[name]))
+        
+        return stats
+    
+    def list(self):
+    
+        stats = self.statistics()
+        
+        print "%i modules" % len(self.modules)
+        
+        for name in self.sections:
+            total, unique = stats[name]
+            print "%s: %i references, %i unique" % (name, total, unique)
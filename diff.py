@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+
+import cases
+import dis
+import opcodes
+from blocks import basic_blocks, branch_target, call_target, function_entries
+from utils import dbl_repr
+
+# Placeholder used in place of branch and call targets when comparing blocks
+# so that inserting code in one place does not change every later block.
+TARGET = "@"
+
+
+class ModuleDiff:
+
+    def __init__(self, old, new):
+    
+        self.old = old
+        self.new = new
+        
+        # Each list contains (key, old value, new value) tuples, with None
+        # used for values that are missing from one of the modules.
+        self.header = []
+        self.types = []
+        self.data = []
+        self.links = []
+        self.ldt = []
+        
+        # The code list contains (kind, old block, new block) tuples where the
+        # kind is "changed", "added" or "removed".
+        self.code = []
+        self.unchanged_blocks = 0
+    
+    def changed(self):
+    
+        return bool(self.header or self.code or self.types or self.data or
+                    self.links or self.ldt)
+    
+    def list(self):
+    
+        for name, old, new in self.header:
+            print "header %s: %s -> %s" % (name, old, new)
+        
+        for kind, old_block, new_block in self.code:
+        
+            print
+            if kind == "changed":
+                print "changed %s-%s -> %s-%s" % (hex(old_block.start),
+                    hex(old_block.end - 1), hex(new_block.start),
+                    hex(new_block.end - 1))
+            elif kind == "removed":
+                print "removed %s-%s" % (hex(old_block.start),
+                    hex(old_block.end - 1))
+            else:
+                print "added %s-%s" % (hex(new_block.start),
+                    hex(new_block.end - 1))
+            
+            if old_block:
+                for pc in range(old_block.start, old_block.end):
+                    print "-", hex(pc) + ":", str(self.old.code[pc])
+            if new_block:
+                for pc in range(new_block.start, new_block.end):
+                    print "+", hex(pc) + ":", str(self.new.code[pc])
+        
+        for section, items in (("desc", self.types), ("data", self.data),
+                               ("link", self.links), ("ldt", self.ldt)):
+            for key, old, new in items:
+                print
+                if old is not None:
+                    print "- %s %s: %s" % (section, key, old)
+                if new is not None:
+                    print "+ %s %s: %s" % (section, key, new)
+        
+        print
+        print "%i unchanged blocks, %i changed" % (self.unchanged_blocks,
+            len(self.code))
+
+
+def block_key(code, block):
+
+    """Returns a hashable key for the instructions in the block that does not
+    depend on the pcs of branch and call targets."""
+    
+    items = []
+    
+    for pc in xrange(block.start, block.end):
+    
+        ins = code[pc]
+        key = ins.key()
+        
+        if branch_target(ins) is not None or call_target(ins) is not None:
+            key = key[:3] + (TARGET,)
+        elif isinstance(ins, opcodes.movpc):
+            key = (key[0], TARGET) + key[2:]
+        
+        items.append(key)
+    
+    return tuple(items)
+
+def match(old_keys, new_keys):
+
+    """Matches the keys in two lists, returning a list for each of them that
+    maps the index of each key to the index of its partner in the other list,
+    or to None if it was not matched.
+    
+    Keys that occur exactly once in both lists are matched first, then the
+    matches are extended to neighbouring keys in both directions before any
+    remaining equal keys are matched in order."""
+    
+    old_map = [None] * len(old_keys)
+    new_map = [None] * len(new_keys)
+    
+    old_positions = {}
+    new_positions = {}
+    
+    for i, key in enumerate(old_keys):
+        old_positions.setdefault(key, []).append(i)
+    
+    for j, key in enumerate(new_keys):
+        new_positions.setdefault(key, []).append(j)
+    
+    # Anchor the unique keys.
+    for key, positions in old_positions.iteritems():
+        others = new_positions.get(key, ())
+        if len(positions) == 1 and len(others) == 1:
+            old_map[positions[0]] = others[0]
+            new_map[others[0]] = positions[0]
+    
+    # Extend each match forwards then backwards over equal neighbours.
+    for step, indices in ((1, xrange(len(old_keys))),
+                          (-1, xrange(len(old_keys) - 1, -1, -1))):
+        for i in indices:
+        
+            j = old_map[i]
+            if j is None:
+                continue
+            
+            i += step
+            j += step
+            while 0 <= i < len(old_keys) and 0 <= j < len(new_keys) and \
+                  old_map[i] is None and new_map[j] is None and \
+                  old_keys[i] == new_keys[j]:
+                
+                old_map[i] = j
+                new_map[j] = i
+                i += step
+                j += step
+    
+    # Pair any remaining equal keys in the order they occur.
+    for key, positions in old_positions.iteritems():
+    
+        others = [j for j in new_positions.get(key, ()) if new_map[j] is None]
+        others.reverse()
+        
+        for i in positions:
+            if not others:
+                break
+            if old_map[i] is None:
+                j = others.pop()
+                old_map[i] = j
+                new_map[j] = i
+    
+    return old_map, new_map
+
+def diff_code(result, old, new):
+
+    old_blocks = basic_blocks(old.code, function_entries(old),
+                              cases.tables(old))
+    new_blocks = basic_blocks(new.code, function_entries(new),
+                              cases.tables(new))
+    
+    old_keys = [block_key(old.code, block) for block in old_blocks]
+    new_keys = [block_key(new.code, block) for block in new_blocks]
+    
+    old_map, new_map = match(old_keys, new_keys)
+    
+    old_starts = dict((block.start, i) for i, block in enumerate(old_blocks))
+    new_starts = dict((block.start, i) for i, block in enumerate(new_blocks))
+    
+    # Matched blocks are only unchanged if their branch and call targets refer
+    # to blocks that were also matched to each other.
+    for i, j in enumerate(old_map):
+    
+        if j is None:
+            continue
+        
+        old_block = old_blocks[i]
+        new_block = new_blocks[j]
+        offset = new_block.start - old_block.start
+        
+        for pc in xrange(old_block.start, old_block.end):
+        
+            old_ins = old.code[pc]
+            new_ins = new.code[pc + offset]
+            
+            old_target = branch_target(old_ins)
+            if old_target is None:
+                old_target = call_target(old_ins)
+                new_target = call_target(new_ins)
+            else:
+                new_target = branch_target(new_ins)
+            
+            if old_target is None:
+                continue
+            
+            k = old_starts.get(old_target)
+            if k is None or old_map[k] != new_starts.get(new_target, -1):
+                result.code.append(("changed", old_block, new_block))
+                break
+        else:
+            result.unchanged_blocks += 1
+    
+    # Pair unmatched blocks that lie between the same matched blocks in both
+    # modules, only using matches that preserve the order of the blocks.
+    pairs = dict((i, j) for i, j in enumerate(old_map) if j is not None)
+    
+    anchors = [(-1, -1)]
+    for i, j in enumerate(old_map):
+        if j is not None and j > anchors[-1][1]:
+            anchors.append((i, j))
+    anchors.append((len(old_blocks), len(new_blocks)))
+    
+    for (i0, j0), (i1, j1) in zip(anchors, anchors[1:]):
+    
+        removed = [old_blocks[i] for i in xrange(i0 + 1, i1)
+                   if old_map[i] is None]
+        added = [new_blocks[j] for j in xrange(j0 + 1, j1)
+                 if new_map[j] is None]
+        
+        for old_block, new_block in zip(removed, added):
+            result.code.append(("changed", old_block, new_block))
+            pairs[old_starts[old_block.start]] = new_starts[new_block.start]
+        
+        for old_block in removed[len(added):]:
+            result.code.append(("removed", old_block, None))
+        
+        for new_block in added[len(removed):]:
+            result.code.append(("added", None, new_block))
+    
+    # Return a function that maps old pcs to new ones where possible.
+    def map_pc(pc):
+        j = pairs.get(old_starts.get(pc))
+        if j is None:
+            return None
+        return new_blocks[j].start
+    
+    return map_pc
+
+def diff_items(old_items, new_items):
+
+    """Compares two dictionaries, returning a sorted list of (key, old value,
+    new value) tuples for the keys whose values differ."""
+    
+    changes = []
+    
+    for key in sorted(set(old_items) | set(new_items)):
+        old_value = old_items.get(key)
+        new_value = new_items.get(key)
+        if old_value != new_value:
+            changes.append((key, old_value, new_value))
+    
+    return changes
+
+def diff(old, new):
+
+    """Compares two Dis objects, returning a ModuleDiff object that describes
+    the differences between their code, types, data, links and LDTs."""
+    
+    result = ModuleDiff(old, new)
+    
+    map_pc = diff_code(result, old, new)
+    
+    for name in ("module_name", "path", "stack_extent", "data_size",
+                 "entry_type"):
+        old_value = getattr(old, name)
+        new_value = getattr(new, name)
+        if old_value != new_value:
+            result.header.append((name, old_value, new_value))
+    
+    if old.runtime_flag.value != new.runtime_flag.value:
+        result.header.append(("runtime_flag", hex(old.runtime_flag.value),
+                              hex(new.runtime_flag.value)))
+    
+    # Entry pcs that do not start blocks, such as the -1 used by modules
+    # without an entry point, are compared directly.
+    entry_pc = map_pc(old.entry_pc)
+    if entry_pc is None:
+        entry_pc = old.entry_pc
+    
+    if entry_pc != new.entry_pc:
+        result.header.append(("entry_pc", hex(old.entry_pc),
+                              hex(new.entry_pc)))
+    
+    result.types = diff_items(
+        dict((i, 'desc $0x%x, %i, "%s"' % (t.desc_number, t.size,
+              t.array.encode("hex"))) for i, t in enumerate(old.types)),
+        dict((i, 'desc $0x%x, %i, "%s"' % (t.desc_number, t.size,
+              t.array.encode("hex"))) for i, t in enumerate(new.types)))
+    
+    result.data = diff_items(
+        dict((address, (item.array_type, dbl_repr(item.data())))
+             for address, item in old.data.items()),
+        dict((address, (item.array_type, dbl_repr(item.data())))
+             for address, item in new.data.items()))
+    
+    # Links are compared by name, with their pcs compared using the mapping
+    # between the blocks of the two modules.
+    old_links = {}
+    new_links = {}
+    
+    for link in old.link:
+        pc = map_pc(link.pc)
+        if pc is None:
+            pc = "old " + hex(link.pc)
+        else:
+            pc = hex(pc)
+        old_links[link.name] = (pc, link.desc_number, hex(link.sig))
+    
+    for link in new.link:
+        new_links[link.name] = (hex(link.pc), link.desc_number, hex(link.sig))
+    
+    result.links = diff_items(old_links, new_links)
+    
+    result.ldt = diff_items(ldt_items(old), ldt_items(new))
+    
+    return result
+
+def ldt_items(d):
+
+    items = {}
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+        for i, sequence in enumerate(d.ldt):
+            for ldt in sequence:
+                items[(i, ldt.name)] = hex(ldt.sig)
+    
+    return items
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage: %s <old file> <new file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    result = diff(dis.Dis(sys.argv[1]), dis.Dis(sys.argv[2]))
+    result.list()
+    
+    sys.exit(result.changed() and 1 or 0)
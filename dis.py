@@ -38,6 +38,31 @@ class Dis:
         if file_name:
             self.read(open(file_name, "rb"), file_name)
     
+    def __getstate__(self):
+    
+        # Subclasses hold other state, so they are pickled in the usual way.
+        if self.__class__ is not Dis:
+            return self.__dict__
+        
+        # Pickle modules in the compact form used in pack files, along with
+        # any attributes that it does not hold. The pack module is imported
+        # here because it depends on this one.
+        import pack
+        extra = dict((name, value) for name, value in self.__dict__.items()
+                     if name not in pack.module_attributes)
+        return pack.to_bytes(self), extra
+    
+    def __setstate__(self, state):
+    
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+            return
+        
+        import pack
+        data, extra = state
+        self.__dict__.update(pack.from_bytes(data).__dict__)
+        self.__dict__.update(extra)
+    
     def error(self, message):
     
         if self.file_name:
@@ -91,13 +116,18 @@ class Dis:
         
         self.path = read_C(f)
     
+    def read_item(self, f, item):
+    
+        # Subclasses can reimplement this to record where each item occurs.
+        return item.read(f)
+    
     def read_code(self, f):
     
         self.code = []
         i = 0
         
         while i < self.code_size:
-            self.code.append(opcodes.Instruction().read(f))
+            self.code.append(self.read_item(f, opcodes.Instruction()))
             i += 1
     
     def read_types(self, f):
@@ -106,7 +136,7 @@ class Dis:
         i = 0
         
         while i < self.type_size:
-            self.types.append(Type().read(f))
+            self.types.append(self.read_item(f, Type()))
             i += 1
     
     def read_data(self, f):
@@ -117,10 +147,18 @@ class Dis:
         # Maintain a list of individual data items for easy inspection.
         self.data_items = []
         
+        # Keep the definitions of arrays in the order they occur, with the
+        # items used to initialise them, so that they can be written again.
+        self.arrays = []
+        
         # Use a list as a load address stack with an initial base address of 0.
+        # The arrays being initialised are held on a corresponding stack.
         addresses = []
         base = 0
         type_ = None
+        contents = self.arrays
+        containers = []
+        array = None
         
         while True:
         
@@ -146,6 +184,8 @@ class Dis:
                 type_index = _read(f, ">I")
                 length = _read(f, ">I")
                 type_ = self.types[type_index]
+                array = Array(offset, type_index, length)
+                contents.append(array)
                 #print "Array", offset
             
             elif array_type == 6:
@@ -155,11 +195,26 @@ class Dis:
                 addresses.append(base)
                 #print "Set", base, offset, index
                 base = offset + index
+                
+                # Items that follow initialise the array defined at the same
+                # offset, if there is one.
+                if array is None or array.offset != offset or \
+                   array.index is not None:
+                    array = Array(offset)
+                    contents.append(array)
+                array.index = index
+                containers.append(contents)
+                contents = array.items
+                array = None
             
             elif array_type == 7:
                 # Restore load address
+                if not addresses:
+                    raise self.error("Unmatched array end in data at 0x%x" % at)
                 base = addresses.pop()
+                contents = containers.pop()
                 type_ = None
+                array = None
                 #print "Restore", base, offset
             
             else:
@@ -168,6 +223,8 @@ class Dis:
                 item = Data(base, offset, array_type, type_)
                 item.read(f, count)
                 self.data_items.append(item)
+                if addresses:
+                    contents.append(item)
                 if address in self.data:
                     print "Overwriting existing data item at %x." % address
                 self.data[address] = item
@@ -178,7 +235,7 @@ class Dis:
         i = 0
         
         while i < self.link_size:
-            self.link.append(Link().read(f))
+            self.link.append(self.read_item(f, Link()))
             i += 1
     
     def read_ldt(self, f):
@@ -204,7 +261,7 @@ class Dis:
             i = 0
             while i < value:
             
-                sequence.append(LDT().read(f))
+                sequence.append(self.read_item(f, LDT()))
                 i += 1
             
             self.ldt.append(sequence)
@@ -221,7 +278,7 @@ class Dis:
         
         while i < number:
         
-            self.exceptions.append(ExceptionInfo().read(f))
+            self.exceptions.append(self.read_item(f, ExceptionInfo()))
             i += 1
         
         # Discard the dummy value that occurs after a set of exceptions.
@@ -234,8 +291,12 @@ class Dis:
         self.type_size = len(self.types)
         self.link_size = len(self.link)
         
-        # Only unsigned files are currently supported.
-        write_OP(f, XMAGIC)
+        if getattr(self, "signed", False):
+            write_OP(f, SMAGIC)
+            _write(f, ">I", len(self.signature))
+            f.write(self.signature)
+        else:
+            write_OP(f, XMAGIC)
         
         self.runtime_flag.write(f)
         write_OP(f, self.stack_extent)
@@ -258,6 +319,9 @@ class Dis:
         if self.runtime_flag.contains(RuntimeFlag.HASLDT):
             self.write_ldt(f)
         
+        if self.runtime_flag.contains(RuntimeFlag.HASEXCEPT):
+            self.write_exceptions(f)
+        
         write_C(f, self.path)
     
     def write_code(self, f):
@@ -272,39 +336,69 @@ class Dis:
     
     def write_data(self, f):
     
-        # Sort the dictionary items by address.
-        items = self.data.items()
-        items.sort()
+        # Write the items at the top level and the arrays defined there in
+        # order of their offsets.
+        entries = []
+        for address, item in self.data.items():
+            if item.base == 0:
+                entries.append((item.offset, 0, item))
         
-        addresses = []
-        base = 0
+        arrays = getattr(self, "arrays", [])
+        for array in arrays:
+            entries.append((array.offset, 1, array))
         
-        for address, item in items:
+        written = set()
+        entries.sort()
         
-            if item.base != base:
-            
-                # Array
-                write_B(f, 0x51)                # use count=1 to save a word
-                write_OP(f, item.base - base)   # offset
-                _write(f, ">I", self.types.index(item.type_))
-                _write(f, ">I", len(item.data))
-                
-                # Set array address
-                write_B(f, 0x61)                # use count=1 to save a word
-                write_OP(f, item.base - base)   # offset
-                _write(f, ">I", 0)              # index
-            
-            item.write(f)
-            
-            if item.base != base:
-            
-                # Restore load address
-                write_B(f, 0x71)                # use count=1 to save a word
-                write_OP(f, 0)                  # offset
-                base = addresses.pop()
+        for offset, kind, entry in entries:
+            self.write_data_entry(f, entry, written)
+        
+        # Items in arrays that have no definitions are written in arrays
+        # that are only used to set their base addresses.
+        bases = {}
+        for address, item in self.data.items():
+            if id(item) not in written:
+                bases.setdefault(item.base, []).append((item.offset, item))
+        
+        for base, items in sorted(bases.items()):
+            array = Array(base, index = 0)
+            array.items = [item for offset, item in sorted(items)]
+            self.write_data_entry(f, array, written)
         
         write_OP(f, 0)
     
+    def write_data_entry(self, f, entry, written):
+    
+        if isinstance(entry, Data):
+            # Use the current item at the address of the one that was read,
+            # skipping it if it has been removed.
+            item = self.data.get(entry.base + entry.offset)
+            if item is not None and id(item) not in written:
+                item.write(f)
+                written.add(id(item))
+            return
+        
+        if entry.type_index is not None:
+            # Array
+            write_B(f, 0x51)                # use count=1 to save a word
+            write_OP(f, entry.offset)
+            _write(f, ">I", entry.type_index)
+            _write(f, ">I", entry.length)
+        
+        if entry.index is not None:
+        
+            # Set array address
+            write_B(f, 0x61)                # use count=1 to save a word
+            write_OP(f, entry.offset)
+            _write(f, ">I", entry.index)
+            
+            for item in entry.items:
+                self.write_data_entry(f, item, written)
+            
+            # Restore load address
+            write_B(f, 0x71)                # use count=1 to save a word
+            write_OP(f, 0)                  # offset
+    
     def write_link(self, f):
     
         for link in self.link:
@@ -322,11 +416,31 @@ class Dis:
                 ldt.write(f)
         
         write_OP(f, 0)
+        
+        # Write the dummy value that is expected after an empty set of LDTs.
+        if not self.ldt:
+            write_OP(f, 0)
+    
+    def write_exceptions(self, f):
+    
+        write_OP(f, len(self.exceptions))
+        
+        for exception in self.exceptions:
+            exception.write(f)
+        
+        write_OP(f, 0)
     
     def list(self):
     
+        # Describe the jump tables used by case instructions in comments.
+        import cases
+        tables = cases.tables(self)
+        
         for i, ins in enumerate(self.code):
             print hex(i) + ":", str(ins)
+            if i in tables:
+                for line in tables[i].lines():
+                    print "#  ", line
         
         print
         print "entry %s, %i" % (hex(self.entry_pc), self.entry_type)
@@ -344,8 +458,12 @@ class Dis:
         for address, item in items:
             if item.array_type == 3:
                 print 'string @mp+%i, %s' % (address, dbl_repr(item.data()))
+            elif item.array_type == 4:
+                print 'real @mp+%i, %s' % (address,
+                    ", ".join(map(repr, item.data())))
             else:
-                print "?",
+                print '%s @mp+%i, %s' % (Data.names[item.array_type], address,
+                    ", ".join(map(str, item.data())))
         
         print
         print "module", self.module_name
@@ -378,6 +496,19 @@ class Dis:
                 if i % 4 == 1:
                     start += 4
         
+        if self.runtime_flag.contains(RuntimeFlag.HASEXCEPT):
+            print
+            print "exceptions %i" % len(self.exceptions)
+            
+            for exception in self.exceptions:
+                print "exception %s, %s, %i, %i, %i" % (hex(exception.p1),
+                    hex(exception.p2), exception.offset, exception.desc,
+                    exception.ne)
+                for name, pc in exception.pcs:
+                    print "except %s, %s" % (dbl_repr(name), hex(pc))
+                if exception.pc != -1:
+                    print "except *, %s" % hex(exception.pc)
+        
         print
         print "source %s" % dbl_repr(self.path)
 
@@ -413,6 +544,21 @@ class Type:
         self.size = size
         self.array = array
     
+    def set_pointers(self, offsets):
+    
+        # Create a pointer bitmap with bits set for the words at the given
+        # offsets, omitting any trailing bytes without pointers.
+        values = []
+        
+        for offset in offsets:
+            bit = offset / 4
+            while bit / 8 >= len(values):
+                values.append(0)
+            values[bit / 8] |= 0x80 >> (bit % 8)
+        
+        self.array = "".join(map(chr, values))
+        return self
+    
     def read(self, f):
     
         self.desc_number = read_OP(f)
@@ -425,7 +571,7 @@ class Type:
     def __repr__(self):
     
         return "Type(desc=%i, size=%i, ptrs=%i, array=%s)" % (self.desc_number,
-            self.size, self.number_ptrs, repr(self.array))
+            self.size, len(self.array), repr(self.array))
     
     def is_pointer(self, address):
     
@@ -434,12 +580,30 @@ class Type:
         
         # Convert the address of a word to a bit offset in the array.
         bit = address / 4
+        # Words beyond the end of the array do not contain pointers.
+        if bit / 8 >= len(self.array):
+            return False
         # Extract the byte containing the bit we want to check.
         byte = self.array[bit / 8]
         # Check whether the bit is 1 or 0, returning True for 1 and False for 0.
-        mask = 1 << (bit % 8)
+        # The first word in each byte is represented by the most significant
+        # bit.
+        mask = 0x80 >> (bit % 8)
         return (ord(byte) & mask) != 0
     
+    def pointers(self):
+    
+        # Return the offsets of the words that contain pointers.
+        offsets = []
+        
+        for i, byte in enumerate(self.array):
+            value = ord(byte)
+            for j in range(8):
+                if value & (0x80 >> j):
+                    offsets.append((i * 8 + j) * 4)
+        
+        return offsets
+    
     def write(self, f):
     
         write_OP(f, self.desc_number)
@@ -454,6 +618,12 @@ class Data:
                    "UTF-8 encoded string", "64-bit float", "Array",
                    "Set array address", "Restore load address"]
     
+    # Names used for data items in assembly language listings.
+    names = {1: "byte", 2: "word", 3: "string", 4: "real", 8: "long"}
+    
+    # The sizes of the values in each type of array.
+    item_sizes = {1: 1, 2: 4, 3: 1, 4: 8, 8: 8}
+    
     def __init__(self, base, offset, array_type, type_ = None, array = None):
     
         self.base = base
@@ -507,6 +677,15 @@ class Data:
         else:
             return self.array
     
+    def size(self):
+    
+        # Return the number of bytes used in the module data, where strings
+        # are represented by pointers.
+        if self.array_type == 3:
+            return 4
+        else:
+            return self.item_sizes[self.array_type] * len(self.array)
+    
     def encoded(self):
     
         """Returns the contents of the array in the form they would take if
@@ -534,12 +713,13 @@ class Data:
         code = self.array_type << 4
         count = len(self.array)
         
-        if count < 16:
+        # A count of zero in the code means that the count follows it.
+        if 0 < count < 16:
             code |= count
         
         write_B(f, code)
         
-        if count >= 16:
+        if not 0 < count < 16:
             write_OP(f, count)
         
         write_OP(f, self.offset)
@@ -558,6 +738,30 @@ class Data:
                 write_L(f, item)
 
 
+class Array:
+
+    """Describes an array in the module data that is created when the module
+    is loaded. The offset is the offset of the word that holds a pointer to
+    the array. If the type index is None then the array is not created, but
+    only used to set the base address of the items that follow. If the index
+    is None then the array is not initialised, otherwise its items are the
+    Data and Array objects that are placed in it, starting at the index."""
+    
+    def __init__(self, offset, type_index = None, length = 0, index = None):
+    
+        self.offset = offset
+        self.type_index = type_index
+        self.length = length
+        self.index = index
+        self.items = []
+    
+    def __repr__(self):
+    
+        return "Array(offset=%i, type=%s, length=%i, index=%s, items=%i)" % (
+            self.offset, self.type_index, self.length, self.index,
+            len(self.items))
+
+
 class Link:
 
     def __init__(self, pc = 0, desc_number = 0, sig = 0, name = ""):
@@ -627,6 +831,9 @@ class ExceptionInfo:
         else:
             self.desc = -1
         
+        # The number of labels is taken from the list of (name, pc) pairs.
+        self.ne = nlab_ne >> 16
+        
         if pcs:
             self.pcs = pcs
         else:
@@ -664,3 +871,23 @@ class ExceptionInfo:
         self.pc = read_OP(f)
         
         return self
+    
+    def __repr__(self):
+    
+        return "ExceptionInfo(offset=%i, p1=%s, p2=%s, desc=%i, pcs=%s, " \
+               "pc=%s)" % (self.offset, hex(self.p1), hex(self.p2), self.desc,
+                           repr(self.pcs), hex(self.pc))
+    
+    def write(self, f):
+    
+        write_OP(f, self.offset)
+        write_OP(f, self.p1)
+        write_OP(f, self.p2)
+        write_OP(f, self.desc)
+        write_OP(f, (self.ne << 16) | len(self.pcs))
+        
+        for name, pc in self.pcs:
+            write_C(f, name)
+            write_OP(f, pc)
+        
+        write_OP(f, self.pc)
@@ -0,0 +1,195 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+
+import dis
+from utils import _write, write_B, write_C, write_OP, write_long_OP
+
+# The amount of data held in memory for each spooled section before it is
+# written to a temporary file.
+SPOOL_SIZE = 1 << 20
+
+
+class EmitError(Exception):
+    pass
+
+
+class Emitter:
+
+    """Writes a module to a file as it is generated, without keeping its
+    instructions, types, data items or links in memory. Data items in arrays
+    are added with the Array objects that contain them.
+    
+    The header is written first with space reserved for the values that are
+    not known until the module is complete, then instructions are written
+    directly to the file. Types, data items and links are encoded into
+    temporary buffers that are copied to the file, after the code, when the
+    finish method is called, before the header is updated. The file must
+    therefore support seeking."""
+    
+    def __init__(self, f, stack_extent = 0, runtime_flag = 0):
+    
+        self.f = f
+        self.stack_extent = stack_extent
+        self.runtime_flag = dis.RuntimeFlag(runtime_flag)
+        
+        self.code_size = 0
+        self.type_size = 0
+        self.link_size = 0
+        self.entry_pc = 0
+        self.entry_type = 0
+        
+        # The size of the module data is found from the first type, which
+        # describes it, and the data items unless it is set explicitly.
+        self.data_size = None
+        self.data_end = 0
+        
+        self.module_name = ""
+        self.path = ""
+        self.ldt = None
+        self.initialised_globals = 0
+        self.exceptions = None
+        
+        self.types = SpooledTemporaryFile(SPOOL_SIZE)
+        self.data = SpooledTemporaryFile(SPOOL_SIZE)
+        self.links = SpooledTemporaryFile(SPOOL_SIZE)
+        
+        write_OP(f, dis.XMAGIC)
+        self.header = f.tell()
+        self.write_header()
+    
+    def write_header(self):
+    
+        for value in (self.runtime_flag.value, self.stack_extent,
+                      self.code_size, self.get_data_size(), self.type_size,
+                      self.link_size, self.entry_pc, self.entry_type):
+            write_long_OP(self.f, value)
+    
+    def get_data_size(self):
+    
+        if self.data_size is None:
+            return (self.data_end + 3) & ~3
+        else:
+            return self.data_size
+    
+    def emit(self, ins):
+    
+        """Writes the instruction to the file, returning its pc."""
+        
+        ins.write(self.f)
+        self.code_size += 1
+        return self.code_size - 1
+    
+    def add_type(self, type_):
+    
+        type_.write(self.types)
+        if self.type_size == 0:
+            self.data_end = max(self.data_end, type_.size)
+        self.type_size += 1
+    
+    def add_data(self, item):
+    
+        # Items in arrays are written with the arrays that contain them.
+        if item.base != 0:
+            raise EmitError("Data item at offset %i is in an array." %
+                            item.offset)
+        
+        item.write(self.data)
+        self.data_end = max(self.data_end, item.offset + item.size())
+    
+    def add_array(self, array):
+    
+        """Writes the Array object, array, which describes an array in the
+        module data, and the data items and arrays it contains."""
+        
+        self.write_array(array)
+        self.data_end = max(self.data_end, array.offset + 4)
+    
+    def write_array(self, array):
+    
+        f = self.data
+        
+        if array.type_index is not None:
+            write_B(f, 0x51)
+            write_OP(f, array.offset)
+            _write(f, ">I", array.type_index)
+            _write(f, ">I", array.length)
+        
+        if array.index is not None:
+        
+            # Set the base address of the items, then restore it.
+            write_B(f, 0x61)
+            write_OP(f, array.offset)
+            _write(f, ">I", array.index)
+            
+            for item in array.items:
+                if isinstance(item, dis.Array):
+                    self.write_array(item)
+                else:
+                    item.write(f)
+            
+            write_B(f, 0x71)
+            write_OP(f, 0)
+    
+    def add_link(self, link):
+    
+        link.write(self.links)
+        self.link_size += 1
+    
+    def finish(self):
+    
+        """Writes the remaining sections of the module to the file and updates
+        the header with the sizes of the sections."""
+        
+        f = self.f
+        
+        for spool in self.types, self.data:
+            spool.seek(0)
+            copyfileobj(spool, f)
+            spool.close()
+        
+        # Terminate the data section.
+        write_OP(f, 0)
+        
+        write_C(f, self.module_name)
+        
+        self.links.seek(0)
+        copyfileobj(self.links, f)
+        self.links.close()
+        
+        d = dis.Dis()
+        d.runtime_flag = self.runtime_flag
+        
+        if self.ldt is not None:
+            self.runtime_flag.value |= dis.RuntimeFlag.HASLDT
+            d.ldt = self.ldt
+            d.initialised_globals = self.initialised_globals
+            d.write_ldt(f)
+        
+        if self.exceptions is not None:
+            self.runtime_flag.value |= dis.RuntimeFlag.HASEXCEPT
+            d.exceptions = self.exceptions
+            d.write_exceptions(f)
+        
+        write_C(f, self.path)
+        
+        end = f.tell()
+        f.seek(self.header)
+        self.write_header()
+        f.seek(end)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from cStringIO import StringIO
+from types import InstanceType
+
+import opcodes
+from corpus import Corpus
+from pipeline import Pipeline
+
+# The attributes of modules that hold each section. Other attributes are
+# counted as part of the header.
+sections = (
+    ("code", ("code",)),
+    ("types", ("types",)),
+    ("data", ("data", "data_items", "arrays")),
+    ("link", ("link",)),
+    ("ldt", ("ldt", "initialised_globals")),
+    ("exceptions", ("exceptions",))
+    )
+
+section_names = ("header",) + tuple(name for name, attributes in sections)
+
+
+def cached(obj):
+
+    """Returns True if the object is one that the interpreter shares between
+    all the places it is used, so that it does not belong to any module."""
+    
+    if obj is None or obj is True or obj is False or obj == ():
+        return True
+    elif type(obj) is int:
+        return -5 <= obj <= 256
+    elif type(obj) is str:
+        return len(obj) <= 1
+    
+    return False
+
+def kind(obj):
+
+    # Instructions and operands are grouped together whatever their classes.
+    if isinstance(obj, opcodes.Instruction):
+        return "Instruction"
+    elif isinstance(obj, opcodes.Operand) or \
+         isinstance(obj, opcodes.NoOperand):
+        return "Operand"
+    elif type(obj) is InstanceType:
+        return obj.__class__.__name__
+    
+    return type(obj).__name__
+
+def encoded_size(d):
+
+    """Returns the number of bytes used by the module, d, when written, which
+    is the size of the file it was read from."""
+    
+    f = StringIO()
+    d.write(f)
+    return f.tell()
+
+
+class Footprint:
+
+    """Measures the memory used by the objects that make up decoded modules,
+    recording the number of bytes used by each section of the modules and by
+    each kind of object.
+    
+    Instructions, operands and the other objects that represent parts of
+    modules are described by their class names. The lists, strings, numbers
+    and other built-in objects they hold are described by the name of their
+    type, prefixed by the kind of object holding them, so that the lists
+    holding the characters of strings in data items are described as
+    "Data list", for example.
+    
+    Each object is only counted once, so that objects shared between modules
+    added to the same Footprint are only counted for the first module that
+    uses them. Objects that the interpreter shares between all their uses,
+    such as small integers and single characters, are not counted. Sizes are
+    those given by sys.getsizeof and do not include the overhead of the
+    memory allocator."""
+    
+    def __init__(self):
+    
+        self.modules = 0
+        self.disk_size = 0
+        self.sections = dict.fromkeys(section_names, 0)
+        
+        # Map each kind of object to the number of objects and their size.
+        self.kinds = {}
+        
+        self.seen = set()
+    
+    def add(self, d, disk_size = None):
+    
+        """Measures the objects used by the module, d, that have not already
+        been measured. The size of the module on disk is obtained by writing
+        it if it is not given."""
+        
+        if id(d) in self.seen:
+            return
+        self.seen.add(id(d))
+        
+        if disk_size is None:
+            disk_size = encoded_size(d)
+        
+        self.modules += 1
+        self.disk_size += disk_size
+        
+        attributes = dict(d.__dict__)
+        
+        for name, names in sections:
+            for attribute in names:
+                if attribute in attributes:
+                    self.measure(name, attributes.pop(attribute), "Dis")
+        
+        # The module object itself and any remaining attributes form the
+        # header.
+        self.count("header", "Dis", sys.getsizeof(d) +
+                                    sys.getsizeof(d.__dict__))
+        
+        for value in attributes.values():
+            self.measure("header", value, "Dis")
+    
+    def count(self, section, name, size):
+    
+        self.sections[section] += size
+        
+        entry = self.kinds.setdefault(name, [0, 0])
+        entry[0] += 1
+        entry[1] += size
+    
+    def measure(self, section, obj, owner):
+    
+        # Visit the objects without recursion, keeping the kind of the
+        # nearest object that holds each one.
+        pending = [(obj, owner)]
+        
+        while pending:
+        
+            obj, owner = pending.pop()
+            
+            if id(obj) in self.seen or cached(obj):
+                continue
+            self.seen.add(id(obj))
+            
+            if type(obj) is InstanceType:
+            
+                # Include the dictionary holding the attributes of instances
+                # but not the names of the attributes, which are interned.
+                owner = kind(obj)
+                self.count(section, owner, sys.getsizeof(obj) +
+                                           sys.getsizeof(obj.__dict__))
+                
+                for value in obj.__dict__.values():
+                    pending.append((value, owner))
+                continue
+            
+            self.count(section, owner + " " + kind(obj), sys.getsizeof(obj))
+            
+            if isinstance(obj, dict):
+                for key, value in obj.items():
+                    pending.append((key, owner))
+                    pending.append((value, owner))
+            
+            elif isinstance(obj, list) or isinstance(obj, tuple) or \
+                 isinstance(obj, set):
+                for value in obj:
+                    pending.append((value, owner))
+    
+    def merge(self, other):
+    
+        """Adds the measurements of another Footprint to this one, assuming
+        that the modules they measured do not share any objects."""
+        
+        self.modules += other.modules
+        self.disk_size += other.disk_size
+        
+        for name, size in other.sections.items():
+            self.sections[name] += size
+        
+        for name, (number, size) in other.kinds.items():
+            entry = self.kinds.setdefault(name, [0, 0])
+            entry[0] += number
+            entry[1] += size
+    
+    def size(self):
+    
+        """Returns the total number of bytes used by the objects measured."""
+        
+        return sum(self.sections.values())
+    
+    def ratio(self):
+    
+        if self.disk_size == 0:
+            return 0.0
+        return float(self.size()) / self.disk_size
+    
+    def ranked_kinds(self):
+    
+        """Returns a list of (kind, number, size) tuples, with the kinds that
+        use the most memory first."""
+        
+        return sorted([(name, number, size) for name, (number, size)
+                       in self.kinds.items()],
+                      key = lambda item: (-item[2], item[0]))
+    
+    def list(self, limit = 20):
+    
+        total = self.size()
+        
+        print "%i modules, %i bytes on disk, %i bytes in memory " \
+              "(%.1f times)" % (self.modules, self.disk_size, total,
+                                self.ratio())
+        print
+        
+        print "Sections"
+        for name in section_names:
+            size = self.sections[name]
+            print "%10i  %5.1f%%  %s" % (size, percent(size, total), name)
+        print
+        
+        print "Objects"
+        for name, number, size in self.ranked_kinds()[:limit]:
+            print "%10i  %5.1f%%  %8i  %s" % (size, percent(size, total),
+                                              number, name)
+
+
+def percent(size, total):
+
+    if total == 0:
+        return 0.0
+    return size * 100.0 / total
+
+def footprint(d):
+
+    """Returns a Footprint describing the memory used by the module, d."""
+    
+    f = Footprint()
+    f.add(d)
+    return f
+
+def corpus_footprint(corpus):
+
+    """Returns a Footprint describing the memory used by the modules in the
+    Corpus, counting the objects they share only once. The tables used by the
+    corpus to find shared objects are not included."""
+    
+    f = Footprint()
+    for name, d in sorted(corpus.modules.items()):
+        f.add(d)
+    return f
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    limit = 20
+    shared = False
+    
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option == "-l" and args:
+            limit = int(args.pop(0))
+        elif option == "-c":
+            shared = True
+        else:
+            args = []
+    
+    if not args:
+        sys.stderr.write("Usage: %s [-l <limit>] [-c] "
+                         "<file, directory or archive> ...\n" % sys.argv[0])
+        sys.exit(1)
+    
+    total = Footprint()
+    corpus = Corpus()
+    
+    for file_name, d, error in Pipeline(args):
+    
+        if error:
+            sys.stderr.write("%s: %s\n" % (file_name, error))
+            continue
+        
+        # Measure each module separately so that it is not kept, unless the
+        # modules are to share objects in a corpus.
+        if shared:
+            corpus.add(d, file_name)
+        else:
+            total.merge(footprint(d))
+    
+    if shared:
+        total = corpus_footprint(corpus)
+    
+    total.list(limit)
+    
+    sys.exit()
@@ -0,0 +1,248 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from bisect import bisect_left
+from heapq import heappop, heappush
+
+import dis
+import opcodes
+from blocks import branch_target
+
+# The size of the frame header used by the interpreter. Arguments and local
+# variables follow it.
+FRAME_HEADER = 32
+
+
+class Register:
+
+    """A virtual register that can be used as an operand in generated code
+    in place of a frame offset. Registers containing pointers are allocated
+    separately from those containing other values so that they can be found
+    by the garbage collector. Non-pointer registers may be 4 or 8 bytes in
+    size."""
+    
+    middle_address_mode = opcodes.ShortOffsetFP.middle_address_mode
+    address_mode = opcodes.LongOffsetFP.address_mode
+    
+    def __init__(self, name = None, pointer = False, size = 4):
+    
+        self.name = name
+        self.pointer = pointer
+        self.size = size
+        self.offset = None
+    
+    def __str__(self):
+    
+        if self.name:
+            return "%" + self.name
+        else:
+            return "%%%x" % id(self)
+    
+    def __getitem__(self, offset):
+    
+        # Allow register[offset] to describe a field of the object that the
+        # register points to.
+        return Indirect(self, offset)
+    
+    def key(self):
+        return (self.__class__, id(self))
+    
+    def write(self, f):
+        raise dis.DisError("Unallocated register %s." % self)
+
+
+class Indirect:
+
+    """An operand that refers to the word at the given offset in the object
+    that a register points to, such as a field in a new frame."""
+    
+    # Indirect operands cannot be used as middle operands.
+    middle_address_mode = opcodes.NoOperand.middle_address_mode
+    address_mode = opcodes.DoubleShortOffsetFP.address_mode
+    
+    def __init__(self, register, offset):
+    
+        self.register = register
+        self.offset = offset
+    
+    def __str__(self):
+        return "%i(%s)" % (self.offset, self.register)
+    
+    def key(self):
+        return (self.__class__, id(self.register), self.offset)
+    
+    def write(self, f):
+        raise dis.DisError("Unallocated register %s." % self.register)
+
+
+def register_of(operand):
+
+    if isinstance(operand, Register):
+        return operand
+    elif isinstance(operand, Indirect):
+        return operand.register
+    
+    return None
+
+def live_ranges(code):
+
+    """Returns a dictionary mapping each register used in the code to a list
+    containing the first and last pcs where it is live."""
+    
+    ranges = {}
+    
+    for pc, ins in enumerate(code):
+        for operand in ins.source, ins.middle, ins.destination:
+            register = register_of(operand)
+            if register is not None:
+                if register in ranges:
+                    ranges[register][1] = pc
+                else:
+                    ranges[register] = [pc, pc]
+    
+    # The address of a register taken with lea is usually stored in a new
+    # frame so that the called function can write its result, so keep the
+    # register live until the next call.
+    call_flags = opcodes.CALL | opcodes.MODULE_CALL
+    calls = [pc for pc, ins in enumerate(code)
+             if opcodes.flags[ins.opcode] & call_flags]
+    
+    for pc, ins in enumerate(code):
+        if isinstance(ins, opcodes.lea) and isinstance(ins.source, Register):
+            live = ranges[ins.source]
+            i = bisect_left(calls, live[1])
+            if i < len(calls):
+                live[1] = calls[i]
+    
+    # A register that is live at the start of a loop is live throughout it,
+    # so extend its range to each backward branch that jumps over its end.
+    loops = []
+    for pc, ins in enumerate(code):
+        target = branch_target(ins)
+        if target is not None and target <= pc:
+            loops.append((target, pc))
+    
+    changed = True
+    while changed:
+        changed = False
+        for target, pc in loops:
+            for live in ranges.values():
+                if live[0] < target <= live[1] < pc:
+                    live[1] = pc
+                    changed = True
+    
+    return ranges
+
+def pack(ranges):
+
+    """Assigns slot numbers to the registers whose live ranges are given in
+    the dictionary, reusing slots where ranges do not overlap, and returns
+    the number of slots used."""
+    
+    intervals = sorted((start, end, id(register), register)
+                       for register, (start, end) in ranges.items())
+    active = []
+    free = []
+    slots = 0
+    slot_of = {}
+    
+    for start, end, ident, register in intervals:
+    
+        # Release the slots of registers that are no longer live.
+        while active and active[0][0] < start:
+            heappush(free, heappop(active)[1])
+        
+        if free:
+            slot = heappop(free)
+        else:
+            slot = slots
+            slots += 1
+        
+        slot_of[register] = slot
+        heappush(active, (end, slot))
+    
+    return slots, slot_of
+
+def allocate(code, desc_number, base = FRAME_HEADER, pointers = ()):
+
+    """Allocates frame offsets to the registers used in the code, replacing
+    the Register and Indirect operands with frame offsets, and returns a Type
+    describing the frame.
+    
+    The base is the offset of the first word that may be used for registers,
+    after the header and any arguments, and pointers contains the offsets of
+    arguments that hold pointers. Pointer registers are placed first, followed
+    by words, then by 8-byte values aligned to 8-byte boundaries."""
+    
+    ranges = live_ranges(code)
+    
+    pools = ([], [], [])
+    for register in ranges:
+        if register.pointer:
+            pools[0].append(register)
+        elif register.size == 8:
+            pools[2].append(register)
+        else:
+            pools[1].append(register)
+    
+    offset = base
+    pointer_offsets = list(pointers)
+    
+    for pool, size in zip(pools, (4, 4, 8)):
+    
+        if size == 8 and offset % 8 != 0:
+            offset += 4
+        
+        slots, slot_of = pack(dict((register, ranges[register])
+                                   for register in pool))
+        
+        for register in pool:
+            register.offset = offset + slot_of[register] * size
+            if register.pointer:
+                pointer_offsets.append(register.offset)
+        
+        offset += slots * size
+    
+    # Frames are a whole number of 8-byte units in size.
+    if offset % 8 != 0:
+        offset += 4
+    
+    for ins in code:
+        ins.source = rewrite(ins.source)
+        ins.middle = rewrite(ins.middle, True)
+        ins.destination = rewrite(ins.destination)
+        ins.set_address_mode()
+    
+    return dis.Type(desc_number, offset).set_pointers(sorted(pointer_offsets))
+
+def rewrite(operand, middle = False):
+
+    if isinstance(operand, Register):
+        if middle:
+            return opcodes.ShortOffsetFP(operand.offset, "SO(FP)")
+        else:
+            return opcodes.LongOffsetFP(operand.offset, "LO(FP)")
+    
+    elif isinstance(operand, Indirect):
+        if middle:
+            raise dis.DisError("Indirect operand %s used as a middle operand." %
+                               operand)
+        return opcodes.DoubleShortOffsetFP(operand.offset,
+                                           operand.register.offset,
+                                           "SO(SO(FP))")
+    
+    return operand
@@ -0,0 +1,93 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from bisect import bisect_right
+
+import dis
+
+
+class HandlerIndex:
+
+    """Indexes the exception handlers of a module by the ranges of pcs that
+    they cover so that the handlers for a pc can be found using a binary
+    search.
+    
+    Each handler covers the pcs from p1 up to, but not including, p2. The pcs
+    where handlers start or stop divide the code into segments, each of which
+    is covered by the same handlers, in the order that they occur in the
+    module, for every pc it contains. The interpreter uses the first of these
+    that handles an exception."""
+    
+    def __init__(self, exceptions):
+    
+        self.exceptions = exceptions
+        
+        events = {}
+        for i, exception in enumerate(exceptions):
+            if exception.p1 < exception.p2:
+                events.setdefault(exception.p1, []).append((1, i))
+                events.setdefault(exception.p2, []).append((-1, i))
+        
+        self.starts = sorted(events)
+        self.segments = []
+        
+        active = set()
+        for pc in self.starts:
+            for change, i in events[pc]:
+                if change == 1:
+                    active.add(i)
+                else:
+                    active.discard(i)
+            self.segments.append(tuple(exceptions[i] for i in sorted(active)))
+    
+    def covering(self, pc):
+    
+        """Returns a tuple containing the handlers that cover the pc."""
+        
+        i = bisect_right(self.starts, pc) - 1
+        if i < 0:
+            return ()
+        
+        return self.segments[i]
+    
+    def find(self, pc, name):
+    
+        """Returns a tuple containing the handler that catches the exception
+        with the given name at the pc and the pc of the code that handles it,
+        or None if the exception is not handled."""
+        
+        for exception in self.covering(pc):
+        
+            for label, handler_pc in exception.pcs:
+                if label == name or \
+                   (label.endswith("*") and name.startswith(label[:-1])):
+                    return exception, handler_pc
+            
+            if exception.pc != -1:
+                return exception, exception.pc
+        
+        return None
+
+
+def index(d):
+
+    """Returns a HandlerIndex for the exception handlers in the module, d."""
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+        return HandlerIndex(d.exceptions)
+    else:
+        return HandlerIndex([])
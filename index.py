@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import marshal, re, sys, zlib
+from array import array
+from struct import calcsize, pack, unpack
+
+import dis, opcodes
+from pack import from_array, to_array
+from pipeline import Pipeline
+
+# An index file starts with a header containing the magic string, the version
+# of the format and the offset of the directory, which is written at the end
+# of the file using the marshal module.
+MAGIC = "DISINDEX"
+VERSION = 1
+HEADER = ">8sIQ"
+
+# The positions of operands used in terms.
+positions = ("src", "mid", "dst")
+
+# Prefixes of terms that describe whole modules instead of instructions.
+module_prefixes = ("import", "link", "module")
+
+immediate_re = re.compile(r"^\$(-?(0x[0-9a-fA-F]+|[0-9]+))$")
+
+
+def instruction_terms(ins):
+
+    """Returns a list of the terms that describe the instruction, ins."""
+    
+    terms = ["op:" + ins.__class__.__name__]
+    
+    for position, operand in zip(positions, (ins.source, ins.middle,
+                                             ins.destination)):
+        if not isinstance(operand, opcodes.NoOperand):
+            terms.append(position + ":" + str(operand))
+    
+    for operand in opcodes.uses(ins):
+        terms.append("read:" + str(operand))
+    
+    for operand in opcodes.defs(ins):
+        terms.append("write:" + str(operand))
+    
+    return terms
+
+def module_terms(d):
+
+    """Returns a list of the terms that describe the module, d, as a whole,
+    followed by a list of the terms for each of its instructions."""
+    
+    terms = set(["module:" + d.module_name])
+    
+    for link in d.link:
+        terms.add("link:" + link.name)
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+        for sequence in d.ldt:
+            for ldt in sequence:
+                terms.add("import:" + ldt.name)
+    
+    return sorted(terms), [instruction_terms(ins) for ins in d.code]
+
+def normalise(term):
+
+    """Returns the term in the form used in the index, accepting decimal
+    immediate values and terms without a prefix, which are treated as
+    instruction names."""
+    
+    if ":" not in term:
+        return "op:" + term
+    
+    prefix, value = term.split(":", 1)
+    
+    match = immediate_re.match(value)
+    if match:
+        value = str(opcodes.Immediate(int(match.group(1), 0)))
+    
+    return prefix + ":" + value
+
+
+class IndexBuilder:
+
+    """Collects the terms that describe modules and their instructions and
+    writes them to an index file.
+    
+    The postings for each term are the pcs of the instructions it describes,
+    grouped by module. Each group of pcs is sorted, and the module numbers are
+    stored as differences between consecutive groups, before the postings are
+    compressed."""
+    
+    def __init__(self):
+    
+        self.modules = []
+        self.postings = {}
+    
+    def add(self, d, name = None):
+    
+        """Adds the module, d, to the index under the given name or the name
+        of the file it was read from."""
+        
+        self.add_terms(name or d.file_name, module_terms(d))
+    
+    def add_terms(self, name, terms):
+    
+        number = len(self.modules)
+        self.modules.append(name)
+        whole, code = terms
+        
+        for term in whole:
+            self.posting(term, number).append(-1)
+        
+        for pc, pc_terms in enumerate(code):
+            for term in pc_terms:
+                self.posting(term, number).append(pc)
+    
+    def posting(self, term, number):
+    
+        groups = self.postings.setdefault(term, [])
+        if not groups or groups[-1][0] != number:
+            groups.append((number, array("i")))
+        return groups[-1][1]
+    
+    def write(self, f):
+    
+        f.write(pack(HEADER, MAGIC, VERSION, 0))
+        directory = {}
+        
+        for term, groups in self.postings.iteritems():
+        
+            runs = array("i")
+            pcs = array("i")
+            previous = 0
+            
+            for number, group in groups:
+                runs.append(number - previous)
+                runs.append(len(group))
+                previous = number
+                pcs.extend(group)
+            
+            data = zlib.compress(from_array(runs) + from_array(pcs))
+            directory[term] = (f.tell(), len(data), len(groups))
+            f.write(data)
+        
+        offset = f.tell()
+        marshal.dump({"modules": self.modules, "terms": directory}, f)
+        
+        f.seek(0)
+        f.write(pack(HEADER, MAGIC, VERSION, offset))
+
+
+class Index:
+
+    """Provides access to an index file, reading only the directory when it
+    is opened and the postings for each term when it is used in a query."""
+    
+    def __init__(self, file_name):
+    
+        self.file_name = file_name
+        self.file = open(file_name, "rb")
+        
+        magic, version, offset = unpack(HEADER,
+                                        self.file.read(calcsize(HEADER)))
+        
+        if magic != MAGIC:
+            raise dis.DisError("Invalid index file '%s'." % file_name)
+        elif version != VERSION:
+            raise dis.DisError("Unsupported version %i of index file "
+                               "'%s'." % (version, file_name))
+        
+        self.file.seek(offset)
+        directory = marshal.load(self.file)
+        self.modules = directory["modules"]
+        self.terms = directory["terms"]
+    
+    def postings(self, term):
+    
+        """Returns a dictionary mapping the numbers of the modules that the
+        term occurs in to sets of the pcs where it occurs. Terms that describe
+        whole modules have the pc -1."""
+        
+        term = normalise(term)
+        
+        if term not in self.terms:
+            return {}
+        
+        offset, length, count = self.terms[term]
+        self.file.seek(offset)
+        data = zlib.decompress(self.file.read(length))
+        
+        runs = to_array("i", data[:count * 8])
+        pcs = to_array("i", data[count * 8:])
+        
+        found = {}
+        number = 0
+        start = 0
+        for i in xrange(0, len(runs), 2):
+            number += runs[i]
+            end = start + runs[i + 1]
+            found[number] = set(pcs[start:end])
+            start = end
+        
+        return found
+    
+    def any_postings(self, term):
+    
+        # Terms with the "any" prefix match operands in any position.
+        prefix, value = term.split(":", 1)
+        if prefix != "any":
+            return self.postings(term)
+        
+        found = {}
+        for position in positions:
+            for number, pcs in self.postings(position + ":" + value).items():
+                found.setdefault(number, set()).update(pcs)
+        
+        return found
+    
+    def query(self, *terms):
+    
+        """Returns a sorted list of (module name, pc) pairs for the
+        instructions that are described by all the terms. Terms that describe
+        whole modules, such as import:print, restrict the results to the
+        modules they describe. If only terms of that kind are given, the pc
+        in each pair is -1."""
+        
+        result = None
+        modules = None
+        
+        for term in terms:
+        
+            term = normalise(term)
+            found = self.any_postings(term)
+            
+            if term.split(":", 1)[0] in module_prefixes:
+                if modules is None:
+                    modules = set(found)
+                else:
+                    modules &= set(found)
+                continue
+            
+            if result is None:
+                result = found
+            else:
+                result = dict((number, result[number] & found[number])
+                              for number in result if number in found)
+        
+        if result is None:
+            result = dict((number, set([-1])) for number in modules or ())
+        elif modules is not None:
+            result = dict((number, pcs) for number, pcs in result.items()
+                          if number in modules)
+        
+        pairs = []
+        for number, pcs in result.items():
+            for pc in pcs:
+                pairs.append((self.modules[number], pc))
+        
+        pairs.sort()
+        return pairs
+    
+    def close(self):
+        self.file.close()
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    
+    if len(args) >= 3 and args[0] == "build":
+    
+        builder = IndexBuilder()
+        
+        for name, terms, error in Pipeline(args[2:], module_terms):
+            if error:
+                sys.stderr.write("%s: %s\n" % (name, error))
+            else:
+                builder.add_terms(name, terms)
+        
+        builder.write(open(args[1], "wb"))
+        print "Indexed %i modules." % len(builder.modules)
+    
+    elif len(args) >= 3 and args[0] == "query":
+    
+        index = Index(args[1])
+        for name, pc in index.query(*args[2:]):
+            if pc == -1:
+                print name
+            else:
+                print "%s:0x%x" % (name, pc)
+    
+    else:
+        sys.stderr.write("Usage: %s build <index file> <file or directory> "
+                         "...\n" % sys.argv[0])
+        sys.stderr.write("       %s query <index file> <term> ...\n" %
+                         sys.argv[0])
+        sys.exit(1)
+    
+    sys.exit()
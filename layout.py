@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from bisect import bisect_right
+
+import cases
+import dis
+import opcodes
+from strip import mp_offset, with_mp_offset
+
+
+def word_alignment(offset):
+
+    """Returns the largest alignment of up to a word that the offset has."""
+    
+    alignment = 4
+    while offset % alignment:
+        alignment /= 2
+    return alignment
+
+def aligned(offset, alignment, residue = 0):
+
+    """Returns the first offset at or after the given offset that leaves the
+    residue when divided by the alignment."""
+    
+    return offset + (residue - offset) % alignment
+
+
+class Slot:
+
+    """Describes a range of the module data that must be kept together and
+    the alignment that each part of it needs."""
+    
+    def __init__(self, start, end, alignment, pointer = False):
+    
+        self.start = start
+        self.end = end
+        self.members = [(start, alignment)]
+        self.pointer = pointer
+    
+    def merge(self, other):
+    
+        self.end = max(self.end, other.end)
+        self.members += other.members
+        self.pointer = self.pointer or other.pointer
+    
+    def alignment(self):
+    
+        """Returns the alignment and the residue that the new start of the
+        slot must have so that its members are aligned."""
+        
+        alignment = max(member_alignment for start, member_alignment
+                        in self.members)
+        
+        for start, member_alignment in self.members:
+            if member_alignment == alignment:
+                residue = (self.start - start) % alignment
+                break
+        
+        # If the members cannot all be aligned, keep their existing alignment.
+        for start, member_alignment in self.members:
+            if (residue + start - self.start) % member_alignment:
+                return alignment, self.start % alignment
+        
+        return alignment, residue
+
+
+class Layout:
+
+    """Moves the items in the module data of a module to new offsets so that
+    words, floats and longs are naturally aligned with as little padding as
+    possible, updating the operands that refer to them, the size of the module
+    data and the type that describes it.
+    
+    The module data is divided into slots covering the data items, the words
+    declared as pointers by the first type and the ranges referred to by the
+    code. Overlapping ranges are kept together in the same slot. Slots that
+    contain pointers are placed first, followed by the others in order of
+    decreasing alignment and size, each in the first gap that fits it. Words
+    that are not in any slot are not used and are removed.
+    
+    If the code takes the address of module data, refers to a block of module
+    data whose size is not known, or if the module data contains arrays, the
+    module data is left unchanged."""
+    
+    def __init__(self, d):
+    
+        self.d = d
+    
+    def slots(self):
+    
+        """Returns a list of the slots in the module data, sorted by offset,
+        or None if the module data cannot be rearranged."""
+        
+        d = self.d
+        mp_type = d.types[0]
+        found = []
+        
+        # The pointers to arrays are not described by data items.
+        if getattr(d, "arrays", []):
+            return None
+        
+        for item in d.data.values():
+            if item.base != 0:
+                return None
+            if item.array_type == 3:
+                found.append(Slot(item.offset, item.offset + 4, 4, True))
+            else:
+                found.append(Slot(item.offset, item.offset + item.size(),
+                                  dis.Data.item_sizes[item.array_type]))
+        
+        for offset in mp_type.pointers():
+            found.append(Slot(offset, offset + 4, 4, True))
+        
+        tables = cases.tables(d)
+        
+        for pc, ins in enumerate(d.code):
+        
+            if isinstance(ins, opcodes.lea) and \
+               mp_offset(ins.source) is not None:
+                return None
+            
+            operands = (ins.source, ins.middle, ins.destination)
+            
+            for index, operand in enumerate(operands):
+            
+                offset = mp_offset(operand)
+                if offset is None:
+                    continue
+                
+                # Indirect operands refer to the word holding a pointer.
+                if isinstance(operand, opcodes.DoubleShortOffsetMP):
+                    found.append(Slot(offset, offset + 4, 4, True))
+                    continue
+                
+                size = opcodes.width(ins, index)
+                if ins.__class__ in cases.layouts and \
+                   operand is ins.destination:
+                    # Case instructions refer to jump tables.
+                    if pc not in tables:
+                        return None
+                    size = tables[pc].size()
+                    alignment = 4
+                elif size is None:
+                    size = self.block_size(ins, offset)
+                    if size is None:
+                        return None
+                    alignment = word_alignment(offset)
+                else:
+                    alignment = size
+                
+                found.append(Slot(offset, offset + size, alignment))
+        
+        found.sort(key = lambda slot: (slot.start, slot.end))
+        
+        slots = []
+        for slot in found:
+            if slots and slot.start < slots[-1].end:
+                slots[-1].merge(slot)
+            else:
+                slots.append(slot)
+        
+        return slots
+    
+    def block_size(self, ins, offset):
+    
+        # Block moves give the size of the memory they refer to.
+        if isinstance(ins.middle, opcodes.Immediate):
+            if isinstance(ins, opcodes.movm):
+                return ins.middle.value
+            elif isinstance(ins, opcodes.movmp):
+                return self.d.types[ins.middle.value].size
+        
+        # The sizes of other blocks are only known if they are described by
+        # data items.
+        item = self.d.data.get(offset)
+        if item is not None and item.array_type != 3:
+            return item.size()
+        
+        return None
+    
+    def place(self, slots):
+    
+        """Returns a list of the new offsets of the slots and the size of the
+        module data needed to hold them."""
+        
+        order = range(len(slots))
+        order.sort(key = lambda i: (not slots[i].pointer,
+                                    -slots[i].alignment()[0],
+                                    slots[i].start - slots[i].end,
+                                    slots[i].start))
+        
+        offsets = [None] * len(slots)
+        gaps = []
+        end = 0
+        
+        for i in order:
+        
+            slot = slots[i]
+            alignment, residue = slot.alignment()
+            size = slot.end - slot.start
+            
+            for j, (gap_start, gap_end) in enumerate(gaps):
+                start = aligned(gap_start, alignment, residue)
+                if start + size <= gap_end:
+                    remaining = [(gap_start, start), (start + size, gap_end)]
+                    gaps[j:j + 1] = [gap for gap in remaining
+                                     if gap[0] < gap[1]]
+                    break
+            else:
+                start = aligned(end, alignment, residue)
+                if start > end:
+                    gaps.append((end, start))
+                end = start + size
+            
+            offsets[i] = start
+        
+        return offsets, aligned(end, 4)
+    
+    def arrange(self):
+    
+        """Rearranges the module data, returning True if it was changed or
+        False if it could not be rearranged."""
+        
+        d = self.d
+        
+        # The module data is described by the first type. If it does not
+        # match the size of the module data then the data cannot be moved.
+        if not d.types or d.types[0].size != d.data_size:
+            return False
+        
+        slots = self.slots()
+        if slots is None:
+            return False
+        
+        offsets, size = self.place(slots)
+        starts = [slot.start for slot in slots]
+        
+        def move(offset):
+            i = bisect_right(starts, offset) - 1
+            return offset - slots[i].start + offsets[i]
+        
+        data = {}
+        for item in d.data.values():
+            item.offset = move(item.offset)
+            data[item.offset] = item
+        d.data = data
+        
+        for ins in d.code:
+            for name in "source", "middle", "destination":
+                operand = getattr(ins, name)
+                offset = mp_offset(operand)
+                if offset is not None:
+                    setattr(ins, name, with_mp_offset(operand, move(offset)))
+        
+        mp_type = d.types[0]
+        mp_type.set_pointers(sorted(map(move, mp_type.pointers())))
+        mp_type.size = d.data_size = size
+        
+        return True
+
+
+def layout(d):
+
+    """Rearranges the module data of the module, d, returning True if it was
+    changed."""
+    
+    return Layout(d).arrange()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage: %s <input file> <output file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    d = dis.Dis(sys.argv[1])
+    size = d.data_size
+    
+    if not layout(d):
+        sys.stderr.write("The module data of '%s' cannot be rearranged.\n" %
+                         sys.argv[1])
+        sys.exit(1)
+    
+    d.write(open(sys.argv[2], "wb"))
+    
+    print "Module data reduced from %i to %i bytes." % (size, d.data_size)
+    
+    sys.exit()
@@ -46,20 +46,7 @@ class Instruction:
         destination = address_mode & 0x07
         destination = self.read_operand(destination, f)
         
-        if issubclass(class_, Src):
-            return class_(source)
-        elif issubclass(class_, Src_Src):
-            return class_(source, middle)
-        elif issubclass(class_, Src_Dst):
-            return class_(source, destination)
-        elif issubclass(class_, Src_Src_Dst):
-            return class_(source, middle, destination)
-        elif issubclass(class_, Src_Src_Src):
-            return class_(source, middle, destination)
-        elif issubclass(class_, Dst):
-            return class_(destination)
-        else:
-            return class_()
+        return create(class_, source, middle, destination)
     
     def set_address_mode(self):
     
@@ -131,6 +118,34 @@ class Instruction:
                 operands.append(s)
         
         return name + " " + ", ".join(operands)
+    
+    def key(self):
+    
+        # Return a hashable value that identifies the instruction and its
+        # operands, but not its position in the code.
+        return (self.opcode, self.source.key(), self.middle.key(),
+                self.destination.key())
+
+
+def create(class_, source, middle, destination):
+
+    """Returns an instance of the instruction class, class_, using the operands
+    that it accepts."""
+    
+    if issubclass(class_, Src):
+        return class_(source)
+    elif issubclass(class_, Src_Src):
+        return class_(source, middle)
+    elif issubclass(class_, Src_Dst):
+        return class_(source, destination)
+    elif issubclass(class_, Src_Src_Dst):
+        return class_(source, middle, destination)
+    elif issubclass(class_, Src_Src_Src):
+        return class_(source, middle, destination)
+    elif issubclass(class_, Dst):
+        return class_(destination)
+    else:
+        return class_()
 
 
 # Define the argument types.
@@ -145,6 +160,9 @@ class NoOperand:
     
     def __str__(self):
         return ""
+    
+    def key(self):
+        return ()
 
 class Operand:
 
@@ -158,6 +176,9 @@ class Operand:
     
     def write(self, f):
         write_OP(f, self.value)
+    
+    def key(self):
+        return (self.__class__, self.value)
 
 class Immediate(Operand):
     str_pattern = "$0x%x"
@@ -200,6 +221,9 @@ class DoubleShortOffset(Operand):
     def write(self, f):
         write_OP(f, self.offset0 & 0xffff)
         write_OP(f, self.offset1 & 0xffff)
+    
+    def key(self):
+        return (self.__class__, self.offset1, self.offset0)
 
 class DoubleShortOffsetMP(DoubleShortOffset):
     str_pattern = "%i(%i(mp))"
@@ -501,3 +525,303 @@ instructions = [
     mulx, divx, cvtxx, mulx0, divx0, cvtxx0, mulx1, divx1,
     cvtxx1, cvtfx, cvtxf, expw, expl, expf, self
     ]
+
+# Define the ways in which each instruction uses its operands. Each operand is
+# described by a pair of characters giving its access and its kind:
+#
+#   Access: r (read), w (written), m (read and written), a (address taken),
+#           - (unused)
+#   Kind:   b (byte), s (short), w (word), p (pointer), l (big), f (real),
+#           a (address that is not followed by the garbage collector, such
+#           as a frame or an element of an array), m (block of memory whose
+#           size is given by another operand or by the type of the object),
+#           i (immediate constant such as a type number or index), t (pc),
+#           - (unused)
+#
+# The operands are given in the order source, middle, destination. The
+# interpreter uses the destination in place of a missing middle operand.
+
+READ = 1
+WRITE = 2
+MODIFY = READ | WRITE
+ADDRESS = 4
+
+access_codes = {"-": 0, "r": READ, "w": WRITE, "m": MODIFY, "a": ADDRESS}
+
+# The number of bytes occupied by each kind of operand.
+widths = {"b": 1, "s": 2, "w": 4, "p": 4, "a": 4, "l": 8, "f": 8}
+
+# Flags describing how the instruction affects the flow of control.
+BRANCH = 1          # jumps to the pc in the destination or falls through
+JUMP = 2            # always jumps to the pc in the destination
+CALL = 4            # calls the function at the pc in the destination
+MODULE_CALL = 8     # calls a function in another module
+TERMINATE = 16      # never falls through to the next instruction
+
+semantics_table = {
+    nop:    ("-- -- --", 0),
+    alt:    ("rm -- ww", 0),
+    nbalt:  ("rm -- ww", 0),
+    goto:   ("rw -- rm", TERMINATE),
+    call:   ("ra -- rt", CALL),
+    frame:  ("ri -- wa", 0),
+    spawn:  ("ra -- rt", CALL),
+    runt:   ("-- -- --", 0),
+    load:   ("rp ri wp", 0),
+    mcall:  ("ra ri rp", MODULE_CALL),
+    mspawn: ("ra ri rp", MODULE_CALL),
+    mframe: ("rp ri wa", 0),
+    ret:    ("-- -- --", TERMINATE),
+    jmp:    ("-- -- rt", JUMP | TERMINATE),
+    case:   ("rw -- rm", TERMINATE),
+    exit:   ("-- -- --", TERMINATE),
+    new:    ("ri -- wp", 0),
+    newa:   ("rw ri wp", 0),
+    newcb:  ("-- -- wp", 0),
+    newcw:  ("-- -- wp", 0),
+    newcf:  ("-- -- wp", 0),
+    newcp:  ("-- -- wp", 0),
+    newcm:  ("-- -- wp", 0),
+    newcmp: ("-- -- wp", 0),
+    send:   ("rm -- rp", 0),
+    recv:   ("rp -- wm", 0),
+    consb:  ("rb -- mp", 0),
+    consw:  ("rw -- mp", 0),
+    consp:  ("rp -- mp", 0),
+    consf:  ("rf -- mp", 0),
+    consm:  ("rm -- mp", 0),
+    consmp: ("rm -- mp", 0),
+    headb:  ("rp -- wb", 0),
+    headw:  ("rp -- ww", 0),
+    headp:  ("rp -- wp", 0),
+    headf:  ("rp -- wf", 0),
+    headm:  ("rp -- wm", 0),
+    headmp: ("rp -- wm", 0),
+    tail:   ("rp -- wp", 0),
+    lea:    ("am -- wa", 0),
+    indx:   ("rp wa rw", 0),
+    movp:   ("rp -- wp", 0),
+    movm:   ("rm rw wm", 0),
+    movmp:  ("rm ri wm", 0),
+    movb:   ("rb -- wb", 0),
+    movw:   ("rw -- ww", 0),
+    movf:   ("rf -- wf", 0),
+    cvtbw:  ("rb -- ww", 0),
+    cvtwb:  ("rw -- wb", 0),
+    cvtfw:  ("rf -- ww", 0),
+    cvtwf:  ("rw -- wf", 0),
+    cvtca:  ("rp -- wp", 0),
+    cvtac:  ("rp -- wp", 0),
+    cvtwc:  ("rw -- wp", 0),
+    cvtcw:  ("rp -- ww", 0),
+    cvtfc:  ("rf -- wp", 0),
+    cvtcf:  ("rp -- wf", 0),
+    addb:   ("rb rb wb", 0),
+    addw:   ("rw rw ww", 0),
+    addf:   ("rf rf wf", 0),
+    subb:   ("rb rb wb", 0),
+    subw:   ("rw rw ww", 0),
+    subf:   ("rf rf wf", 0),
+    mulb:   ("rb rb wb", 0),
+    mulw:   ("rw rw ww", 0),
+    mulf:   ("rf rf wf", 0),
+    divb:   ("rb rb wb", 0),
+    divw:   ("rw rw ww", 0),
+    divf:   ("rf rf wf", 0),
+    modw:   ("rw rw ww", 0),
+    modb:   ("rb rb wb", 0),
+    andb:   ("rb rb wb", 0),
+    andw:   ("rw rw ww", 0),
+    orb:    ("rb rb wb", 0),
+    orw:    ("rw rw ww", 0),
+    xorb:   ("rb rb wb", 0),
+    xorw:   ("rw rw ww", 0),
+    shlb:   ("rw rb wb", 0),
+    shlw:   ("rw rw ww", 0),
+    shrb:   ("rw rb wb", 0),
+    shrw:   ("rw rw ww", 0),
+    insc:   ("rw rw mp", 0),
+    indc:   ("rp rw ww", 0),
+    addc:   ("rp rp wp", 0),
+    lenc:   ("rp -- ww", 0),
+    lena:   ("rp -- ww", 0),
+    lenl:   ("rp -- ww", 0),
+    beqb:   ("rb rb rt", BRANCH),
+    bneb:   ("rb rb rt", BRANCH),
+    bltb:   ("rb rb rt", BRANCH),
+    bleb:   ("rb rb rt", BRANCH),
+    bgtb:   ("rb rb rt", BRANCH),
+    bgeb:   ("rb rb rt", BRANCH),
+    beqw:   ("rw rw rt", BRANCH),
+    bnew:   ("rw rw rt", BRANCH),
+    bltw:   ("rw rw rt", BRANCH),
+    blew:   ("rw rw rt", BRANCH),
+    bgtw:   ("rw rw rt", BRANCH),
+    bgew:   ("rw rw rt", BRANCH),
+    beqf:   ("rf rf rt", BRANCH),
+    bnef:   ("rf rf rt", BRANCH),
+    bltf:   ("rf rf rt", BRANCH),
+    blef:   ("rf rf rt", BRANCH),
+    bgtf:   ("rf rf rt", BRANCH),
+    bgef:   ("rf rf rt", BRANCH),
+    beqc:   ("rp rp rt", BRANCH),
+    bnec:   ("rp rp rt", BRANCH),
+    bltc:   ("rp rp rt", BRANCH),
+    blec:   ("rp rp rt", BRANCH),
+    bgtc:   ("rp rp rt", BRANCH),
+    bgec:   ("rp rp rt", BRANCH),
+    slicea: ("rw rw mp", 0),
+    slicela: ("rp rw mp", 0),
+    slicec: ("rw rw mp", 0),
+    indw:   ("rp wa rw", 0),
+    indf:   ("rp wa rw", 0),
+    indb:   ("rp wa rw", 0),
+    negf:   ("rf -- wf", 0),
+    movl:   ("rl -- wl", 0),
+    addl:   ("rl rl wl", 0),
+    subl:   ("rl rl wl", 0),
+    divl:   ("rl rl wl", 0),
+    modl:   ("rl rl wl", 0),
+    mull:   ("rl rl wl", 0),
+    andl:   ("rl rl wl", 0),
+    orl:    ("rl rl wl", 0),
+    xorl:   ("rl rl wl", 0),
+    shll:   ("rw rl wl", 0),
+    shrl:   ("rw rl wl", 0),
+    bnel:   ("rl rl rt", BRANCH),
+    bltl:   ("rl rl rt", BRANCH),
+    blel:   ("rl rl rt", BRANCH),
+    bgtl:   ("rl rl rt", BRANCH),
+    bgel:   ("rl rl rt", BRANCH),
+    beql:   ("rl rl rt", BRANCH),
+    cvtlf:  ("rl -- wf", 0),
+    cvtfl:  ("rf -- wl", 0),
+    cvtlw:  ("rl -- ww", 0),
+    cvtwl:  ("rw -- wl", 0),
+    cvtlc:  ("rl -- wp", 0),
+    cvtcl:  ("rp -- wl", 0),
+    headl:  ("rp -- wl", 0),
+    consl:  ("rl -- mp", 0),
+    newcl:  ("-- -- wp", 0),
+    casec:  ("rp -- rm", TERMINATE),
+    indl:   ("rp wa rw", 0),
+    movpc:  ("rt -- ww", 0),
+    tcmp:   ("rp -- rp", 0),
+    mnewz:  ("rp ri wp", 0),
+    cvtrf:  ("rw -- wf", 0),
+    cvtfr:  ("rf -- ww", 0),
+    cvtws:  ("rw -- ws", 0),
+    cvtsw:  ("rs -- ww", 0),
+    lsrw:   ("rw rw ww", 0),
+    lsrl:   ("rw rl wl", 0),
+    eclr:   ("-- -- --", 0),
+    newz:   ("ri -- wp", 0),
+    newaz:  ("rw ri wp", 0),
+    raise_: ("rp -- --", TERMINATE),
+    casel:  ("rl -- rm", TERMINATE),
+    mulx:   ("rw rw ww", 0),
+    divx:   ("rw rw ww", 0),
+    cvtxx:  ("rw rw ww", 0),
+    mulx0:  ("rw rw ww", 0),
+    divx0:  ("rw rw ww", 0),
+    cvtxx0: ("rw rw ww", 0),
+    mulx1:  ("rw rw ww", 0),
+    divx1:  ("rw rw ww", 0),
+    cvtxx1: ("rw rw ww", 0),
+    cvtfx:  ("rf -- ww", 0),
+    cvtxf:  ("rw rf wf", 0),
+    expw:   ("rw rw ww", 0),
+    expl:   ("rw rl wl", 0),
+    expf:   ("rw rf wf", 0),
+    self:   ("-- -- --", 0)
+    }
+
+# Lists indexed by opcode containing tuples of the access and kind of the
+# source, middle and destination operands of each instruction, and its flags.
+access = []
+kinds = []
+flags = []
+
+for class_ in instructions:
+    spec, class_flags = semantics_table[class_]
+    operands = spec.split()
+    access.append(tuple(access_codes[operand[0]] for operand in operands))
+    kinds.append(tuple(operand[1] for operand in operands))
+    flags.append(class_flags)
+
+del class_, spec, class_flags, operands
+
+
+def operand_access(ins):
+
+    """Returns a tuple containing the access of the source, middle and
+    destination operands of the instruction, taking into account the use of
+    the destination as the middle operand when the middle operand is
+    missing."""
+    
+    source, middle, destination = access[ins.opcode]
+    
+    if middle and isinstance(ins.middle, NoOperand):
+        destination |= middle
+        middle = 0
+    
+    return source, middle, destination
+
+def pointer_slot(operand):
+
+    """Returns an operand referring to the word holding the pointer used by an
+    indirect operand, or None if the operand is not indirect."""
+    
+    if isinstance(operand, DoubleShortOffsetFP):
+        return LongOffsetFP(operand.offset0, "LO(FP)")
+    elif isinstance(operand, DoubleShortOffsetMP):
+        return LongOffsetMP(operand.offset0, "LO(MP)")
+    
+    return None
+
+def uses(ins):
+
+    """Returns a list of the operands of the instruction that refer to memory
+    that it reads, including the words holding the pointers used by indirect
+    operands and operands whose addresses are taken."""
+    
+    used = []
+    
+    for operand, mode in zip((ins.source, ins.middle, ins.destination),
+                             operand_access(ins)):
+    
+        if isinstance(operand, Immediate) or isinstance(operand, NoOperand):
+            continue
+        
+        if mode & (READ | ADDRESS):
+            used.append(operand)
+        
+        slot = pointer_slot(operand)
+        if slot is not None:
+            used.append(slot)
+    
+    return used
+
+def defs(ins):
+
+    """Returns a list of the operands of the instruction that refer to memory
+    that it writes."""
+    
+    defined = []
+    
+    for operand, mode in zip((ins.source, ins.middle, ins.destination),
+                             operand_access(ins)):
+    
+        if mode & WRITE and not isinstance(operand, Immediate) and \
+           not isinstance(operand, NoOperand):
+            defined.append(operand)
+    
+    return defined
+
+def width(ins, index):
+
+    """Returns the number of bytes used by the operand with the given index
+    (0 for the source, 1 for the middle and 2 for the destination) of the
+    instruction, or None if the size is not fixed."""
+    
+    return widths.get(kinds[ins.opcode][index])
@@ -0,0 +1,625 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc, mmap, sys
+from array import array
+from cStringIO import StringIO
+from struct import calcsize, pack, unpack, unpack_from
+from types import InstanceType
+
+import archives, dis, opcodes
+from patch import MappedDis
+from pipeline import find_files, read_file
+from utils import read_C, write_C
+
+# A pack file starts with a header containing the magic string, the version
+# of the format, the number of modules and the offset of the table of
+# contents, which lists the name, offset and length of each module.
+MAGIC = "DISPACK\x00"
+VERSION = 1
+FILE_HEADER = ">8sIIQ"
+TOC_ENTRY = ">QIH"
+
+# Each module starts with the fields of its header, followed by the offsets
+# and lengths of the sections that are stored in their usual encoding, then
+# the columns holding the code.
+header_fields = ("signed", "runtime_flag", "stack_extent", "code_size",
+                 "data_size", "type_size", "link_size", "entry_pc",
+                 "entry_type")
+MODULE_HEADER = ">%ii" % len(header_fields)
+
+section_names = ("signature", "types", "data", "module_name", "link", "ldt",
+                 "exceptions", "path")
+SECTION_TABLE = ">%iI" % (len(section_names) * 2)
+
+# The attributes of Dis objects that are restored by the from_bytes function.
+module_attributes = header_fields + (
+    "file_name", "code", "types", "data", "data_items", "arrays",
+    "module_name", "link", "ldt", "initialised_globals", "exceptions",
+    "signature", "path")
+
+# The code is stored as two columns of bytes holding the opcodes and address
+# modes, padded to a multiple of four bytes, followed by five columns of
+# 32-bit integers holding the values of the operands.
+byte_columns = ("opcode", "address_mode")
+int_columns = ("src0", "src1", "mid", "dst0", "dst1")
+
+# Operand classes for the address modes of source and destination operands,
+# and of middle operands.
+operand_classes = {
+    0x00: (opcodes.LongOffsetMP, "LO(MP)"),
+    0x01: (opcodes.LongOffsetFP, "LO(FP)"),
+    0x02: (opcodes.Immediate, "$OP"),
+    0x04: (opcodes.DoubleShortOffsetMP, "SO(SO(MP))"),
+    0x05: (opcodes.DoubleShortOffsetFP, "SO(SO(FP))")
+    }
+
+middle_classes = {
+    0x40: (opcodes.Immediate, "$SI"),
+    0x80: (opcodes.ShortOffsetFP, "SO(FP)"),
+    0xc0: (opcodes.ShortOffsetMP, "SO(MP)")
+    }
+
+
+def operand_values(operand):
+
+    """Returns the two values stored in the code columns for the operand."""
+    
+    if isinstance(operand, opcodes.DoubleShortOffset):
+        return operand.offset0, operand.offset1
+    elif isinstance(operand, opcodes.Operand):
+        return operand.value, 0
+    else:
+        return 0, 0
+
+def kept_operands(class_):
+
+    """Returns a tuple of booleans indicating which of the source, middle and
+    destination operands are kept by the instruction class when it is
+    created."""
+    
+    operands = (opcodes.NoOperand(), opcodes.NoOperand(), opcodes.NoOperand())
+    ins = opcodes.create(class_, *operands)
+    return tuple(a is b for a, b in zip((ins.source, ins.middle,
+                                         ins.destination), operands))
+
+def address_mode_masks(kept):
+
+    # Return the bits of the address mode to keep and the bits to set for the
+    # operands that are not kept.
+    mask = 0
+    fill = 0
+    for bits, missing, keep in zip((0x38, 0xc0, 0x07), (0x18, 0x00, 0x03),
+                                   kept):
+        if keep:
+            mask |= bits
+        else:
+            fill |= missing
+    return mask, fill
+
+# The operands kept by each instruction class, indexed by opcode.
+shapes = []
+for class_ in opcodes.instructions:
+    kept = kept_operands(class_)
+    shapes.append((class_, kept) + address_mode_masks(kept))
+
+del class_, kept
+
+# A single NoOperand object is shared between all instructions decoded from
+# code columns since it has no state.
+no_operand = opcodes.NoOperand()
+
+def make_operand(mode, value0, value1):
+
+    # Create operands without calling their constructors since many are
+    # created when code is decoded.
+    if mode in operand_classes:
+        class_, annotation = operand_classes[mode]
+        if mode & 0x04:
+            return InstanceType(class_, {"offset0": value0, "offset1": value1,
+                                         "annotation": annotation})
+        else:
+            return InstanceType(class_, {"value": value0,
+                                         "annotation": annotation})
+    
+    return no_operand
+
+def make_middle_operand(mode, value):
+
+    if mode in middle_classes:
+        class_, annotation = middle_classes[mode]
+        return InstanceType(class_, {"value": value, "annotation": annotation})
+    
+    return no_operand
+
+def make_instruction(opcode, mode, src0, src1, mid, dst0, dst1):
+
+    class_, kept, mask, fill = shapes[opcode]
+    
+    if kept[0]:
+        source = make_operand((mode >> 3) & 0x07, src0, src1)
+    else:
+        source = no_operand
+    
+    if kept[1]:
+        middle = make_middle_operand(mode & 0xc0, mid)
+    else:
+        middle = no_operand
+    
+    if kept[2]:
+        destination = make_operand(mode & 0x07, dst0, dst1)
+    else:
+        destination = no_operand
+    
+    return InstanceType(class_, {"source": source, "middle": middle,
+                                 "destination": destination,
+                                 "address_mode": (mode & mask) | fill})
+
+def to_array(typecode, data):
+
+    # Columns are stored in big-endian order.
+    a = array(typecode)
+    a.fromstring(data)
+    if a.itemsize > 1 and sys.byteorder == "little":
+        a.byteswap()
+    return a
+
+def from_array(a):
+
+    if a.itemsize > 1 and sys.byteorder == "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+def encode_code(code):
+
+    columns = dict((name, array("B")) for name in byte_columns)
+    columns.update((name, array("i")) for name in int_columns)
+    
+    for ins in code:
+        columns["opcode"].append(ins.opcode)
+        columns["address_mode"].append(ins.address_mode)
+        src0, src1 = operand_values(ins.source)
+        dst0, dst1 = operand_values(ins.destination)
+        columns["src0"].append(src0)
+        columns["src1"].append(src1)
+        columns["mid"].append(operand_values(ins.middle)[0])
+        columns["dst0"].append(dst0)
+        columns["dst1"].append(dst1)
+    
+    pieces = [from_array(columns[name]) for name in byte_columns]
+    pieces.append("\x00" * (-len(code) * 2 % 4))
+    pieces += [from_array(columns[name]) for name in int_columns]
+    
+    return "".join(pieces)
+
+def encode_sections(d):
+
+    """Returns a dictionary mapping the names of the sections stored in their
+    usual encoding to the encoded sections of the module, d."""
+    
+    sections = {}
+    
+    # Modules that were not read from files may not be signed.
+    if getattr(d, "signed", False):
+        signature = getattr(d, "signature", "")
+        sections["signature"] = pack(">I", len(signature)) + signature
+    else:
+        sections["signature"] = ""
+    
+    for name, method in (("types", d.write_types), ("data", d.write_data),
+                         ("link", d.write_link)):
+        f = StringIO()
+        method(f)
+        sections[name] = f.getvalue()
+    
+    for name in "module_name", "path":
+        f = StringIO()
+        write_C(f, getattr(d, name))
+        sections[name] = f.getvalue()
+    
+    sections["ldt"] = ""
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+        f = StringIO()
+        d.write_ldt(f)
+        sections["ldt"] = f.getvalue()
+    
+    sections["exceptions"] = ""
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+        f = StringIO()
+        d.write_exceptions(f)
+        sections["exceptions"] = f.getvalue()
+    
+    return sections
+
+def file_sections(d, contents):
+
+    """Returns a dictionary like the one returned by encode_sections for the
+    MappedDis object, d, using the bytes of the file it was read from."""
+    
+    sections = dict.fromkeys(section_names, "")
+    
+    if d.signed:
+        sections["signature"] = pack(">I", len(d.signature)) + d.signature
+    
+    for name in section_names:
+        if name in d.sections:
+            start, end = d.sections[name]
+            sections[name] = contents[start:end]
+        elif name in d.spans:
+            start, end = d.spans[name]
+            sections[name] = contents[start:end]
+    
+    return sections
+
+def encode_module(d, sections = None):
+
+    """Returns a string containing the module, d, in the form stored in pack
+    files. The sections dictionary contains the encoded sections, or None if
+    they should be encoded from the module."""
+    
+    if sections is None:
+        sections = encode_sections(d)
+    
+    values = [int(getattr(d, "signed", False)), d.runtime_flag.value]
+    values += [getattr(d, name) for name in header_fields[2:]]
+    values[header_fields.index("code_size")] = len(d.code)
+    
+    offset = calcsize(MODULE_HEADER) + calcsize(SECTION_TABLE)
+    code = encode_code(d.code)
+    offset += len(code)
+    
+    table = []
+    for name in section_names:
+        table += [offset, len(sections[name])]
+        offset += len(sections[name])
+    
+    return "".join([pack(MODULE_HEADER, *values), pack(SECTION_TABLE, *table),
+                    code] + [sections[name] for name in section_names])
+
+
+def to_bytes(d):
+
+    """Returns a string containing the module, d, and the name of the file it
+    was read from, in the form stored in pack files."""
+    
+    name = getattr(d, "file_name", None) or ""
+    if isinstance(name, unicode):
+        name = name.encode("utf8")
+    
+    return pack(">H", len(name)) + name + encode_module(d)
+
+def from_bytes(data):
+
+    """Returns a Dis object for the module in the string, data, which was
+    returned by the to_bytes function."""
+    
+    length = unpack_from(">H", data)[0]
+    name = data[2:2 + length] or None
+    
+    m = PackedModule(data, 2 + length, name)
+    d = dis.Dis()
+    d.file_name = name
+    
+    for key in header_fields:
+        setattr(d, key, getattr(m, key))
+    
+    d.code = m.code
+    d.types = m.types
+    m.load_data()
+    d.data = m.data
+    d.data_items = m.data_items
+    d.arrays = m.arrays
+    d.module_name = m.module_name
+    d.link = m.link
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+        d.ldt = m.ldt
+        d.initialised_globals = m.initialised_globals
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+        d.exceptions = m.exceptions
+    
+    if d.signed:
+        d.signature = m.signature
+    
+    d.path = m.path
+    
+    return d
+
+
+class PackWriter:
+
+    """Writes modules to a pack file. The file must support seeking."""
+    
+    def __init__(self, f):
+    
+        self.f = f
+        self.start = f.tell()
+        self.toc = []
+        f.write(pack(FILE_HEADER, MAGIC, VERSION, 0, 0))
+    
+    def add(self, d, name = None):
+    
+        """Adds the Dis object, d, to the pack under the given name or the
+        name of the file it was read from."""
+        
+        self.write(name or d.file_name, encode_module(d))
+    
+    def add_file(self, name, contents = None):
+    
+        """Adds the module in the file with the given name, or in the string,
+        contents, if given, copying its sections instead of encoding them
+        again."""
+        
+        if contents is None:
+            contents = read_file(name)
+        
+        d = MappedDis()
+        d.read(StringIO(contents), name)
+        self.write(name, encode_module(d, file_sections(d, contents)))
+    
+    def write(self, name, record):
+    
+        self.toc.append((name, self.f.tell() - self.start, len(record)))
+        self.f.write(record)
+    
+    def close(self):
+    
+        """Writes the table of contents and updates the header."""
+        
+        f = self.f
+        toc_offset = f.tell() - self.start
+        
+        for name, offset, length in self.toc:
+            if isinstance(name, unicode):
+                name = name.encode("utf8")
+            f.write(pack(TOC_ENTRY, offset, length, len(name)))
+            f.write(name)
+        
+        end = f.tell()
+        f.seek(self.start)
+        f.write(pack(FILE_HEADER, MAGIC, VERSION, len(self.toc), toc_offset))
+        f.seek(end)
+
+
+class PackedModule(dis.Dis):
+
+    """A module in a pack file. The header fields are available immediately
+    and each section is decoded when it is first used."""
+    
+    loaders = {
+        "code": "load_code",
+        "types": "load_types",
+        "data": "load_data", "data_items": "load_data", "arrays": "load_data",
+        "module_name": "load_module_name",
+        "link": "load_link",
+        "ldt": "load_ldt", "initialised_globals": "load_ldt",
+        "exceptions": "load_exceptions",
+        "path": "load_path",
+        "signature": "load_signature"
+        }
+    
+    def __init__(self, buf, offset, name):
+    
+        self.buf = buf
+        self.offset = offset
+        self.file_name = name
+        
+        values = unpack_from(MODULE_HEADER, buf, offset)
+        for name, value in zip(header_fields, values):
+            setattr(self, name, value)
+        
+        self.signed = bool(self.signed)
+        self.runtime_flag = dis.RuntimeFlag(self.runtime_flag)
+        
+        table = unpack_from(SECTION_TABLE, buf,
+                            offset + calcsize(MODULE_HEADER))
+        self.ranges = {}
+        for i, name in enumerate(section_names):
+            start = offset + table[i * 2]
+            self.ranges[name] = (start, start + table[i * 2 + 1])
+        
+        self.code_offset = offset + calcsize(MODULE_HEADER) + \
+                           calcsize(SECTION_TABLE)
+    
+    def __getstate__(self):
+    
+        # Pickle the bytes of the module in the form returned by the to_bytes
+        # function, without the buffer that holds them.
+        name = self.file_name or ""
+        if isinstance(name, unicode):
+            name = name.encode("utf8")
+        
+        end = max(end for start, end in self.ranges.values())
+        return pack(">H", len(name)) + name + self.buf[self.offset:end]
+    
+    def __setstate__(self, state):
+    
+        # Unpickled modules decode their sections from the pickled string
+        # when they are used.
+        length = unpack_from(">H", state)[0]
+        self.__init__(state, 2 + length, state[2:2 + length] or None)
+    
+    def __getattr__(self, name):
+    
+        loader = self.loaders.get(name)
+        if loader is None:
+            raise AttributeError(name)
+        
+        getattr(self, loader)()
+        return self.__dict__[name]
+    
+    def section(self, name):
+    
+        start, end = self.ranges[name]
+        return StringIO(self.buf[start:end])
+    
+    def column(self, name):
+    
+        """Returns an array containing the values in the named code column
+        without decoding the instructions."""
+        
+        n = self.code_size
+        
+        if name in byte_columns:
+            start = self.code_offset + byte_columns.index(name) * n
+            return to_array("B", self.buf[start:start + n])
+        
+        start = self.code_offset + n * 2 + (-n * 2 % 4)
+        start += int_columns.index(name) * n * 4
+        return to_array("i", self.buf[start:start + n * 4])
+    
+    def load_code(self):
+    
+        columns = [self.column(name) for name in byte_columns + int_columns]
+        
+        # None of the objects created form cycles, so pause the garbage
+        # collector instead of letting it run repeatedly as they are created.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.code = map(make_instruction, *columns)
+        finally:
+            if enabled:
+                gc.enable()
+    
+    def load_types(self):
+        self.read_types(self.section("types"))
+    
+    def load_data(self):
+        self.read_data(self.section("data"))
+    
+    def load_module_name(self):
+        self.module_name = read_C(self.section("module_name"))
+    
+    def load_link(self):
+        self.read_link(self.section("link"))
+    
+    def load_ldt(self):
+    
+        if self.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+            self.read_ldt(self.section("ldt"))
+        else:
+            self.ldt = []
+            self.initialised_globals = 0
+    
+    def load_exceptions(self):
+    
+        if self.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+            self.read_exceptions(self.section("exceptions"))
+        else:
+            self.exceptions = []
+    
+    def load_path(self):
+        self.path = read_C(self.section("path"))
+    
+    def load_signature(self):
+    
+        f = self.section("signature")
+        if self.signed:
+            self.signature = f.read(unpack(">I", f.read(4))[0])
+        else:
+            self.signature = ""
+
+
+class Pack:
+
+    """Provides access to the modules in a pack file, which is mapped into
+    memory so that opening a module only requires its header to be read."""
+    
+    def __init__(self, file_name):
+    
+        self.file_name = file_name
+        self.file = open(file_name, "rb")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        
+        magic, version, count, toc_offset = unpack_from(FILE_HEADER, self.buf)
+        
+        if magic != MAGIC:
+            raise dis.DisError("Invalid pack file '%s'." % file_name)
+        elif version != VERSION:
+            raise dis.DisError("Unsupported version %i of pack file '%s'." % (
+                version, file_name))
+        
+        self.names = []
+        self.offsets = {}
+        
+        size = calcsize(TOC_ENTRY)
+        at = toc_offset
+        
+        for i in range(count):
+            offset, length, name_length = unpack_from(TOC_ENTRY, self.buf, at)
+            at += size
+            name = self.buf[at:at + name_length]
+            at += name_length
+            self.names.append(name)
+            self.offsets[name] = offset
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __getitem__(self, key):
+    
+        """Returns the module with the given name or index."""
+        
+        if isinstance(key, int):
+            key = self.names[key]
+        
+        return PackedModule(self.buf, self.offsets[key], key)
+    
+    def __iter__(self):
+    
+        for name in self.names:
+            yield PackedModule(self.buf, self.offsets[name], name)
+    
+    def close(self):
+    
+        self.buf.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s <output file> <input file or directory> "
+                         "...\n" % sys.argv[0])
+        sys.exit(1)
+    
+    writer = PackWriter(open(sys.argv[1], "wb"))
+    
+    for path in find_files(sys.argv[2:]):
+    
+        if archives.is_archive(path):
+            sources = archives.members(path)
+        else:
+            sources = [(path, None)]
+        
+        for name, contents in sources:
+            try:
+                writer.add_file(name, contents)
+            except Exception, error:
+                sys.stderr.write("%s: %s\n" % (name, error))
+    
+    writer.close()
+    writer.f.close()
+    
+    print "Packed %i modules." % len(writer.toc)
+    
+    sys.exit()
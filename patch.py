@@ -0,0 +1,263 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from cStringIO import StringIO
+
+import dis
+import opcodes
+from utils import _read, read_B, read_OP, write_C, write_OP
+
+# The fields of the header in the order they occur in the file.
+header_fields = ("runtime_flag", "stack_extent", "code_size", "data_size",
+                 "type_size", "link_size", "entry_pc", "entry_type")
+
+# The number of bytes that follow the offset of each kind of entry in the
+# data section, either per value or in total.
+value_sizes = {1: 1, 2: 4, 3: 1, 4: 8, 8: 8}
+entry_sizes = {5: 8, 6: 4, 7: 0}
+
+
+class MappedDis(dis.Dis):
+
+    """Reads a module in the same way as the Dis class, recording the range
+    of bytes in the file occupied by each header field, section and item so
+    that they can be replaced without writing the whole file again.
+    
+    The ranges are stored as (start, end) tuples in the spans dictionary,
+    which maps each item to its range, or the name of each header field and
+    of the module_name and path strings, and in the sections dictionary."""
+    
+    def read(self, f, file_name = None):
+    
+        self.spans = {}
+        self.sections = {}
+        
+        dis.Dis.read(self, f, file_name)
+        
+        end = f.tell()
+        self.spans["path"] = (end - len(self.path) - 1, end)
+        self.spans["module_name"] = (self.sections["data"][1],
+                                     self.sections["link"][0])
+        
+        # Find the fields of the header.
+        f.seek(0)
+        read_OP(f)
+        if self.signed:
+            f.seek(_read(f, ">I"), 1)
+        
+        start = f.tell()
+        for name in header_fields:
+            at = f.tell()
+            read_OP(f)
+            self.spans[name] = (at, f.tell())
+        
+        self.sections["header"] = (start, f.tell())
+        f.seek(end)
+    
+    def read_item(self, f, item):
+    
+        start = f.tell()
+        item = dis.Dis.read_item(self, f, item)
+        self.spans[item] = (start, f.tell())
+        return item
+    
+    def read_section(self, name, method, f):
+    
+        start = f.tell()
+        method(self, f)
+        self.sections[name] = (start, f.tell())
+    
+    def read_code(self, f):
+        self.read_section("code", dis.Dis.read_code, f)
+    
+    def read_types(self, f):
+        self.read_section("types", dis.Dis.read_types, f)
+    
+    def read_data(self, f):
+    
+        self.read_section("data", dis.Dis.read_data, f)
+        
+        # Data items are read with their headers, so find the range of each
+        # entry in the section, including the ones that are not items.
+        start, end = self.sections["data"]
+        f.seek(start)
+        items = iter(self.data_items)
+        
+        while True:
+        
+            at = f.tell()
+            code = read_B(f)
+            if code == 0:
+                break
+            
+            count = code & 0x0f
+            array_type = code >> 4
+            
+            if count == 0:
+                count = read_OP(f)
+            
+            read_OP(f)
+            
+            if array_type in entry_sizes:
+                f.seek(entry_sizes[array_type], 1)
+            else:
+                f.seek(value_sizes[array_type] * count, 1)
+                self.spans[items.next()] = (at, f.tell())
+        
+        f.seek(end)
+    
+    def read_link(self, f):
+        self.read_section("link", dis.Dis.read_link, f)
+    
+    def read_ldt(self, f):
+        self.read_section("ldt", dis.Dis.read_ldt, f)
+    
+    def read_exceptions(self, f):
+        self.read_section("exceptions", dis.Dis.read_exceptions, f)
+
+
+class Patcher:
+
+    """Applies changes made to the items of a module to the file it was read
+    from without encoding the rest of the module again.
+    
+    Items in the module are changed in the usual way, then passed to the
+    update method. Header fields and the module_name and path strings are
+    passed to the update method by name. When the changes are committed,
+    items that are encoded using the same number of bytes as before are
+    written in place. Otherwise, the part of the file after the first change
+    in length is spliced together from the old contents and the new items.
+    
+    Signed modules are not re-signed, so their signatures will no longer be
+    valid after they are patched."""
+    
+    def __init__(self, file_name):
+    
+        self.file_name = file_name
+        self.load()
+    
+    def load(self):
+    
+        self.contents = open(self.file_name, "rb").read()
+        self.d = MappedDis()
+        self.d.read(StringIO(self.contents), self.file_name)
+        self.changed = []
+    
+    def update(self, key):
+    
+        """Marks the item or named field as changed."""
+        
+        if key not in self.d.spans:
+            raise dis.DisError("No item %s in file '%s'." % (
+                key, self.file_name))
+        
+        if isinstance(key, opcodes.Instruction):
+            key.set_address_mode()
+        
+        if key not in self.changed:
+            self.changed.append(key)
+    
+    def encode(self, key):
+    
+        f = StringIO()
+        
+        if key in ("module_name", "path"):
+            write_C(f, getattr(self.d, key))
+        elif key == "runtime_flag":
+            self.d.runtime_flag.write(f)
+        elif key in header_fields:
+            write_OP(f, getattr(self.d, key))
+        else:
+            key.write(f)
+        
+        return f.getvalue()
+    
+    def patches(self):
+    
+        """Returns a list of (start, end, bytes) tuples describing the changes
+        to the file, sorted by the start of each range of bytes."""
+        
+        patches = []
+        for key in self.changed:
+            start, end = self.d.spans[key]
+            patches.append((start, end, self.encode(key)))
+        
+        patches.sort()
+        return patches
+    
+    def apply(self, contents, patches, pos = 0):
+    
+        """Returns the result of applying the patches to the contents,
+        starting from the given position."""
+        
+        pieces = []
+        for start, end, data in patches:
+            pieces.append(contents[pos:start])
+            pieces.append(data)
+            pos = end
+        
+        pieces.append(contents[pos:])
+        return "".join(pieces)
+    
+    def commit(self):
+    
+        """Writes the changes to the file, returning the number of bytes
+        written, and reads the patched module again."""
+        
+        patches = self.patches()
+        if not patches:
+            return 0
+        
+        f = open(self.file_name, "r+b")
+        written = 0
+        
+        # Write the patches that do not change the length of the file.
+        i = 0
+        while i < len(patches):
+            start, end, data = patches[i]
+            if len(data) != end - start:
+                break
+            f.seek(start)
+            f.write(data)
+            written += len(data)
+            i += 1
+        
+        # Splice the remaining patches into the rest of the file.
+        if i < len(patches):
+            start = patches[i][0]
+            tail = self.apply(self.contents, patches[i:], start)
+            f.seek(start)
+            f.write(tail)
+            f.truncate()
+            written += len(tail)
+        
+        f.close()
+        self.load()
+        
+        return written
+
+
+def patch(file_name, function):
+
+    """Reads the module in the file with the given name, passing a Patcher
+    for it to the function, which should call the Patcher's update method
+    for each change it makes, then commits the changes. Returns the number
+    of bytes written."""
+    
+    patcher = Patcher(file_name)
+    function(patcher)
+    return patcher.commit()
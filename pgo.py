@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+
+import builder, cases, dis, opcodes
+from blocks import basic_blocks, branch_target, function_entries
+
+# The conditional branches that can be inverted. Branches that compare reals
+# are not included because comparisons with NaN are false whichever way
+# round they are made.
+inverses = {}
+for suffix in "b", "w", "l", "c":
+    for first, second in ("eq", "ne"), ("lt", "ge"), ("le", "gt"):
+        first = getattr(opcodes, "b" + first + suffix)
+        second = getattr(opcodes, "b" + second + suffix)
+        inverses[first] = second
+        inverses[second] = first
+
+
+class ProfileError(Exception):
+    pass
+
+
+def read_profile(f):
+
+    """Reads a profile from the file, f, returning a dictionary mapping pcs
+    to the number of times the instructions at them were executed. Each line
+    of the file contains a pc and a count, given in decimal or hexadecimal
+    with a 0x prefix. Empty lines and text following # characters are
+    ignored. The counts for pcs that occur more than once are added."""
+    
+    counts = {}
+    
+    for line_number, line in enumerate(f):
+    
+        line = line.split("#")[0].strip()
+        if not line:
+            continue
+        
+        try:
+            pc, count = map(lambda value: int(value, 0), line.split())
+        except ValueError:
+            raise ProfileError("Invalid profile entry at line %i." %
+                               (line_number + 1))
+        
+        counts[pc] = counts.get(pc, 0) + count
+    
+    return counts
+
+
+class Chain:
+
+    def __init__(self, block):
+    
+        self.blocks = [block]
+
+
+class Reorderer:
+
+    """Reorders the basic blocks in each function of a module so that the
+    most frequently executed successor of each block follows it, given the
+    execution counts of the instructions in the module in the dictionary,
+    counts, which maps pcs to counts.
+    
+    The count of each block is the count of its first instruction, and the
+    number of times that each edge between blocks is followed is estimated
+    to be the smaller of the counts of the blocks at each end. Blocks are
+    joined into chains by following the edges in order of decreasing count,
+    joining a block to the successor that can follow it, either by falling
+    through, by removing a jmp instruction or by inverting a conditional
+    branch. The chain containing the entry to a function is placed first,
+    followed by the others in order of decreasing count, so that blocks that
+    were never executed are placed at the end in their original order.
+    
+    Jumps are inserted where a block no longer falls through to its
+    successor, and are removed where they jump to the following block.
+    Branches, links, the entry point, case tables and exception handlers are
+    updated to refer to the new positions of the instructions.
+    
+    Functions that contain instructions protected by exception handlers are
+    not reordered, since handlers refer to ranges of pcs. If the module uses
+    goto instructions, which refer to tables of pcs, or if the table used by
+    a case instruction cannot be decoded, the module is left unchanged."""
+    
+    def __init__(self, d, counts):
+    
+        self.d = d
+        self.counts = counts
+        
+        self.inverted = 0
+        self.inserted = 0
+        self.removed = 0
+        self.moved = 0
+    
+    def can_reorder(self):
+    
+        tables = cases.tables(self.d)
+        
+        for pc, ins in enumerate(self.d.code):
+        
+            if isinstance(ins, opcodes.goto):
+                return False
+            elif ins.__class__ in cases.layouts and pc not in tables:
+                return False
+            elif opcodes.flags[ins.opcode] & (opcodes.BRANCH | opcodes.JUMP) \
+                 and branch_target(ins) is None:
+                return False
+        
+        return True
+    
+    def count(self, block):
+    
+        return self.counts.get(block.start, 0)
+    
+    def regions(self, blocks):
+    
+        """Returns a list of lists of blocks, one for each function, and a
+        list of booleans indicating whether the blocks in each function can
+        be moved."""
+        
+        d = self.d
+        entries = set(function_entries(d))
+        entries.add(0)
+        
+        regions = []
+        for block in blocks:
+            if block.start in entries:
+                regions.append([])
+            regions[-1].append(block)
+        
+        protected = []
+        if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+            protected = [(e.p1, e.p2) for e in d.exceptions]
+        
+        movable = []
+        for region in regions:
+            start, end = region[0].start, region[-1].end
+            movable.append(not [p1 for p1, p2 in protected
+                                if p1 < end and start < p2])
+        
+        return regions, movable
+    
+    def fall_through(self, block):
+    
+        """Returns the pc of the block that the block falls through to, or
+        None if it does not fall through."""
+        
+        last = self.d.code[block.end - 1]
+        if opcodes.flags[last.opcode] & opcodes.TERMINATE:
+            return None
+        return block.end
+    
+    def can_follow(self, block, successor):
+    
+        """Returns True if the successor can be placed after the block."""
+        
+        last = self.d.code[block.end - 1]
+        
+        if successor.start == self.fall_through(block):
+            return True
+        elif isinstance(last, opcodes.jmp):
+            return True
+        elif last.__class__ in inverses:
+            return branch_target(last) == successor.start
+        
+        return False
+    
+    def order(self, region):
+    
+        """Returns the blocks of the region in a new order."""
+        
+        by_start = dict((block.start, block) for block in region)
+        chains = {}
+        for block in region:
+            chains[block.start] = Chain(block)
+        
+        edges = []
+        for index, block in enumerate(region):
+            for pc in block.successors:
+                successor = by_start.get(pc)
+                if successor is None or successor is region[0]:
+                    continue
+                weight = min(self.count(block), self.count(successor))
+                if weight > 0 and self.can_follow(block, successor):
+                    edges.append((-weight, index, block, successor))
+        
+        edges.sort(key = lambda edge: (edge[0], edge[1], edge[3].start))
+        
+        for weight, index, block, successor in edges:
+        
+            chain = chains[block.start]
+            other = chains[successor.start]
+            
+            # Only join the end of one chain to the start of another.
+            if chain is other or chain.blocks[-1] is not block or \
+               other.blocks[0] is not successor:
+                continue
+            
+            chain.blocks += other.blocks
+            for member in other.blocks:
+                chains[member.start] = chain
+        
+        first = chains[region[0].start]
+        others = []
+        for block in region:
+            chain = chains[block.start]
+            if chain is not first and chain.blocks[0] is block:
+                others.append(chain)
+        
+        others.sort(key = lambda chain: (-self.count(chain.blocks[0]),
+                                         chain.blocks[0].start))
+        
+        ordered = []
+        for chain in [first] + others:
+            ordered += chain.blocks
+        
+        return ordered
+    
+    def reorder(self):
+    
+        """Reorders the blocks in the module, returning True if it could be
+        reordered or False if it was left unchanged."""
+        
+        d = self.d
+        if not self.can_reorder():
+            return False
+        
+        # Load the code into a builder, which replaces the pcs used in the
+        # module with labels, and resolve it to assign the current pcs to
+        # the labels, then find the labels for each pc in the code.
+        loaded = builder.load(d)
+        loaded.resolve(d)
+        labels = {}
+        pc = 0
+        for chunk in loaded.chunks:
+            for item in chunk.items:
+                if isinstance(item, builder.Label):
+                    labels.setdefault(pc, []).append(item)
+                else:
+                    pc += 1
+        
+        blocks = basic_blocks(d.code, labels.keys(), cases.tables(d))
+        regions, movable = self.regions(blocks)
+        
+        # Place a label at the start of every block and at the end of the
+        # code so that new jumps can refer to any of them.
+        for pc in [block.start for block in blocks] + [len(d.code)]:
+            if pc not in labels:
+                labels[pc] = [builder.Label()]
+        
+        placed = []
+        for region, can_move in zip(regions, movable):
+            if can_move:
+                ordered = self.order(region)
+            else:
+                ordered = region
+            for block, original in zip(ordered, region):
+                if block is not original:
+                    self.moved += 1
+                placed.append((block, can_move))
+        
+        b = builder.Builder()
+        b.fixups = loaded.fixups
+        
+        for i, (block, can_move) in enumerate(placed):
+        
+            # The labels were placed in the loaded code, so place them again
+            # in the new code.
+            for label in labels[block.start]:
+                label.chunk = None
+                b.mark(label)
+            
+            code = d.code[block.start:block.end]
+            
+            if can_move:
+                if i + 1 < len(placed):
+                    following = placed[i + 1][0].start
+                else:
+                    following = None
+                code = self.link(block, code, following, labels)
+            
+            b.append(*code)
+        
+        for label in labels.get(len(d.code), []):
+            label.chunk = None
+            b.mark(label)
+        
+        b.resolve(d)
+        return True
+    
+    def link(self, block, code, following, labels):
+    
+        """Returns the instructions of the block, changing the last one so
+        that it reaches its successors when followed by the block at the pc,
+        following, which is None for the last block in the code. New branches
+        refer to the labels in the dictionary, labels, which maps the starts
+        of blocks to lists of labels."""
+        
+        last = code[-1]
+        target = branch_target(last)
+        
+        if isinstance(last, opcodes.jmp):
+            if target == following:
+                self.removed += 1
+                return code[:-1]
+            return code
+        
+        fall_through = self.fall_through(block)
+        if fall_through is None or fall_through == following:
+            return code
+        
+        if target is not None and target == following and \
+           last.__class__ in inverses:
+            # Invert the branch so that it falls through to the block that
+            # it used to branch to.
+            inverse = inverses[last.__class__](
+                last.source, last.middle,
+                builder.Target(labels[fall_through][0]))
+            self.inverted += 1
+            return code[:-1] + [inverse]
+        
+        # Jump directly to the target of a jump that the block used to fall
+        # through to.
+        destination = fall_through
+        if destination < len(self.d.code) and \
+           isinstance(self.d.code[destination], opcodes.jmp):
+            destination = branch_target(self.d.code[destination])
+        
+        self.inserted += 1
+        return code + [opcodes.jmp(builder.Target(labels[destination][0]))]
+
+
+def reorder(d, counts):
+
+    """Reorders the basic blocks of the module, d, using the execution counts
+    in the dictionary, counts, returning True if it was reordered."""
+    
+    return Reorderer(d, counts).reorder()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 4:
+        sys.stderr.write("Usage: %s <input file> <profile file> "
+                         "<output file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    d = dis.Dis(sys.argv[1])
+    
+    try:
+        counts = read_profile(open(sys.argv[2]))
+    except ProfileError, error:
+        sys.stderr.write("%s\n" % error)
+        sys.exit(1)
+    
+    r = Reorderer(d, counts)
+    if not r.reorder():
+        sys.stderr.write("The code of '%s' cannot be reordered.\n" %
+                         sys.argv[1])
+        sys.exit(1)
+    
+    d.write(open(sys.argv[3], "wb"))
+    
+    print "%i blocks moved, %i branches inverted, %i jumps inserted, " \
+          "%i jumps removed." % (r.moved, r.inverted, r.inserted, r.removed)
+    
+    sys.exit()
@@ -0,0 +1,230 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fnmatch, os, threading
+from cStringIO import StringIO
+from Queue import Queue
+
+import archives, dis
+
+# Marker placed in the queues to indicate that no more items will follow.
+DONE = None
+
+
+def find_files(paths, pattern = "*.dis"):
+
+    """Yields the names of the files given in paths, descending into any
+    directories to find files with names that match the pattern."""
+    
+    for path in paths:
+    
+        if not os.path.isdir(path):
+            yield path
+            continue
+        
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if fnmatch.fnmatch(file_name, pattern):
+                    yield os.path.join(dir_path, file_name)
+
+def read_file(name):
+
+    f = open(name, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def decode(name, data):
+
+    """Decodes the module contained in the string, data, returning a Dis
+    object."""
+    
+    d = dis.Dis()
+    d.read(StringIO(data), name)
+    return d
+
+def summarise(d):
+
+    """Returns a dictionary describing the header and sections of the module,
+    d, without its code."""
+    
+    summary = {
+        "file": d.file_name,
+        "module": d.module_name,
+        "source": d.path,
+        "signed": d.signed,
+        "runtime_flag": d.runtime_flag.value,
+        "stack_extent": d.stack_extent,
+        "code_size": d.code_size,
+        "data_size": d.data_size,
+        "type_size": d.type_size,
+        "link_size": d.link_size,
+        "entry_pc": d.entry_pc,
+        "entry_type": d.entry_type,
+        "links": [(link.name, link.pc, link.desc_number, link.sig)
+                  for link in d.link]
+        }
+    
+    if d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+        summary["imports"] = [[(ldt.name, ldt.sig) for ldt in sequence]
+                              for sequence in d.ldt]
+    else:
+        summary["imports"] = []
+    
+    return summary
+
+
+class Pipeline:
+
+    """Reads and decodes modules using pools of threads, returning the results
+    in the order that they are completed when iterated over.
+    
+    Files are read by the reader threads and placed in a queue of limited size
+    so that reading is suspended while the decoder threads catch up. Each item
+    obtained from the pipeline is a (name, result, error) tuple where result
+    is the Dis object, or the value returned by the process function if one
+    was given, and error is the exception raised while reading or decoding,
+    or None."""
+    
+    def __init__(self, paths, process = None, readers = 4, decoders = 2,
+                       queue_size = 16, pattern = "*.dis"):
+    
+        self.paths = paths
+        self.process = process
+        self.readers = readers
+        self.decoders = decoders
+        self.pattern = pattern
+        
+        self.names = Queue(queue_size)
+        self.encoded = Queue(queue_size)
+        self.results = Queue(queue_size)
+        
+        self.lock = threading.Lock()
+        self.running_readers = readers
+        self.running_decoders = decoders
+    
+    def sources(self):
+    
+        """Yields (name, function) pairs where each function returns the
+        contents of the named module when called. Modules in archives given
+        in the list of paths are read from the archives without extracting
+        them."""
+        
+        for name in find_files(self.paths, self.pattern):
+            if archives.is_archive(name):
+                for source in self.archive_sources(name):
+                    yield source
+            else:
+                yield name, lambda name=name: read_file(name)
+    
+    def archive_sources(self, path):
+    
+        # Archives are read in sequence, so pass the contents of each module
+        # to the readers, or the error that occurred when reading it.
+        try:
+            for name, data in archives.members(path, self.pattern):
+                yield name, lambda data=data: data
+        
+        except Exception, error:
+            def reader(error=error):
+                raise error
+            yield path, reader
+    
+    def start(self, target):
+    
+        thread = threading.Thread(target = target)
+        thread.daemon = True
+        thread.start()
+    
+    def feed(self):
+    
+        for source in self.sources():
+            self.names.put(source)
+        
+        for i in range(self.readers):
+            self.names.put(DONE)
+    
+    def read(self):
+    
+        while True:
+        
+            source = self.names.get()
+            if source is DONE:
+                break
+            
+            name, reader = source
+            try:
+                self.encoded.put((name, reader(), None))
+            except Exception, error:
+                self.encoded.put((name, None, error))
+        
+        # The last reader to finish tells the decoders to stop.
+        self.lock.acquire()
+        self.running_readers -= 1
+        finished = self.running_readers == 0
+        self.lock.release()
+        
+        if finished:
+            for i in range(self.decoders):
+                self.encoded.put(DONE)
+    
+    def decode(self):
+    
+        while True:
+        
+            item = self.encoded.get()
+            if item is DONE:
+                break
+            
+            name, data, error = item
+            result = None
+            
+            if error is None:
+                try:
+                    result = decode(name, data)
+                    if self.process:
+                        result = self.process(result)
+                except Exception, error:
+                    result = None
+            
+            self.results.put((name, result, error))
+        
+        self.lock.acquire()
+        self.running_decoders -= 1
+        finished = self.running_decoders == 0
+        self.lock.release()
+        
+        if finished:
+            self.results.put(DONE)
+    
+    def __iter__(self):
+    
+        self.start(self.feed)
+        
+        for i in range(self.readers):
+            self.start(self.read)
+        
+        for i in range(self.decoders):
+            self.start(self.decode)
+        
+        while True:
+            item = self.results.get()
+            if item is DONE:
+                break
+            yield item
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+
+import dis, opcodes
+from blocks import call_target, function_entries
+
+
+def words(offset, size):
+
+    """Returns a set, represented as an integer with one bit for each word,
+    of the words covered by size bytes starting at the given offset."""
+    
+    first = offset / 4
+    last = (offset + size + 3) / 4
+    return ((1 << (last - first)) - 1) << first
+
+def bitmap(type_):
+
+    """Returns the set of pointer words declared by the type."""
+    
+    bits = 0
+    for offset in type_.pointers():
+        bits |= 1 << (offset / 4)
+    return bits
+
+def offsets(bits):
+
+    """Returns a list of the offsets of the words in the set."""
+    
+    found = []
+    word = 0
+    while bits:
+        if bits & 1:
+            found.append(word * 4)
+        bits >>= 1
+        word += 1
+    return found
+
+
+class PointerAnalysis:
+
+    """Finds the words in frames and in the module data that are written with
+    pointers and with other values by the code of a module.
+    
+    Each function uses the frame type given by its link, by the module's entry
+    type or by the frame instructions used to call it. Writes to the words of
+    a new frame or object through an indirect operand are attributed to the
+    type used to create it with a frame, new or newz instruction. The code is
+    scanned once in pc order and the slots known to hold new frames and
+    objects are forgotten at the start of each function, so a slot must be
+    set before it is used within the same function.
+    
+    Sets of words are represented by integers with one bit for each word."""
+    
+    def __init__(self, d):
+    
+        self.d = d
+        
+        # Map type numbers to sets of words written with pointers and with
+        # other values.
+        self.pointers = {}
+        self.scalars = {}
+        
+        # Map the pcs of functions to their frame types.
+        self.frame_types = {d.entry_pc: d.entry_type}
+        for link in d.link:
+            self.frame_types[link.pc] = link.desc_number
+        
+        self.entries = function_entries(d)
+        
+        # Record the words written in the frame of each function until their
+        # frame types are known.
+        self.frame_pointers = dict.fromkeys(self.entries, 0)
+        self.frame_scalars = dict.fromkeys(self.entries, 0)
+        
+        self.scan()
+        self.scan_data()
+        
+        for pc in self.entries:
+            type_number = self.frame_types.get(pc)
+            if type_number is not None:
+                self.mark(type_number, self.frame_pointers[pc],
+                          self.frame_scalars[pc])
+    
+    def mark(self, type_number, pointers, scalars):
+    
+        self.pointers[type_number] = \
+            self.pointers.get(type_number, 0) | pointers
+        self.scalars[type_number] = self.scalars.get(type_number, 0) | scalars
+    
+    def scan(self):
+    
+        d = self.d
+        entries = set(self.entries)
+        function = None
+        
+        # Map (mp or fp, offset) pairs to the types of the frames and objects
+        # that the slots hold.
+        holders = {}
+        
+        for pc, ins in enumerate(d.code):
+        
+            if pc in entries:
+                function = pc
+                holders = {}
+            
+            # Find the functions called with frames of known types.
+            target = call_target(ins)
+            if target is not None:
+                key = self.slot(ins.source)
+                if key in holders:
+                    self.frame_types.setdefault(target, holders[key])
+            
+            operands = (ins.source, ins.middle, ins.destination)
+            
+            for operand, access, kind in zip(operands,
+                                             opcodes.operand_access(ins),
+                                             opcodes.kinds[ins.opcode]):
+                if access & opcodes.WRITE:
+                    self.write(ins, operand, kind, function, holders)
+            
+            # Record the types of new frames and objects after the writes
+            # have been handled, since their slots were overwritten.
+            if isinstance(ins, (opcodes.frame, opcodes.new, opcodes.newz)) and \
+               isinstance(ins.source, opcodes.Immediate):
+                key = self.slot(ins.destination)
+                if key is not None:
+                    holders[key] = ins.source.value
+    
+    def slot(self, operand):
+    
+        if isinstance(operand, opcodes.LongOffsetFP) or \
+           isinstance(operand, opcodes.ShortOffsetFP):
+            return ("fp", operand.value)
+        elif isinstance(operand, opcodes.LongOffsetMP) or \
+             isinstance(operand, opcodes.ShortOffsetMP):
+            return ("mp", operand.value)
+        
+        return None
+    
+    def write(self, ins, operand, kind, function, holders):
+    
+        size = opcodes.widths.get(kind)
+        pointers = 0
+        scalars = 0
+        
+        if kind == "p":
+            pointers = words(0, 4)
+        elif size is not None:
+            scalars = words(0, size)
+        elif isinstance(ins, opcodes.movmp) and \
+             isinstance(ins.middle, opcodes.Immediate):
+            # The words copied by a movmp instruction are described by a type.
+            type_ = self.d.types[ins.middle.value]
+            pointers = bitmap(type_)
+            scalars = words(0, type_.size) & ~pointers
+        else:
+            # The contents of other blocks of memory are unknown.
+            return
+        
+        key = self.slot(operand)
+        
+        if key is not None:
+            base, offset = key
+            shift = offset / 4
+            if base == "mp":
+                self.mark(0, pointers << shift, scalars << shift)
+            elif function is not None:
+                self.frame_pointers[function] |= pointers << shift
+                self.frame_scalars[function] |= scalars << shift
+            
+            # The slot no longer holds a known frame or object.
+            holders.pop(key, None)
+        
+        elif isinstance(operand, opcodes.DoubleShortOffset):
+            if isinstance(operand, opcodes.DoubleShortOffsetFP):
+                key = ("fp", operand.offset0)
+            else:
+                key = ("mp", operand.offset0)
+            
+            type_number = holders.get(key)
+            if type_number is not None:
+                shift = operand.offset1 / 4
+                self.mark(type_number, pointers << shift, scalars << shift)
+    
+    def scan_data(self):
+    
+        # Strings in the module data are pointers and other values are not.
+        for item in self.d.data.values():
+            if item.base == 0:
+                if item.array_type == 3:
+                    self.mark(0, words(item.offset, 4), 0)
+                else:
+                    self.mark(0, 0, words(item.offset, item.size()))
+    
+    def derive(self, type_number, size):
+    
+        """Returns a Type with the given number and size whose pointers are
+        the words found to be written with pointers."""
+        
+        return dis.Type(type_number, size).set_pointers(
+            [offset for offset in offsets(self.pointers.get(type_number, 0))
+             if offset < size])
+    
+    def mismatches(self):
+    
+        """Returns a list of (type number, offset, problem) tuples describing
+        words where the pointer maps of the module's types disagree with the
+        values written by the code. The problem is either "undeclared" for a
+        pointer written to a word that is not declared as a pointer, or
+        "unused" for a word declared as a pointer that is only written with
+        other values."""
+        
+        found = []
+        
+        for type_number, type_ in enumerate(self.d.types):
+        
+            declared = bitmap(type_)
+            pointers = self.pointers.get(type_number, 0)
+            scalars = self.scalars.get(type_number, 0)
+            
+            for offset in offsets(pointers & ~declared):
+                found.append((type_number, offset, "undeclared"))
+            
+            for offset in offsets(declared & scalars & ~pointers):
+                found.append((type_number, offset, "unused"))
+        
+        found.sort()
+        return found
+
+
+def analyse(d):
+
+    """Returns a PointerAnalysis for the module, d."""
+    
+    return PointerAnalysis(d)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: %s <file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    d = dis.Dis(sys.argv[1])
+    problems = analyse(d).mismatches()
+    
+    for type_number, offset, problem in problems:
+        if problem == "undeclared":
+            print "desc $0x%x: pointer written to %i, not declared" % (
+                type_number, offset)
+        else:
+            print "desc $0x%x: %i declared as a pointer, written with " \
+                  "other values" % (type_number, offset)
+    
+    if problems:
+        sys.exit(1)
+    else:
+        sys.exit()
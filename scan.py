@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import glob, json, sys
+
+from pipeline import Pipeline, summarise
+from watch import Watcher
+
+usage = """\
+Usage: %s [-w <workers>] [-c] [--watch] [<file, directory, archive or glob> ...]
+
+Writes a JSON object describing each module to stdout, one per line, as soon as
+it has been read. File names are read from stdin, one per line, if none are
+given or if - is given.
+
+  -w <workers>  Use the given number of threads to read and decode modules.
+  -c            Include the instructions of each module.
+  --watch       Keep watching the files and directories given, writing an
+                object for each module that is added or changed, and one
+                with a "removed" value for each module that is removed.
+                Archives are not watched.
+"""
+
+
+def text(s):
+
+    # Strings in modules are UTF-8 encoded but may contain invalid sequences.
+    return s.decode("utf8", "replace")
+
+def describe(d, code = False):
+
+    """Returns a dictionary describing the module, d, that can be encoded as
+    JSON, including a list of its instructions if code is True."""
+    
+    record = summarise(d)
+    
+    for key in "file", "module", "source":
+        record[key] = text(record[key])
+    
+    record["links"] = [(text(name), pc, desc, sig)
+                       for name, pc, desc, sig in record["links"]]
+    record["imports"] = [[(text(name), sig) for name, sig in sequence]
+                         for sequence in record["imports"]]
+    
+    record["types"] = [{"size": type_.size, "pointers": type_.pointers()}
+                       for type_ in d.types]
+    
+    data = []
+    for address, item in sorted(d.data.items()):
+        if item.array_type == 3:
+            value = text(item.data())
+        else:
+            value = item.data()
+        data.append({"base": item.base, "offset": item.offset,
+                     "kind": item.names.get(item.array_type), "value": value})
+    
+    record["data"] = data
+    
+    if code:
+        record["code"] = [repr(ins).rstrip() for ins in d.code]
+    
+    return record
+
+def read_names(f):
+
+    for line in f:
+        line = line.strip()
+        if line:
+            yield line
+
+def expand(args):
+
+    """Yields the paths given in args, expanding any glob patterns and reading
+    paths from stdin in place of -."""
+    
+    for arg in args:
+        if arg == "-":
+            for name in read_names(sys.stdin):
+                yield name
+        elif glob.has_magic(arg):
+            for name in sorted(glob.glob(arg)):
+                yield name
+        else:
+            yield arg
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    workers = 2
+    code = False
+    watching = False
+    
+    while args and args[0].startswith("-") and args[0] != "-":
+        option = args.pop(0)
+        try:
+            if option == "-w":
+                workers = int(args.pop(0))
+                if workers < 1:
+                    raise ValueError
+            elif option == "-c":
+                code = True
+            elif option == "--watch":
+                watching = True
+            else:
+                raise ValueError
+        except (IndexError, ValueError):
+            sys.stderr.write(usage % sys.argv[0])
+            sys.exit(1)
+    
+    if not args:
+        args = ["-"]
+    
+    def process(d):
+        return json.dumps(describe(d, code))
+    
+    if watching:
+        watcher = Watcher(list(expand(args)), process)
+        try:
+            for changed, removed in watcher.watch():
+                for name in changed:
+                    if name in watcher.errors:
+                        line = json.dumps({"file": text(name),
+                                           "error": str(watcher.errors[name])})
+                    else:
+                        line = watcher.results[name]
+                    sys.stdout.write(line + "\n")
+                for name in removed:
+                    sys.stdout.write(json.dumps({"file": text(name),
+                                                 "removed": True}) + "\n")
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            sys.exit()
+    
+    failed = False
+    
+    for name, line, error in Pipeline(expand(args), process, readers = workers,
+                                      decoders = workers):
+        if error is not None:
+            line = json.dumps({"file": text(name), "error": str(error)})
+            failed = True
+        
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+    
+    if failed:
+        sys.exit(1)
+    else:
+        sys.exit()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import opcodes, pack
+from pipeline import Pipeline
+
+# Names used to describe the address modes of operands.
+operand_modes = {0x00: "mp", 0x01: "fp", 0x02: "$", 0x03: "-",
+                 0x04: "(mp)", 0x05: "(fp)"}
+middle_modes = {0x00: "-", 0x40: "$", 0x80: "fp", 0xc0: "mp"}
+
+
+def columns(d):
+
+    """Returns arrays of bytes containing the opcodes and address modes of the
+    instructions in the module, d, using the columns of a module in a pack
+    file if possible."""
+    
+    if hasattr(d, "column"):
+        return d.column("opcode"), d.column("address_mode")
+    
+    return array("B", [ins.opcode for ins in d.code]), \
+           array("B", [ins.address_mode for ins in d.code])
+
+def describe_mode(mode):
+
+    """Returns a string describing the source, middle and destination
+    operands of an address mode."""
+    
+    return "%s %s %s" % (operand_modes.get((mode >> 3) & 0x07, "?"),
+                         middle_modes[mode & 0xc0],
+                         operand_modes.get(mode & 0x07, "?"))
+
+def name(opcode):
+
+    if opcode < len(opcodes.instructions):
+        return opcodes.instructions[opcode].__name__
+    else:
+        return hex(opcode)
+
+def ranked(counts):
+
+    """Returns a list of (key, count) pairs from the dictionary, sorted with
+    the most frequent first."""
+    
+    return sorted(counts.items(), key = lambda item: (-item[1], item[0]))
+
+
+class Statistics:
+
+    """Counts opcodes, address modes and sequences of opcodes up to length n
+    over a collection of modules.
+    
+    The opcodes and address modes of each module are counted as whole
+    arrays. If NumPy is available, it is used to count them and to find the
+    sequences of opcodes, which are encoded as integers with one byte for
+    each opcode. Otherwise, strings of opcodes are counted using the string
+    methods, and the combinations of opcodes and address modes and the
+    sequences of opcodes are each passed to a Counter in a single call for
+    each module. This is not vectorised, since the Counter still handles
+    each instruction in turn. Sequences do not span modules."""
+    
+    def __init__(self, n = 4):
+    
+        self.n = n
+        self.modules = 0
+        self.instructions = 0
+        
+        # Counts of opcodes and of combinations of opcodes and address modes,
+        # indexed by opcode and by (opcode << 8) | mode.
+        self.opcode_counts = [0] * 256
+        self.mode_counts = [0] * 65536
+        
+        # Sequences of opcodes for each length from 2 to n.
+        if numpy is not None:
+            self.sequences = dict((length, []) for length in range(2, n + 1))
+        else:
+            self.sequences = dict((length, Counter())
+                                  for length in range(2, n + 1))
+    
+    def add(self, d):
+    
+        """Adds the opcodes and address modes of the module, d."""
+        
+        self.add_columns(*columns(d))
+    
+    def add_columns(self, ops, modes):
+    
+        self.modules += 1
+        self.instructions += len(ops)
+        
+        if numpy is not None:
+            self.count_numpy(ops, modes)
+        else:
+            self.count_arrays(ops, modes)
+    
+    def count_numpy(self, ops, modes):
+    
+        ops = numpy.frombuffer(ops, dtype = numpy.uint8).astype(numpy.int64)
+        modes = numpy.frombuffer(modes, dtype = numpy.uint8)
+        
+        counts = numpy.bincount(ops, minlength = 256)
+        for opcode in numpy.flatnonzero(counts):
+            self.opcode_counts[opcode] += int(counts[opcode])
+        
+        counts = numpy.bincount((ops << 8) | modes, minlength = 65536)
+        for key in numpy.flatnonzero(counts):
+            self.mode_counts[key] += int(counts[key])
+        
+        # Encode each sequence as an integer, with the first opcode in the
+        # most significant byte, by shifting and combining slices.
+        for length in self.sequences:
+            if len(ops) < length:
+                continue
+            codes = ops[:len(ops) - length + 1].copy()
+            for i in range(1, length):
+                codes = (codes << 8) | ops[i:len(ops) - length + 1 + i]
+            self.sequences[length].append(codes)
+    
+    def count_arrays(self, ops, modes):
+    
+        s = ops.tostring()
+        for c in set(s):
+            self.opcode_counts[ord(c)] += s.count(c)
+        
+        pairs = Counter(zip(ops, modes))
+        for (opcode, mode), count in pairs.items():
+            self.mode_counts[(opcode << 8) | mode] += count
+        
+        for length, counter in self.sequences.items():
+            counter.update(zip(*[ops[i:] for i in range(length)]))
+    
+    def opcodes(self):
+    
+        """Returns a list of (name, count) pairs for the opcodes, sorted with
+        the most frequent first."""
+        
+        return ranked(dict((name(opcode), count) for opcode, count
+                           in enumerate(self.opcode_counts) if count))
+    
+    def address_modes(self):
+    
+        """Returns a list of (name, mode, count) tuples for the combinations of
+        opcodes and address modes, sorted with the most frequent first."""
+        
+        counts = dict(((name(key >> 8), describe_mode(key & 0xff)), count)
+                      for key, count in enumerate(self.mode_counts) if count)
+        
+        return [(key[0], key[1], count) for key, count in ranked(counts)]
+    
+    def ngrams(self, length):
+    
+        """Returns a list of (names, count) pairs for the sequences of opcodes
+        of the given length, where names is a tuple of instruction names,
+        sorted with the most frequent first."""
+        
+        if numpy is not None:
+            if not self.sequences[length]:
+                return []
+            codes, counts = numpy.unique(
+                numpy.concatenate(self.sequences[length]), return_counts = True)
+            found = {}
+            for code, count in zip(codes.tolist(), counts.tolist()):
+                found[tuple(name((code >> (8 * i)) & 0xff)
+                            for i in range(length - 1, -1, -1))] = count
+        else:
+            found = dict((tuple(map(name, key)), count)
+                         for key, count in self.sequences[length].items())
+        
+        return ranked(found)
+    
+    def list(self, limit = 20):
+    
+        print "%i modules, %i instructions" % (self.modules, self.instructions)
+        print
+        
+        print "Opcodes"
+        for opcode, count in self.opcodes()[:limit]:
+            print "%8i  %s" % (count, opcode)
+        print
+        
+        print "Address modes (source middle destination)"
+        for opcode, mode, count in self.address_modes()[:limit]:
+            print "%8i  %-8s %s" % (count, opcode, mode)
+        
+        for length in sorted(self.sequences):
+            print
+            print "Sequences of %i opcodes" % length
+            for names, count in self.ngrams(length)[:limit]:
+                print "%8i  %s" % (count, " ".join(names))
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    n = 4
+    limit = 20
+    
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option == "-n" and args:
+            n = int(args.pop(0))
+        elif option == "-l" and args:
+            limit = int(args.pop(0))
+        else:
+            args = []
+    
+    if not args:
+        sys.stderr.write("Usage: %s [-n <length>] [-l <limit>] "
+                         "<file, directory or pack file> ...\n" % sys.argv[0])
+        sys.exit(1)
+    
+    stats = Statistics(n)
+    
+    packs = [path for path in args if path.endswith(".pack")]
+    paths = [path for path in args if not path.endswith(".pack")]
+    
+    for path in packs:
+        for d in pack.Pack(path):
+            stats.add(d)
+    
+    if paths:
+        for file_name, result, error in Pipeline(paths, columns):
+            if error:
+                sys.stderr.write("%s: %s\n" % (file_name, error))
+            else:
+                stats.add_columns(*result)
+    
+    stats.list(limit)
+    
+    sys.exit()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+
+import dis
+import opcodes
+
+# Instructions whose source operand is an immediate type number.
+source_types = (opcodes.frame, opcodes.new, opcodes.newz)
+
+# Instructions whose middle operand is an immediate type number.
+middle_types = (opcodes.newa, opcodes.newaz, opcodes.movmp)
+
+
+def mp_offset(operand):
+
+    """Returns the offset in the module data referred to by the operand, or
+    None if it does not refer to the module data."""
+    
+    if isinstance(operand, opcodes.LongOffsetMP) or \
+       isinstance(operand, opcodes.ShortOffsetMP):
+        return operand.value
+    elif isinstance(operand, opcodes.DoubleShortOffsetMP):
+        return operand.offset0
+    
+    return None
+
+def with_mp_offset(operand, offset):
+
+    """Returns a copy of the operand that refers to the given offset in the
+    module data."""
+    
+    if isinstance(operand, opcodes.DoubleShortOffsetMP):
+        return operand.__class__(operand.offset1, offset, operand.annotation)
+    else:
+        return operand.__class__(offset, operand.annotation)
+
+def type_operands(ins):
+
+    """Returns a list of the names of the operands of the instruction that
+    contain immediate type numbers."""
+    
+    names = []
+    
+    if isinstance(ins, source_types) and \
+       isinstance(ins.source, opcodes.Immediate):
+        names.append("source")
+    
+    if isinstance(ins, middle_types) and \
+       isinstance(ins.middle, opcodes.Immediate):
+        names.append("middle")
+    
+    return names
+
+def nested_arrays(arrays):
+
+    """Returns a list of the arrays in the list, arrays, and the arrays
+    nested inside them."""
+    
+    found = []
+    pending = list(arrays)
+    
+    while pending:
+        array = pending.pop(0)
+        found.append(array)
+        pending += [item for item in array.items
+                    if isinstance(item, dis.Array)]
+    
+    return found
+
+
+class Stripper:
+
+    """Removes the types, module data items and LDT sequences that are not
+    referred to by a module, renumbering the remaining types and LDT
+    sequences and moving the remaining module data to fill the space that
+    was freed.
+    
+    Module data is only removed in aligned 8-byte units so that the alignment
+    of the remaining data is preserved. If the address of module data is taken
+    with an lea instruction, or if the code refers to a jump table that cannot
+    be decoded or to a block of module data whose size is not known, or if
+    the module data contains arrays, the module data is left unchanged."""
+    
+    def __init__(self, d):
+    
+        self.d = d
+        self.removed = {"types": 0, "data": 0, "data_bytes": 0, "ldt": 0}
+    
+    def strip(self):
+    
+        self.strip_types()
+        self.strip_ldt()
+        self.strip_data()
+        
+        return self.removed
+    
+    def strip_types(self):
+    
+        d = self.d
+        used = set([d.entry_type])
+        
+        # The module data is described by the first type.
+        if d.types:
+            used.add(0)
+        
+        for link in d.link:
+            used.add(link.desc_number)
+        
+        for item in d.data.values():
+            if item.type_ is not None:
+                used.add(d.types.index(item.type_))
+        
+        arrays = nested_arrays(getattr(d, "arrays", []))
+        for array in arrays:
+            if array.type_index is not None:
+                used.add(array.type_index)
+        
+        if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+            for exception in d.exceptions:
+                used.add(exception.desc)
+        
+        for ins in d.code:
+            for name in type_operands(ins):
+                used.add(getattr(ins, name).value)
+        
+        numbers = {}
+        types = []
+        
+        for i, type_ in enumerate(d.types):
+            if i in used:
+                numbers[i] = len(types)
+                type_.desc_number = len(types)
+                types.append(type_)
+        
+        self.removed["types"] = len(d.types) - len(types)
+        d.types = types
+        
+        # Type numbers that do not refer to types, such as the entry type of
+        # modules without an entry point, which is -1, are left unchanged.
+        def number(i):
+            return numbers.get(i, i)
+        
+        d.entry_type = number(d.entry_type)
+        
+        for link in d.link:
+            link.desc_number = number(link.desc_number)
+        
+        for array in arrays:
+            if array.type_index is not None:
+                array.type_index = number(array.type_index)
+        
+        if d.runtime_flag.contains(dis.RuntimeFlag.HASEXCEPT):
+            for exception in d.exceptions:
+                exception.desc = number(exception.desc)
+        
+        for ins in d.code:
+            for name in type_operands(ins):
+                operand = getattr(ins, name)
+                setattr(ins, name, operand.__class__(number(operand.value),
+                                                     operand.annotation))
+    
+    def strip_ldt(self):
+    
+        d = self.d
+        
+        if not d.runtime_flag.contains(dis.RuntimeFlag.HASLDT):
+            return
+        
+        used = set()
+        
+        for ins in d.code:
+            if isinstance(ins, opcodes.load):
+                if not isinstance(ins.middle, opcodes.Immediate):
+                    # The sequence used is only known at run-time.
+                    return
+                used.add(ins.middle.value)
+        
+        # Loads may refer to sequences that the module does not contain,
+        # which cannot be renumbered.
+        if [i for i in used if not 0 <= i < len(d.ldt)]:
+            return
+        
+        numbers = {}
+        ldt = []
+        
+        for i, sequence in enumerate(d.ldt):
+            if i in used:
+                numbers[i] = len(ldt)
+                ldt.append(sequence)
+        
+        self.removed["ldt"] = len(d.ldt) - len(ldt)
+        
+        # The LDT section starts with the number of sequences it contains.
+        if d.initialised_globals == len(d.ldt):
+            d.initialised_globals = len(ldt)
+        
+        d.ldt = ldt
+        
+        for ins in d.code:
+            if isinstance(ins, opcodes.load):
+                ins.middle = ins.middle.__class__(numbers[ins.middle.value],
+                                                  ins.middle.annotation)
+    
+    def referenced_ranges(self):
+    
+        """Returns a list of (start, end) tuples describing the ranges of
+        module data that are referred to by the code, or None if the code
+        takes the address of module data or refers to a range whose size is
+        not known."""
+        
+        # The cases module is imported here because it depends on this one.
+        import cases
+        
+        d = self.d
+        ranges = []
+        tables = cases.tables(d)
+        
+        for pc, ins in enumerate(d.code):
+        
+            if isinstance(ins, opcodes.lea) and mp_offset(ins.source) is not None:
+                return None
+            
+            for operand in ins.source, ins.middle, ins.destination:
+                offset = mp_offset(operand)
+                if offset is not None:
+                    ranges.append((offset, offset + 4))
+            
+            # Case instructions refer to jump tables, which include the
+            # pointers to the strings used by casec tables.
+            if ins.__class__ in cases.layouts and \
+               mp_offset(ins.destination) is not None:
+                if pc not in tables:
+                    return None
+                table = tables[pc]
+                ranges.append((table.offset, table.offset + table.size()))
+            
+            # Block moves refer to more than one word of module data.
+            if isinstance(ins, opcodes.movm) or isinstance(ins, opcodes.movmp):
+                for operand in ins.source, ins.destination:
+                    # Indirect operands only refer to the word holding a
+                    # pointer to the block.
+                    offset = mp_offset(operand)
+                    if offset is None or \
+                       isinstance(operand, opcodes.DoubleShortOffsetMP):
+                        continue
+                    elif not isinstance(ins.middle, opcodes.Immediate):
+                        return None
+                    elif isinstance(ins, opcodes.movm):
+                        size = ins.middle.value
+                    else:
+                        size = d.types[ins.middle.value].size
+                    ranges.append((offset, offset + size))
+        
+        return ranges
+    
+    def strip_data(self):
+    
+        d = self.d
+        
+        if not d.data_size:
+            return
+        
+        # Items in arrays are not stored in the module data itself, and the
+        # pointers to arrays are not described by data items.
+        if getattr(d, "arrays", []):
+            return
+        
+        for item in d.data.values():
+            if item.base != 0:
+                return
+        
+        ranges = self.referenced_ranges()
+        if ranges is None:
+            return
+        
+        words = set()
+        for start, end in ranges:
+            words.update(xrange(start / 4, (end + 3) / 4))
+        
+        # Remove items that are not referenced.
+        data = {}
+        for address, item in d.data.items():
+            for word in xrange(address / 4, (address + item.size() + 3) / 4):
+                if word in words:
+                    data[address] = item
+                    break
+        
+        self.removed["data"] = len(d.data) - len(data)
+        
+        if hasattr(d, "data_items"):
+            kept = set(map(id, data.values()))
+            d.data_items = [item for item in d.data_items if id(item) in kept]
+        
+        for address, item in data.items():
+            words.update(xrange(address / 4, (address + item.size() + 3) / 4))
+        
+        # The module data is described by the first type. If it does not
+        # match the size of the module data then the data cannot be moved.
+        if not d.types or d.types[0].size != d.data_size:
+            d.data = data
+            return
+        
+        mp_type = d.types[0]
+        
+        # Find the 8-byte units that are used and map each one to its new
+        # position.
+        units = (d.data_size + 7) / 8
+        shifts = []
+        shift = 0
+        
+        for unit in xrange(units):
+            shifts.append(shift)
+            if unit * 2 not in words and unit * 2 + 1 not in words:
+                shift += 8
+        
+        def move(offset):
+            unit = offset / 8
+            if 0 <= unit < units:
+                return offset - shifts[unit]
+            return offset - shift
+        
+        d.data = {}
+        for address, item in data.items():
+            item.offset = move(item.offset)
+            d.data[move(address)] = item
+        
+        for ins in d.code:
+            for name in "source", "middle", "destination":
+                operand = getattr(ins, name)
+                offset = mp_offset(operand)
+                if offset is not None:
+                    setattr(ins, name, with_mp_offset(operand, move(offset)))
+        
+        # Keep only the pointers in words that are still used.
+        pointers = [move(offset) for offset in mp_type.pointers()
+                    if offset / 4 in words]
+        
+        d.data_size -= shift
+        mp_type.size = d.data_size
+        mp_type.set_pointers(pointers)
+        
+        self.removed["data_bytes"] = shift
+
+
+def strip(d):
+
+    """Removes unused types, module data and LDT sequences from the module,
+    d, returning a dictionary containing the number of each removed."""
+    
+    return Stripper(d).strip()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage: %s <input file> <output file>\n" % sys.argv[0])
+        sys.exit(1)
+    
+    d = dis.Dis(sys.argv[1])
+    removed = strip(d)
+    d.write(open(sys.argv[2], "wb"))
+    
+    print "Removed %(types)i types, %(data)i data items (%(data_bytes)i " \
+          "bytes) and %(ldt)i LDT sequences." % removed
+    
+    sys.exit()
@@ -95,17 +95,26 @@ def write_B(f, value):
 def write_OP(f, value):
 
     if -64 <= value <= 63:
-        f.write(pack(">B", value))
+        f.write(pack(">B", value & 0x7f))
     
     elif -8192 <= value <= 8191:
         f.write(pack(">H", (value & 0x3fff) | 0x8000))
     
-    elif -0x20000000 <= value <= 0x1f000000:
+    elif -0x20000000 <= value <= 0x1fffffff:
         f.write(pack(">I", (value & 0x3fffffff) | 0xc0000000))
     
     else:
         raise ValueError("Cannot encode %i as an OP." % value)
 
+def write_long_OP(f, value):
+
+    # Always use the four byte encoding so that the value can be replaced
+    # later without changing the size of the file.
+    if -0x20000000 <= value <= 0x1fffffff:
+        f.write(pack(">I", (value & 0x3fffffff) | 0xc0000000))
+    else:
+        raise ValueError("Cannot encode %i as an OP." % value)
+
 def write_W(f, value):
     # 32-bit word
     f.write(pack(">i", value))
@@ -152,6 +161,13 @@ def hash_signature(function_signature):
 
 def dbl_repr(obj):
 
+    # Strings are enclosed in double quotes, escaping the quotes they contain
+    # as well as the characters that Python escapes, so that the assembler
+    # can read them again. Single quotes are not escaped.
+    if isinstance(obj, str):
+        text = obj.encode("string_escape").replace("\\'", "'")
+        return '"%s"' % text.replace('"', '\\"')
+    
     return repr(obj).replace("'", '"')
 
 # Currently unused:
@@ -0,0 +1,237 @@
+"""
+Copyright (C) 2017 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, time
+from cStringIO import StringIO
+
+import archives, dis
+from pipeline import find_files, read_file
+
+# The sections that can be reused, the header fields that must be unchanged
+# for them to be decoded in the same way, and the attributes that hold them.
+sections = {
+    "code": ("code_size", ("code",)),
+    "types": ("type_size", ("types",)),
+    "data": (None, ("data", "data_items", "arrays")),
+    "link": ("link_size", ("link",)),
+    "ldt": (None, ("ldt", "initialised_globals")),
+    "exceptions": (None, ("exceptions",))
+    }
+
+
+class CachedDis(dis.Dis):
+
+    """Reads a module from a string, reusing the objects decoded from the
+    sections of a previous version of the module, given as previous, where
+    the bytes of a section are unchanged.
+    
+    The ranges of bytes occupied by each section are stored as (start, end)
+    tuples in the sections dictionary, and the names of the sections that
+    were reused are stored in the reused set. Reused objects are shared with
+    the previous version, so they should not be modified."""
+    
+    def __init__(self, contents, previous = None):
+    
+        self.contents = contents
+        self.previous = previous
+        self.sections = {}
+        self.reused = set()
+    
+    def read_section(self, name, method, f):
+    
+        start = f.tell()
+        previous = self.previous
+        
+        if previous is not None and name in previous.sections and \
+           self.can_reuse(name):
+        
+            old_start, old_end = previous.sections[name]
+            end = start + old_end - old_start
+            
+            if self.contents[start:end] == \
+               previous.contents[old_start:old_end]:
+            
+                for attribute in sections[name][1]:
+                    setattr(self, attribute, getattr(previous, attribute))
+                
+                f.seek(end)
+                self.sections[name] = (start, end)
+                self.reused.add(name)
+                return
+        
+        method(self, f)
+        self.sections[name] = (start, f.tell())
+    
+    def can_reuse(self, name):
+    
+        # Data items refer to the types, so they can only be reused if the
+        # types were.
+        if name == "data":
+            return "types" in self.reused
+        
+        field = sections[name][0]
+        return field is None or \
+               getattr(self, field) == getattr(self.previous, field)
+    
+    def read_code(self, f):
+        self.read_section("code", dis.Dis.read_code, f)
+    
+    def read_types(self, f):
+        self.read_section("types", dis.Dis.read_types, f)
+    
+    def read_data(self, f):
+        self.read_section("data", dis.Dis.read_data, f)
+    
+    def read_link(self, f):
+        self.read_section("link", dis.Dis.read_link, f)
+    
+    def read_ldt(self, f):
+        self.read_section("ldt", dis.Dis.read_ldt, f)
+    
+    def read_exceptions(self, f):
+        self.read_section("exceptions", dis.Dis.read_exceptions, f)
+
+
+def decode(name, contents, previous = None):
+
+    """Decodes the module contained in the string, contents, reusing the
+    unchanged sections of the previous version of the module, if given,
+    and returns a CachedDis object."""
+    
+    d = CachedDis(contents, previous)
+    d.read(StringIO(contents), name)
+    
+    # Do not keep older versions of the module.
+    d.previous = None
+    return d
+
+
+class Watcher:
+
+    """Watches the files given in paths, and the files with names matching
+    the pattern in any directories given, decoding modules when they are
+    added or changed. Archives are not watched.
+    
+    Changes are found by polling the modification times and sizes of the
+    files. Each changed module is decoded again, reusing the sections that
+    have not changed, and passed to the process function, if given. The
+    modules and the results of the process function are kept in the modules
+    and results dictionaries, and the errors that occurred when reading
+    modules are kept in the errors dictionary, all indexed by file name."""
+    
+    def __init__(self, paths, process = None, pattern = "*.dis"):
+    
+        self.paths = paths
+        self.process = process
+        self.pattern = pattern
+        
+        self.stats = {}
+        self.modules = {}
+        self.results = {}
+        self.errors = {}
+    
+    def scan(self):
+    
+        """Returns a dictionary mapping the names of the watched files to
+        their modification times and sizes."""
+        
+        found = {}
+        
+        for name in find_files(self.paths, self.pattern):
+            if archives.is_archive(name):
+                continue
+            try:
+                s = os.stat(name)
+            except OSError:
+                continue
+            found[name] = (s.st_mtime, s.st_size)
+        
+        return found
+    
+    def poll(self):
+    
+        """Checks the files for changes, decoding the modules that were added
+        or changed and forgetting those that were removed. Returns lists of
+        the names of the files whose modules were decoded again or could not
+        be read, and of the files that were removed. Files that were touched
+        without changing their contents are not included."""
+        
+        current = self.scan()
+        
+        touched = sorted(name for name, stat in current.items()
+                         if self.stats.get(name) != stat)
+        removed = sorted(name for name in self.stats if name not in current)
+        
+        for name in removed:
+            self.forget(name)
+        
+        changed = [name for name in touched if self.update(name)]
+        
+        self.stats = current
+        return changed, removed
+    
+    def update(self, name):
+    
+        """Decodes the module in the named file again if its contents have
+        changed, returning True if it was decoded or an error occurred."""
+        
+        previous = self.modules.get(name)
+        
+        try:
+            contents = read_file(name)
+        except Exception, error:
+            self.forget(name)
+            self.errors[name] = error
+            return True
+        
+        # Keep the module and its results if the file was only touched.
+        if previous is not None and contents == previous.contents:
+            return False
+        
+        self.forget(name)
+        
+        try:
+            d = decode(name, contents, previous)
+            if self.process:
+                self.results[name] = self.process(d)
+            else:
+                self.results[name] = d
+            self.modules[name] = d
+        
+        except Exception, error:
+            self.errors[name] = error
+        
+        return True
+    
+    def forget(self, name):
+    
+        for table in self.modules, self.results, self.errors:
+            table.pop(name, None)
+    
+    def watch(self, interval = 0.5):
+    
+        """Polls the files every interval seconds, yielding lists of the names
+        of the files that were changed and removed whenever there are any,
+        starting with all the files found when first called."""
+        
+        while True:
+        
+            changed, removed = self.poll()
+            if changed or removed:
+                yield changed, removed
+            
+            time.sleep(interval)